@@ -12,7 +12,7 @@ router = APIRouter(
 
 
 @router.post("/request/{imdb_id}")
-async def request(request: Request, imdb_id: str) -> Dict[str, Any]:
+def request(request: Request, imdb_id: str) -> Dict[str, Any]:
     try:
         new_item = MediaItem({"imdb_id": imdb_id, "requested_by": "manually"})
         request.app.program.add_to_queue(new_item)
@@ -23,7 +23,7 @@ async def request(request: Request, imdb_id: str) -> Dict[str, Any]:
     return {"success": True, "message": f"Added {imdb_id} to queue"}
 
 @router.delete("/symlink/{_id}")
-async def remove_symlink(request: Request, _id: int) -> Dict[str, Any]:
+def remove_symlink(request: Request, _id: int) -> Dict[str, Any]:
     try:
         symlinker: Symlinker = request.app.program.services[Symlinker]
         if symlinker.delete_item_symlinks(_id):
@@ -4,12 +4,14 @@ import program.db.db_functions as DB
 import requests
 from fastapi import APIRouter, HTTPException, Request
 from program.content.trakt import TraktContent
+from program.downloaders import Downloader
 from program.db.db import db
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.media.state import States
 from program.scrapers import Scraping
 from program.settings.manager import settings_manager
 from sqlalchemy import func, select
+from utils.request import cache_stats
 
 router = APIRouter(
     responses={404: {"description": "Not found"}},
@@ -17,7 +19,7 @@ router = APIRouter(
 
 
 @router.get("/")
-async def root():
+def root():
     return {
         "success": True,
         "message": "Riven is running!",
@@ -26,7 +28,7 @@ async def root():
 
 
 @router.get("/health")
-async def health(request: Request):
+def health(request: Request):
     return {
         "success": True,
         "message": request.app.program.initialized,
@@ -34,7 +36,7 @@ async def health(request: Request):
 
 
 @router.get("/rd")
-async def get_rd_user():
+def get_rd_user():
     api_key = settings_manager.settings.downloaders.real_debrid.api_key
     headers = {"Authorization": f"Bearer {api_key}"}
 
@@ -57,7 +59,7 @@ async def get_rd_user():
 
 
 @router.get("/torbox")
-async def get_torbox_user():
+def get_torbox_user():
     api_key = settings_manager.settings.downloaders.torbox.api_key
     headers = {"Authorization": f"Bearer {api_key}"}
     response = requests.get(
@@ -67,7 +69,7 @@ async def get_torbox_user():
 
 
 @router.get("/services")
-async def get_services(request: Request):
+def get_services(request: Request):
     data = {}
     if hasattr(request.app.program, "services"):
         for service in request.app.program.services.values():
@@ -80,7 +82,7 @@ async def get_services(request: Request):
 
 
 @router.get("/trakt/oauth/initiate")
-async def initiate_trakt_oauth(request: Request):
+def initiate_trakt_oauth(request: Request):
     trakt = request.app.program.services.get(TraktContent)
     if trakt is None:
         raise HTTPException(status_code=404, detail="Trakt service not found")
@@ -89,7 +91,7 @@ async def initiate_trakt_oauth(request: Request):
 
 
 @router.get("/trakt/oauth/callback")
-async def trakt_oauth_callback(code: str, request: Request):
+def trakt_oauth_callback(code: str, request: Request):
     trakt = request.app.program.services.get(TraktContent)
     if trakt is None:
         raise HTTPException(status_code=404, detail="Trakt service not found")
@@ -101,7 +103,7 @@ async def trakt_oauth_callback(code: str, request: Request):
 
 
 @router.get("/stats")
-async def get_stats(_: Request):
+def get_stats(_: Request):
     payload = {}
     with db.Session() as session:
 
@@ -134,4 +136,25 @@ async def get_stats(_: Request):
         payload["incomplete_retries"] = incomplete_retries
         payload["states"] = states
 
-        return {"success": True, "data": payload}
\ No newline at end of file
+        return {"success": True, "data": payload}
+
+
+@router.get("/downloaders/stats")
+def get_downloader_stats(request: Request):
+    downloader = request.app.program.services.get(Downloader)
+    if not downloader or not downloader.race:
+        raise HTTPException(status_code=404, detail="Multi provider downloading is not enabled")
+    return {"success": True, "data": downloader.race.get_stats()}
+
+
+@router.get("/symlinks/stats")
+def get_symlink_stats(request: Request):
+    scanner = getattr(request.app.program, "symlink_scanner", None)
+    if not scanner:
+        raise HTTPException(status_code=404, detail="Symlink integrity scanner is not running")
+    return {"success": True, "data": scanner.stats()}
+
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    return {"success": True, "data": cache_stats()}
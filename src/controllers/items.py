@@ -3,14 +3,15 @@ from typing import Optional
 
 import Levenshtein
 import program.db.db_functions as DB
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
 from program.db.db import db
+from program.db.search import apply_search
 from program.media.item import MediaItem
 from program.media.state import States
 from sqlalchemy import func, select
 from program.types import Event
+from utils.jobs import jobs
 from utils.logger import logger
-from sqlalchemy.orm import joinedload
 
 router = APIRouter(
     prefix="/items",
@@ -18,6 +19,9 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# Requests for more items than this are run as background jobs
+BACKGROUND_JOB_THRESHOLD = 100
+
 def handle_ids(ids: str) -> list[int]:
     ids = [int(id) for id in ids.split(",")] if "," in ids else [int(ids)]
     if not ids:
@@ -25,7 +29,7 @@ def handle_ids(ids: str) -> list[int]:
     return ids
 
 @router.get("/states")
-async def get_states():
+def get_states():
     return {
         "success": True,
         "states": [state for state in States],
@@ -36,7 +40,7 @@ async def get_states():
     summary="Retrieve Media Items",
     description="Fetch media items with optional filters and pagination",
 )
-async def get_items(
+def get_items(
     _: Request,
     limit: Optional[int] = 50,
     page: Optional[int] = 1,
@@ -59,10 +63,7 @@ async def get_items(
         if search_lower.startswith("tt"):
             query = query.where(MediaItem.imdb_id == search_lower)
         else:
-            query = query.where(
-                (func.lower(MediaItem.title).like(f"%{search_lower}%")) |
-                (func.lower(MediaItem.imdb_id).like(f"%{search_lower}%"))
-            )
+            query = apply_search(query, search_lower)
 
     if state:
         filter_lower = state.lower()
@@ -124,7 +125,7 @@ async def get_items(
         summary="Add Media Items",
         description="Add media items with bases on imdb IDs",
 )
-async def add_items(
+def add_items(
     request: Request, imdb_ids: str = None
 ):
 
@@ -149,64 +150,79 @@ async def add_items(
 
     return {"success": True, "message": f"Added {len(valid_ids)} item(s) to the queue"}
 
+def _run_bulk(name: str, ids: list[int], fn, background_tasks: BackgroundTasks, background: Optional[bool]) -> Optional[str]:
+    """Run `fn(progress)` now, or as a background job when asked to or when there are many ids."""
+    job = jobs.create(name, total=len(ids))
+    if background or (background is None and len(ids) > BACKGROUND_JOB_THRESHOLD):
+        background_tasks.add_task(jobs.run, job, fn)
+        return job.id
+    jobs.run(job, fn)
+    if job.error:
+        raise HTTPException(status_code=500, detail=f"Failed to {name} items: {job.error}")
+    return None
+
+def _bulk_response(job_id: Optional[str], message: str) -> dict:
+    if job_id:
+        return {"success": True, "message": f"Started job {job_id}", "job_id": job_id}
+    return {"success": True, "message": message}
+
 @router.post(
         "/reset",
         summary="Reset Media Items",
         description="Reset media items with bases on item IDs",
 )
-async def reset_items(
-    request: Request, ids: str
+def reset_items(
+    request: Request, ids: str, background_tasks: BackgroundTasks, background: Optional[bool] = None
 ):
     ids = handle_ids(ids)
-    with db.Session() as session:
-        items = []
-        for id in ids:
-            item = session.execute(select(MediaItem).where(MediaItem._id == id).options(joinedload("*"))).unique().scalar_one()
-            items.append(item)
-        for item in items:
-            if item.type == "show":
-                for season in item.seasons:
-                    for episode in season.episodes:
-                        episode.reset()
-                    season.reset()
-            elif item.type == "season":
-                for episode in item.episodes:
-                    episode.reset()
-            item.reset()
-
-        session.commit()
-    return {"success": True, "message": f"Reset items with id {ids}"}
+    job_id = _run_bulk("reset", ids, lambda progress: {"reset": DB._reset_items_in_db(ids, progress)}, background_tasks, background)
+    return _bulk_response(job_id, f"Reset items with id {ids}")
 
 @router.post(
         "/retry",
         summary="Retry Media Items",
         description="Retry media items with bases on item IDs",
 )
-async def retry_items(
-    request: Request, ids: str
+def retry_items(
+    request: Request, ids: str, background_tasks: BackgroundTasks, background: Optional[bool] = None
 ):
     ids = handle_ids(ids)
-    with db.Session() as session:
-        items = []
-        for id in ids:
-            items.append(session.execute(select(MediaItem).where(MediaItem._id == id)).unique().scalar_one())
-        for item in items:
-            request.app.program._remove_from_running_events(item)
-            request.app.program.add_to_queue(item)
+    program = request.app.program
 
-    return {"success": True, "message": f"Retried items with id {ids}"}
+    def retry(progress):
+        queued = 0
+        for chunk in DB._chunked(ids):
+            with db.Session() as session:
+                items = DB._get_items_from_db(session, chunk)
+                program._remove_many_from_running_events(items)
+                queued += program.add_many_to_queue(items)
+            progress(len(chunk))
+        return {"queued": queued}
+
+    job_id = _run_bulk("retry", ids, retry, background_tasks, background)
+    return _bulk_response(job_id, f"Retried items with id {ids}")
 
 @router.delete(
         "",
         summary="Remove Media Items",
         description="Remove media items with bases on item IDs",)
-async def remove_item(
-    _: Request, ids: str
+def remove_item(
+    _: Request, ids: str, background_tasks: BackgroundTasks, background: Optional[bool] = None
 ):
     ids = handle_ids(ids)
-    for id in ids:
-        DB._remove_item_from_db(id)
-    return {"success": True, "message": f"Removed item with id {id}"}
+    job_id = _run_bulk("remove", ids, lambda progress: {"removed": DB._remove_items_from_db(ids, progress)}, background_tasks, background)
+    return _bulk_response(job_id, f"Removed items with id {ids}")
+
+@router.get(
+        "/jobs/{job_id}",
+        summary="Get Bulk Job",
+        description="Get the progress of a bulk reset, retry or remove job",
+)
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, "data": job.to_dict()}
 
 # These require downloaders to be refactored
 
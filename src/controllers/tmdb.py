@@ -1,9 +1,12 @@
+import os
 from enum import Enum
-from typing import Annotated
+from typing import Annotated, Any, Callable
 from urllib.parse import urlencode
 
 from fastapi import APIRouter, Depends
 from program.indexers.tmdb import tmdb
+from utils import data_dir_path
+from utils.cache import Cache
 
 router = APIRouter(
     prefix="/tmdb",
@@ -12,6 +15,29 @@ router = APIRouter(
 )
 
 
+# Seconds a response is fresh for, it may then be served stale for as long again while it refreshes
+CACHE_TTLS = {
+    "trending": 60 * 60,
+    "list": 60 * 60,
+    "details": 24 * 60 * 60,
+    "search": 15 * 60,
+    "external_id": 7 * 24 * 60 * 60,
+}
+
+tmdb_cache = Cache(
+    "TMDB",
+    maxsize=2048,
+    disk_path=data_dir_path / "cache" / "tmdb.db" if os.getenv("TMDB_CACHE_DISK", "false").lower() in ["true", "1"] else None,
+)
+
+
+def cached(kind: str, fn: Callable[..., Any], **kwargs) -> Any:
+    """Call a TMDB method through the cache, identical concurrent calls share one upstream request."""
+    key = (fn.__name__, *sorted(kwargs.items()))
+    ttl = CACHE_TTLS[kind]
+    return tmdb_cache.get_or_load(key, lambda: fn(**kwargs), ttl=ttl, stale_ttl=ttl)
+
+
 def dict_to_query_string(params: dict):
     filtered_params = {k: v for k, v in params.items() if v is not None}
     return urlencode(filtered_params)
@@ -140,12 +166,14 @@ class TVSearchParams:
 
 
 @router.get("/trending/{type}/{window}")
-async def get_trending(
+def get_trending(
     params: Annotated[TrendingParams, Depends()],
     type: TrendingType,
     window: TrendingWindow,
 ):
-    trending = tmdb.getTrending(
+    trending = cached(
+        "trending",
+        tmdb.getTrending,
         params=dict_to_query_string(params.__dict__),
         type=type.value,
         window=window.value,
@@ -163,8 +191,8 @@ async def get_trending(
 
 
 @router.get("/movie/now_playing")
-async def get_movies_now_playing(params: Annotated[CommonListParams, Depends()]):
-    movies = tmdb.getMoviesNowPlaying(params=dict_to_query_string(params.__dict__))
+def get_movies_now_playing(params: Annotated[CommonListParams, Depends()]):
+    movies = cached("list", tmdb.getMoviesNowPlaying, params=dict_to_query_string(params.__dict__))
     if movies:
         return {
             "success": True,
@@ -178,8 +206,8 @@ async def get_movies_now_playing(params: Annotated[CommonListParams, Depends()])
 
 
 @router.get("/movie/popular")
-async def get_movies_popular(params: Annotated[CommonListParams, Depends()]):
-    movies = tmdb.getMoviesPopular(params=dict_to_query_string(params.__dict__))
+def get_movies_popular(params: Annotated[CommonListParams, Depends()]):
+    movies = cached("list", tmdb.getMoviesPopular, params=dict_to_query_string(params.__dict__))
     if movies:
         return {
             "success": True,
@@ -193,8 +221,8 @@ async def get_movies_popular(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/movie/top_rated")
-async def get_movies_top_rated(params: Annotated[CommonListParams, Depends()]):
-    movies = tmdb.getMoviesTopRated(params=dict_to_query_string(params.__dict__))
+def get_movies_top_rated(params: Annotated[CommonListParams, Depends()]):
+    movies = cached("list", tmdb.getMoviesTopRated, params=dict_to_query_string(params.__dict__))
     if movies:
         return {
             "success": True,
@@ -208,8 +236,8 @@ async def get_movies_top_rated(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/movie/upcoming")
-async def get_movies_upcoming(params: Annotated[CommonListParams, Depends()]):
-    movies = tmdb.getMoviesUpcoming(params=dict_to_query_string(params.__dict__))
+def get_movies_upcoming(params: Annotated[CommonListParams, Depends()]):
+    movies = cached("list", tmdb.getMoviesUpcoming, params=dict_to_query_string(params.__dict__))
     if movies:
         return {
             "success": True,
@@ -226,11 +254,13 @@ async def get_movies_upcoming(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/movie/{movie_id}")
-async def get_movie_details(
+def get_movie_details(
     movie_id: str,
     params: Annotated[DetailsParams, Depends()],
 ):
-    data = tmdb.getMovieDetails(
+    data = cached(
+        "details",
+        tmdb.getMovieDetails,
         params=dict_to_query_string(params.__dict__),
         movie_id=movie_id,
     )
@@ -247,8 +277,8 @@ async def get_movie_details(
 
 
 @router.get("/tv/airing_today")
-async def get_tv_airing_today(params: Annotated[CommonListParams, Depends()]):
-    tv = tmdb.getTVAiringToday(params=dict_to_query_string(params.__dict__))
+def get_tv_airing_today(params: Annotated[CommonListParams, Depends()]):
+    tv = cached("list", tmdb.getTVAiringToday, params=dict_to_query_string(params.__dict__))
     if tv:
         return {
             "success": True,
@@ -262,8 +292,8 @@ async def get_tv_airing_today(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/tv/on_the_air")
-async def get_tv_on_the_air(params: Annotated[CommonListParams, Depends()]):
-    tv = tmdb.getTVOnTheAir(params=dict_to_query_string(params.__dict__))
+def get_tv_on_the_air(params: Annotated[CommonListParams, Depends()]):
+    tv = cached("list", tmdb.getTVOnTheAir, params=dict_to_query_string(params.__dict__))
     if tv:
         return {
             "success": True,
@@ -277,8 +307,8 @@ async def get_tv_on_the_air(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/tv/popular")
-async def get_tv_popular(params: Annotated[CommonListParams, Depends()]):
-    tv = tmdb.getTVPopular(params=dict_to_query_string(params.__dict__))
+def get_tv_popular(params: Annotated[CommonListParams, Depends()]):
+    tv = cached("list", tmdb.getTVPopular, params=dict_to_query_string(params.__dict__))
     if tv:
         return {
             "success": True,
@@ -292,8 +322,8 @@ async def get_tv_popular(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/tv/top_rated")
-async def get_tv_top_rated(params: Annotated[CommonListParams, Depends()]):
-    tv = tmdb.getTVTopRated(params=dict_to_query_string(params.__dict__))
+def get_tv_top_rated(params: Annotated[CommonListParams, Depends()]):
+    tv = cached("list", tmdb.getTVTopRated, params=dict_to_query_string(params.__dict__))
     if tv:
         return {
             "success": True,
@@ -307,11 +337,13 @@ async def get_tv_top_rated(params: Annotated[CommonListParams, Depends()]):
 
 
 @router.get("/tv/{series_id}")
-async def get_tv_details(
+def get_tv_details(
     series_id: str,
     params: Annotated[DetailsParams, Depends()],
 ):
-    data = tmdb.getTVDetails(
+    data = cached(
+        "details",
+        tmdb.getTVDetails,
         params=dict_to_query_string(params.__dict__),
         series_id=series_id,
     )
@@ -328,12 +360,14 @@ async def get_tv_details(
 
 
 @router.get("/tv/{series_id}/season/{season_number}")
-async def get_tv_season_details(
+def get_tv_season_details(
     series_id: int,
     season_number: int,
     params: Annotated[DetailsParams, Depends()],
 ):
-    data = tmdb.getTVSeasonDetails(
+    data = cached(
+        "details",
+        tmdb.getTVSeasonDetails,
         params=dict_to_query_string(params.__dict__),
         series_id=series_id,
         season_number=season_number,
@@ -351,13 +385,15 @@ async def get_tv_season_details(
 
 
 @router.get("/tv/{series_id}/season/{season_number}/episode/{episode_number}")
-async def get_tv_episode_details(
+def get_tv_episode_details(
     series_id: int,
     season_number: int,
     episode_number: int,
     params: Annotated[DetailsParams, Depends()],
 ):
-    data = tmdb.getTVSeasonEpisodeDetails(
+    data = cached(
+        "details",
+        tmdb.getTVSeasonEpisodeDetails,
         params=dict_to_query_string(params.__dict__),
         series_id=series_id,
         season_number=season_number,
@@ -376,8 +412,8 @@ async def get_tv_episode_details(
 
 
 @router.get("/search/collection")
-async def search_collection(params: Annotated[CollectionSearchParams, Depends()]):
-    data = tmdb.getCollectionSearch(params=dict_to_query_string(params.__dict__))
+def search_collection(params: Annotated[CollectionSearchParams, Depends()]):
+    data = cached("search", tmdb.getCollectionSearch, params=dict_to_query_string(params.__dict__))
     if data:
         return {
             "success": True,
@@ -391,8 +427,8 @@ async def search_collection(params: Annotated[CollectionSearchParams, Depends()]
 
 
 @router.get("/search/movie")
-async def search_movie(params: Annotated[MovieSearchParams, Depends()]):
-    data = tmdb.getMovieSearch(params=dict_to_query_string(params.__dict__))
+def search_movie(params: Annotated[MovieSearchParams, Depends()]):
+    data = cached("search", tmdb.getMovieSearch, params=dict_to_query_string(params.__dict__))
     if data:
         return {
             "success": True,
@@ -406,8 +442,8 @@ async def search_movie(params: Annotated[MovieSearchParams, Depends()]):
 
 
 @router.get("/search/multi")
-async def search_multi(params: Annotated[MultiSearchParams, Depends()]):
-    data = tmdb.getMultiSearch(params=dict_to_query_string(params.__dict__))
+def search_multi(params: Annotated[MultiSearchParams, Depends()]):
+    data = cached("search", tmdb.getMultiSearch, params=dict_to_query_string(params.__dict__))
     if data:
         return {
             "success": True,
@@ -421,8 +457,8 @@ async def search_multi(params: Annotated[MultiSearchParams, Depends()]):
 
 
 @router.get("/search/tv")
-async def search_tv(params: Annotated[TVSearchParams, Depends()]):
-    data = tmdb.getTVSearch(params=dict_to_query_string(params.__dict__))
+def search_tv(params: Annotated[TVSearchParams, Depends()]):
+    data = cached("search", tmdb.getTVSearch, params=dict_to_query_string(params.__dict__))
     if data:
         return {
             "success": True,
@@ -436,11 +472,13 @@ async def search_tv(params: Annotated[TVSearchParams, Depends()]):
 
 
 @router.get("/external_id/{external_id}")
-async def get_from_external_id(
+def get_from_external_id(
     external_id: str,
     params: Annotated[ExternalIDParams, Depends()],
 ):
-    data = tmdb.getFromExternalID(
+    data = cached(
+        "external_id",
+        tmdb.getFromExternalID,
         params=dict_to_query_string(params.__dict__),
         external_id=external_id,
     )
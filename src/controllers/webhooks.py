@@ -2,6 +2,7 @@ from typing import Any, Dict
 
 import pydantic
 from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
 from program.content.overseerr import Overseerr
 from program.indexers.trakt import get_imdbid_from_tmdb, get_imdbid_from_tvdb
 from program.media.item import MediaItem
@@ -33,7 +34,11 @@ async def overseerr(request: Request) -> Dict[str, Any]:
         logger.error(f"Failed to process request: {e}")
         return {"success": False, "message": "Failed to process request"}
 
+    # The imdb lookups are blocking requests, keep them off the event loop
+    return await run_in_threadpool(_process_overseerr_request, request, req)
 
+
+def _process_overseerr_request(request: Request, req: OverseerrWebhook) -> Dict[str, Any]:
     imdb_id = req.media.imdbId
     if not imdb_id:
         try:
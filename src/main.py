@@ -1,4 +1,5 @@
 import contextlib
+import os
 import signal
 import sys
 import threading
@@ -6,6 +7,7 @@ import time
 import traceback
 
 import uvicorn
+from anyio import to_thread
 from controllers.actions import router as actions_router
 from controllers.default import router as default_router
 from controllers.items import router as items_router
@@ -41,11 +43,21 @@ class LoguruMiddleware(BaseHTTPMiddleware):
 
 args = handle_args()
 
+
+@contextlib.asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Sync route handlers run in anyio's default thread pool, bound it so a burst of
+    # blocking DB or HTTP calls can't spawn an unbounded number of threads.
+    to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("API_MAX_WORKERS", 20))
+    yield
+
+
 app = FastAPI(
     title="Riven",
     summary="A media management system.",
     version="0.7.x",
     redoc_url=None,
+    lifespan=lifespan,
     license_info={
         "name": "GPL-3.0",
         "url": "https://www.gnu.org/licenses/gpl-3.0.en.html",
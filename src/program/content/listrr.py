@@ -2,12 +2,15 @@
 
 from typing import Generator
 
-from program.indexers.trakt import get_imdbid_from_tmdb
+from program.content.seen import SeenSet
+from program.indexers.trakt import id_resolver
 from program.media.item import MediaItem
 from program.settings.manager import settings_manager
 from requests.exceptions import HTTPError
 from utils.logger import logger
-from utils.request import get, ping
+from utils.request import CachePolicy, ResponseCache, get, ping
+
+listrr_cache = ResponseCache.for_service("listrr", CachePolicy(ttl=0))
 
 
 class Listrr:
@@ -22,7 +25,7 @@ class Listrr:
         if not self.initialized:
             return
         self.not_found_ids = []
-        self.recurring_items = set()
+        self.recurring_items = SeenSet(self.key)
         logger.success("Listrr initialized!")
 
     def validate(self) -> bool:
@@ -82,19 +85,22 @@ class Listrr:
             while page <= total_pages:
                 try:
                     url = f"{self.url}/List/{content_type}/{list_id}/ReleaseDate/Descending/{page}"
-                    response = get(url, additional_headers=self.headers).response
+                    response = get(url, additional_headers=self.headers, cache=listrr_cache).response
                     data = response.json()
                     total_pages = data.get("pages", 1)
+                    tmdb_ids = []
                     for item in data.get("items", []):
                         imdb_id = item.get("imDbId")
                         if imdb_id:
                             unique_ids.add(imdb_id)
                         elif content_type == "Movies" and item.get("tmDbId"):
-                            imdb_id = get_imdbid_from_tmdb(item["tmDbId"])
-                            if imdb_id:
-                                unique_ids.add(imdb_id)
+                            tmdb_ids.append(item["tmDbId"])
                         else:
                             self.not_found_ids.append(item["id"])
+                    # The movies without an imdb id on this page are resolved together
+                    for imdb_id in id_resolver.resolve_many("tmdb", tmdb_ids, "movie").values():
+                        if imdb_id and imdb_id.startswith("tt"):
+                            unique_ids.add(imdb_id)
                 except HTTPError as e:
                     if e.response.status_code in [400, 404, 429, 500]:
                         break
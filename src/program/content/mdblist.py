@@ -2,11 +2,15 @@
 
 from typing import Generator
 
+from program.content.seen import SeenSet
 from program.media.item import MediaItem
 from program.settings.manager import settings_manager
 from utils.logger import logger
 from utils.ratelimiter import RateLimiter, RateLimitExceeded
-from utils.request import get, ping
+from utils.request import CachePolicy, ResponseCache, get, ping
+
+# Lists are revalidated on every update, a 304 skips downloading and parsing them again
+mdblist_cache = ResponseCache.for_service("mdblist", CachePolicy(ttl=0))
 
 
 class Mdblist:
@@ -18,7 +22,7 @@ class Mdblist:
         self.initialized = self.validate()
         if not self.initialized:
             return
-        self.recurring_items = set()
+        self.recurring_items = SeenSet(self.key)
         self.requests_per_2_minutes = self._calculate_request_time()
         self.rate_limiter = RateLimiter(self.requests_per_2_minutes, 120, True)
         logger.success("mdblist initialized")
@@ -83,7 +87,7 @@ def my_limits(api_key: str):
 def list_items_by_id(list_id: int, api_key: str):
     """Wrapper for mdblist api method 'List items'"""
     response = get(
-        f"http://www.mdblist.com/api/lists/{str(list_id)}/items?apikey={api_key}"
+        f"http://www.mdblist.com/api/lists/{str(list_id)}/items?apikey={api_key}", cache=mdblist_cache
     )
     return response.data
 
@@ -91,5 +95,5 @@ def list_items_by_id(list_id: int, api_key: str):
 def list_items_by_url(url: str, api_key: str):
     url = url if url.endswith("/") else f"{url}/"
     url = url if url.endswith("json/") else f"{url}json/"
-    response = get(url, params={"apikey": api_key})
+    response = get(url, params={"apikey": api_key}, cache=mdblist_cache)
     return response.data
\ No newline at end of file
@@ -1,14 +1,26 @@
 """Overseerr content module"""
 
-from typing import Union
+from datetime import datetime, timedelta
+from typing import List, Optional, Union
 
+from program.content.seen import SeenSet
 from program.indexers.trakt import get_imdbid_from_tmdb
+from program.media.cursor import get_cursor, set_cursor
 from program.media.item import MediaItem
 from program.settings.manager import settings_manager
 from requests.exceptions import ConnectionError, RetryError
 from urllib3.exceptions import MaxRetryError, NewConnectionError
 from utils.logger import logger
-from utils.request import delete, get, ping, post
+from utils.request import CachePolicy, ResponseCache, delete, get, ping, post
+
+# Media details only change when Overseerr refreshes its metadata
+overseerr_cache = ResponseCache.for_service("overseerr", CachePolicy(ttl=24 * 60 * 60))
+
+# Newest request modification seen, polls stop paging once they reach it
+REQUESTS_CURSOR = "overseerr_requests"
+FULL_SYNC_CURSOR = "overseerr_full_sync"
+PAGE_SIZE = 20
+FULL_SYNC_PAGE_SIZE = 100
 
 
 class Overseerr:
@@ -22,7 +34,7 @@ class Overseerr:
         self.run_once = False
         if not self.initialized:
             return
-        self.recurring_items = set()
+        self.recurring_items = SeenSet(self.key)
         logger.success("Overseerr initialized!")
 
     def validate(self) -> bool:
@@ -59,25 +71,24 @@ class Overseerr:
         if self.run_once:
             return
 
-        try:
-            response = get(
-                self.settings.url + f"/api/v1/request?take={10000}&filter=approved&sort=added",
-                additional_headers=self.headers,
-            )
-        except (ConnectionError, RetryError, MaxRetryError) as e:
-            logger.error(f"Failed to fetch requests from overseerr: {str(e)}")
-            return
-        except Exception as e:
-            logger.error(f"Unexpected error during fetching requests: {str(e)}")
-            return
-
-        if not response.is_ok or not hasattr(response.data, "pageInfo") or getattr(response.data.pageInfo, "results", 0) == 0:
+        cursor = get_cursor(REQUESTS_CURSOR)
+        since = _updated_at(cursor)
+        last_full_sync = get_cursor(FULL_SYNC_CURSOR)
+        full_sync = (
+            not since
+            or not last_full_sync
+            or datetime.now() - datetime.fromisoformat(last_full_sync) > timedelta(seconds=self.settings.full_sync_interval)
+        )
+        requests = self._fetch_requests(None if full_sync else since)
+        if requests is None:
             return
+        if full_sync:
+            logger.debug(f"Reconciled all {len(requests)} approved requests from overseerr")
 
         # Lets look at approved items only that are only in the pending state
         pending_items = [
             item
-            for item in response.data.results
+            for item in requests
             if item.status == 2 and item.media.status == 3
         ]
         for item in pending_items:
@@ -99,9 +110,51 @@ class Overseerr:
                 logger.error(f"Error processing item {item}: {str(e)}")
                 continue
 
+        timestamps = [request.updatedAt for request in requests if _updated_at(getattr(request, "updatedAt", None))]
+        newest = max(timestamps, key=_updated_at, default=None)
+        if newest and (not since or _updated_at(newest) > since):
+            set_cursor(REQUESTS_CURSOR, newest)
+        if full_sync:
+            set_cursor(FULL_SYNC_CURSOR, datetime.now().isoformat())
+
         if self.settings.use_webhook:
             self.run_once = True
 
+    def _fetch_requests(self, since: Optional[datetime] = None) -> Optional[List]:
+        """
+        Approved requests, most recently modified first. With `since` paging stops at the
+        first request that was not modified after it, so a quiet poll fetches one small page.
+        Without it every request is fetched. Returns None when Overseerr could not be reached.
+        """
+        take = PAGE_SIZE if since else FULL_SYNC_PAGE_SIZE
+        requests, skip = [], 0
+        while True:
+            try:
+                response = get(
+                    self.settings.url + f"/api/v1/request?take={take}&skip={skip}&filter=approved&sort=modified",
+                    additional_headers=self.headers,
+                )
+            except (ConnectionError, RetryError, MaxRetryError) as e:
+                logger.error(f"Failed to fetch requests from overseerr: {str(e)}")
+                return None
+            except Exception as e:
+                logger.error(f"Unexpected error during fetching requests: {str(e)}")
+                return None
+
+            if not response.is_ok or not hasattr(response.data, "pageInfo"):
+                return None
+
+            page = getattr(response.data, "results", None) or []
+            for request in page:
+                updated_at = _updated_at(getattr(request, "updatedAt", None))
+                # Requests modified at the cursor itself are fetched again, skipping one would lose it
+                if since and updated_at and updated_at < since:
+                    return requests
+                requests.append(request)
+            skip += take
+            if len(page) < take or skip >= getattr(response.data.pageInfo, "results", 0):
+                return requests
+
     def get_imdb_id(self, data) -> str:
         """Get imdbId for item from overseerr"""
         if data.mediaType == "show":
@@ -114,6 +167,7 @@ class Overseerr:
             response = get(
                 self.settings.url + f"/api/v1/{data.mediaType}/{external_id}?language=en",
                 additional_headers=self.headers,
+                cache=overseerr_cache,
             )
         except (ConnectionError, RetryError, MaxRetryError) as e:
             logger.error(f"Failed to fetch media details from overseerr: {str(e)}")
@@ -214,6 +268,16 @@ class Overseerr:
             return False
 
 
+def _updated_at(value: Optional[str]) -> Optional[datetime]:
+    """Parse an Overseerr timestamp such as 2024-05-01T12:30:00.000Z."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
 # Statuses for Media Requests endpoint /api/v1/request:
 # item.status:
 # 1 = PENDING APPROVAL, 
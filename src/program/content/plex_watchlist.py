@@ -4,6 +4,7 @@ import xml.etree.ElementTree as ET
 
 from typing import Generator, Union
 
+from program.content.seen import SeenSet
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.settings.manager import settings_manager
 from program.indexers.trakt import get_imdbid_from_tvdb
@@ -28,7 +29,7 @@ class PlexWatchlist:
         self.initialized = self.validate()
         if not self.initialized:
             return
-        self.recurring_items = set()
+        self.recurring_items = SeenSet(self.key)
         logger.success("Plex Watchlist initialized!")
 
     def validate(self):
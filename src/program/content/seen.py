@@ -0,0 +1,113 @@
+"""Persistent record of the imdb ids the content sources already emitted"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from cachetools import LRUCache
+from program.db.db import db
+from program.media.item import MediaItem
+from program.media.seen_item import SeenItem
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from utils.bloom import BloomFilter
+
+SEEN_CAPACITY = 10000
+# Ids that never made it into the library are kept this long before they are emitted again
+EXPIRE_GRACE = timedelta(days=1)
+EXPIRE_INTERVAL = 60 * 60
+
+seen_sets: Dict[str, "SeenSet"] = {}
+
+
+class SeenSet:
+    """
+    The imdb ids a content source emitted, kept in the SeenItem table so a restart
+    doesn't push every list item through the program again. Used like the set it
+    replaces, with `imdb_id in seen` and `seen.add(imdb_id)`.
+
+    A Bloom filter of the stored ids answers ids that were never seen without a query,
+    the ones it may have seen are confirmed in the table and kept in a bounded LRU.
+    """
+
+    def __init__(self, source: str, capacity: int = SEEN_CAPACITY, maxsize: int = 4096):
+        self.source = source
+        self.capacity = capacity
+        self._bloom: Optional[BloomFilter] = None
+        self._known: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.RLock()
+        self.filtered = 0
+        self.queries = 0
+        seen_sets[source] = self
+
+    def _filter(self) -> BloomFilter:
+        # Built on first use, the services are created before the migrations ran
+        with self._lock:
+            if self._bloom is None:
+                with db.Session() as session:
+                    ids = session.execute(select(SeenItem.imdb_id).where(SeenItem.source == self.source)).scalars().all()
+                self._bloom = BloomFilter(max(self.capacity, len(ids) * 2))
+                for imdb_id in ids:
+                    self._bloom.add(imdb_id)
+            return self._bloom
+
+    def __contains__(self, imdb_id: Optional[str]) -> bool:
+        if not imdb_id:
+            return False
+        with self._lock:
+            if imdb_id not in self._filter():
+                self.filtered += 1
+                return False
+            if imdb_id in self._known:
+                return True
+            self.queries += 1
+        with db.Session() as session:
+            found = session.get(SeenItem, (self.source, imdb_id)) is not None
+        if found:
+            with self._lock:
+                self._known[imdb_id] = True
+        return found
+
+    def add(self, imdb_id: Optional[str]) -> None:
+        if not imdb_id:
+            return
+        with db.Session() as session:
+            session.merge(SeenItem(self.source, imdb_id))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Stored by another thread in the meantime
+                session.rollback()
+        with self._lock:
+            bloom = self._filter()
+            bloom.add(imdb_id)
+            self._known[imdb_id] = True
+            if len(bloom) > bloom.capacity:
+                # Past its capacity the filter lets too many ids through, size it anew
+                self._bloom = None
+
+    def invalidate(self) -> None:
+        """Forget everything held in memory, the next lookup reloads it from the table."""
+        with self._lock:
+            self._bloom = None
+            self._known.clear()
+
+    def stats(self) -> dict:
+        return {"filtered": self.filtered, "queries": self.queries, "known": len(self._known)}
+
+
+def expire_seen(grace: timedelta = EXPIRE_GRACE) -> int:
+    """
+    Remove the seen ids that are not in the library, because they were deleted from it
+    or never got there, once they are older than `grace`. Returns how many were removed.
+    """
+    cutoff = datetime.now() - grace
+    library_ids = select(MediaItem.imdb_id).where(MediaItem.imdb_id.isnot(None))
+    with db.Session() as session:
+        removed = session.execute(
+            delete(SeenItem).where(SeenItem.seen_at < cutoff).where(SeenItem.imdb_id.not_in(library_ids))
+        ).rowcount
+        session.commit()
+    if removed:
+        for seen_set in seen_sets.values():
+            seen_set.invalidate()
+    return removed
@@ -3,6 +3,7 @@ import re
 import time
 from urllib.parse import urlencode
 
+from program.content.seen import SeenSet
 from program.media.item import MediaItem, Movie, Show
 from program.settings.manager import settings_manager
 from requests import RequestException
@@ -27,7 +28,7 @@ class TraktContent:
         if not self.initialized:
             return
         self.next_run_time = 0
-        self.items_already_seen = set()
+        self.items_already_seen = SeenSet(self.key)
         self.missing()
         logger.success("Trakt initialized!")
 
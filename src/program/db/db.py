@@ -4,6 +4,7 @@ from alembic.autogenerate import compare_metadata
 from alembic.runtime.migration import MigrationContext
 from program.settings.manager import settings_manager
 from sqla_wrapper import Alembic, SQLAlchemy
+from sqlalchemy import event, text
 from utils import data_dir_path
 from utils.logger import logger
 
@@ -19,6 +20,18 @@ alembic = Alembic(db, script_location)
 alembic.init(script_location)
 
 
+def ensure_trigram_extension(connection) -> None:
+    """Enable pg_trgm on PostgreSQL, the item search indexes depend on it."""
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+@event.listens_for(db.Model.metadata, "before_create")
+def _before_create(_target, connection, **kw) -> None:
+    ensure_trigram_extension(connection)
+
+
 # https://stackoverflow.com/questions/61374525/how-do-i-check-if-alembic-migrations-need-to-be-generated
 def need_upgrade_check() -> bool:
     """Check if there are any pending migrations."""
@@ -31,6 +44,8 @@ def need_upgrade_check() -> bool:
 def run_migrations() -> None:
     """Run Alembic migrations if needed."""
     try:
+        with db.engine.begin() as connection:
+            ensure_trigram_extension(connection)
         if need_upgrade_check():
             logger.info("New migrations detected, creating revision...")
             alembic.revision("auto-upg")
@@ -1,17 +1,21 @@
 import os
 import shutil
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
 
 import alembic
 
 from program.media.item import Episode, MediaItem, Movie, Season, Show
-from program.media.stream import Stream, StreamRelation
+from program.media.stream import Stream, StreamBlacklistRelation, StreamRelation
+from program.media.subtitle import Subtitle
 from program.types import Event
-from sqlalchemy import delete, func, select, text
+from sqlalchemy import delete, func, insert, select, text, update
 from sqlalchemy.orm import joinedload
 from utils.logger import logger
 from utils import alembic_dir
 
 from .db import db, alembic
+from .search import refresh_search_index
 
 
 def _ensure_item_exists_in_db(item: MediaItem) -> bool:
@@ -73,26 +77,153 @@ def _get_item_from_db(session, item: MediaItem):
             logger.error(f"_get_item_from_db Failed to create item from type: {type}")
             return None
 
-def _remove_item_from_db(id):
+BULK_CHUNK_SIZE = 500
+
+def _chunked(ids: Iterable[int], size: int = BULK_CHUNK_SIZE):
+    ids = list(dict.fromkeys(ids))
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _get_item_ids_with_children(session, ids: Iterable[int]) -> set[int]:
+    """Return the given ids together with the ids of their seasons and episodes."""
+    ids = set(ids)
+    seasons, episodes = Season.__table__, Episode.__table__
+    season_ids = set(session.execute(select(seasons.c._id).where(seasons.c.parent_id.in_(ids))).scalars())
+    episode_ids = set(session.execute(select(episodes.c._id).where(episodes.c.parent_id.in_(ids | season_ids))).scalars())
+    return ids | season_ids | episode_ids
+
+def _get_items_from_db(session, ids: Iterable[int]) -> List[MediaItem]:
+    """Load many items, including their seasons and episodes, in a single query."""
+    ids = list(ids)
+    if not ids:
+        return []
+    return session.execute(select(MediaItem).where(MediaItem._id.in_(ids))).unique().scalars().all()
+
+def _unlink(path: Optional[str]) -> None:
+    if not path:
+        return
     try:
+        Path(path).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Failed to remove {path}: {e}")
+
+def _blacklist_active_streams(session, active_hashes: dict[int, str]) -> None:
+    """Move each item's active stream from its streams to its blacklisted streams."""
+    if not active_hashes:
+        return
+    relations = session.execute(
+        select(StreamRelation._id, StreamRelation.parent_id, StreamRelation.child_id, Stream.infohash)
+        .join(Stream, Stream._id == StreamRelation.child_id)
+        .where(StreamRelation.parent_id.in_(active_hashes.keys()))
+        .where(Stream.infohash.in_(set(active_hashes.values())))
+    ).all()
+    relations = [r for r in relations if active_hashes.get(r.parent_id) == r.infohash]
+    if not relations:
+        return
+    session.execute(delete(StreamRelation).where(StreamRelation._id.in_([r._id for r in relations])))
+    session.execute(
+        insert(StreamBlacklistRelation),
+        [{"media_item_id": r.parent_id, "stream_id": r.child_id} for r in relations],
+    )
+
+def _reset_items_in_db(ids: Iterable[int], progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Reset items and all of their seasons and episodes for rescraping.
+
+    This is the set based equivalent of calling `MediaItem.reset` on every item
+    in the tree, the ids are processed in chunks, each with a handful of statements.
+    Returns the amount of items that were reset, children included.
+    """
+    items, subtitles = MediaItem.__table__, Subtitle.__table__
+    total = 0
+    for chunk in _chunked(ids):
         with db.Session() as session:
-            item = session.execute(select(MediaItem).where(MediaItem._id == id)).unique().scalar_one()
-            item_type = None
-            if item.type == "movie":
-                item_type = Movie
-            elif item.type == "show":
-                item_type = Show
-            elif item.type == "season":
-                item_type = Season
-            elif item.type == "episode":
-                item_type = Episode
-            if item:
-                session.execute(delete(Stream).where(Stream.parent_id == item._id))
-                session.execute(delete(item_type).where(item_type._id == item._id))
-                session.execute(delete(MediaItem.__table__).where(MediaItem._id == item._id))
-                session.commit()
-                return True
-            return False
+            all_ids = _get_item_ids_with_children(session, chunk)
+            rows = session.execute(
+                select(items.c._id, items.c.symlink_path, items.c.active_stream)
+                .where(items.c._id.in_(all_ids))
+            ).all()
+            subtitle_files = session.execute(
+                select(subtitles.c.file).where(subtitles.c.parent_id.in_(all_ids))
+            ).scalars().all()
+
+            for row in rows:
+                _unlink(row.symlink_path)
+            for file in subtitle_files:
+                _unlink(file)
+
+            _blacklist_active_streams(session, {
+                row._id: row.active_stream["hash"]
+                for row in rows if row.active_stream and row.active_stream.get("hash")
+            })
+            session.execute(update(subtitles).where(subtitles.c.parent_id.in_(all_ids)).values(file=None))
+            session.execute(
+                update(items).where(items.c._id.in_(all_ids)).values(
+                    symlink_path=None,
+                    file=None,
+                    folder=None,
+                    alternative_folder=None,
+                    active_stream={},
+                    symlinked=False,
+                    symlinked_at=None,
+                    update_folder=None,
+                    scraped_at=None,
+                    symlinked_times=0,
+                    scraped_times=0,
+                )
+            )
+            session.commit()
+            refresh_search_index(session, all_ids)
+            total += len(rows)
+        logger.debug(f"Reset {len(rows)} items for rescraping")
+        if progress:
+            progress(len(chunk))
+    return total
+
+def _remove_items_from_db(ids: Iterable[int], progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Remove items and all of their seasons, episodes, stream relations and subtitles.
+
+    Streams which are no longer related to any item are removed as well.
+    Returns the amount of items that were removed, children included.
+    """
+    items = MediaItem.__table__
+    total = 0
+    for chunk in _chunked(ids):
+        with db.Session() as session:
+            all_ids = _get_item_ids_with_children(session, chunk)
+            stream_ids = set(session.execute(
+                select(StreamRelation.child_id).where(StreamRelation.parent_id.in_(all_ids))
+            ).scalars()) | set(session.execute(
+                select(StreamBlacklistRelation.stream_id).where(StreamBlacklistRelation.media_item_id.in_(all_ids))
+            ).scalars())
+
+            session.execute(delete(StreamRelation).where(StreamRelation.parent_id.in_(all_ids)))
+            session.execute(delete(StreamBlacklistRelation).where(StreamBlacklistRelation.media_item_id.in_(all_ids)))
+            session.execute(delete(Subtitle).where(Subtitle.parent_id.in_(all_ids)))
+            # Children first, the subclass tables reference their parents and MediaItem
+            for table in (Episode.__table__, Season.__table__, Show.__table__, Movie.__table__):
+                session.execute(delete(table).where(table.c._id.in_(all_ids)))
+            removed = session.execute(delete(items).where(items.c._id.in_(all_ids))).rowcount
+
+            if stream_ids:
+                session.execute(
+                    delete(Stream)
+                    .where(Stream._id.in_(stream_ids))
+                    .where(~Stream._id.in_(select(StreamRelation.child_id)))
+                    .where(~Stream._id.in_(select(StreamBlacklistRelation.stream_id)))
+                )
+            session.commit()
+            refresh_search_index(session, all_ids)
+            total += removed
+        logger.debug(f"Removed {removed} items from the database")
+        if progress:
+            progress(len(chunk))
+    return total
+
+def _remove_item_from_db(id):
+    try:
+        return _remove_items_from_db([id]) > 0
     except Exception as e:
         logger.error("Failed to remove item from imdb_id, " + str(e))
         return False
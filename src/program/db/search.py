@@ -0,0 +1,219 @@
+"""Ranked item search for the /items endpoint.
+
+On PostgreSQL the search is answered by the database using the `pg_trgm`
+GIN indexes declared on `MediaItem`. Any other backend falls back to an
+in-process trigram index over item titles and ids which is kept up to date
+through ORM events as items are inserted, updated or removed.
+"""
+import re
+import threading
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+import Levenshtein
+from program.db.db import db
+from program.media.item import MediaItem
+from sqlalchemy import Select, bindparam, case, event, false, func, or_, select
+from utils.logger import logger
+
+NGRAM_SIZE = 3
+MIN_SIMILARITY = 0.3
+MIN_FUZZY_RATIO = 0.75
+# Matches ranked by score, any further matches follow them by id
+MAX_RANKED = 1000
+
+_non_word = re.compile(r"[^\w]+")
+
+
+def _normalize(text: Optional[str]) -> str:
+    """Lowercase the text and collapse everything that is not a word character."""
+    if not text:
+        return ""
+    return _non_word.sub(" ", text.lower()).strip()
+
+
+def _ngrams(text: str, n: int = NGRAM_SIZE) -> set[str]:
+    """Split normalized text into padded word n-grams, the same way pg_trgm does."""
+    grams = set()
+    for word in text.split():
+        padded = f"{' ' * (n - 1)}{word} "
+        grams.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class NGramIndex:
+    """In-process trigram index over item titles and imdb ids."""
+
+    def __init__(self, n: int = NGRAM_SIZE):
+        self.n = n
+        self.built = False
+        self._lock = threading.RLock()
+        self._postings: dict[str, set[int]] = defaultdict(set)
+        self._documents: dict[int, Tuple[str, str, frozenset]] = {}
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, item_id: int, title: Optional[str], imdb_id: Optional[str] = None) -> None:
+        """Add or replace an item in the index."""
+        if item_id is None:
+            return
+        normalized_title = _normalize(title)
+        normalized_id = (imdb_id or "").lower()
+        grams = frozenset(_ngrams(normalized_title, self.n) | _ngrams(normalized_id, self.n))
+        with self._lock:
+            self._discard(item_id)
+            if not grams:
+                return
+            self._documents[item_id] = (normalized_title, normalized_id, grams)
+            for gram in grams:
+                self._postings[gram].add(item_id)
+
+    def add_many(self, rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+        """Add many `(id, title, imdb_id)` rows at once."""
+        with self._lock:
+            for item_id, title, imdb_id in rows:
+                self.add(item_id, title, imdb_id)
+
+    def remove(self, item_id: int) -> None:
+        """Remove an item from the index."""
+        with self._lock:
+            self._discard(item_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self.built = False
+
+    def _discard(self, item_id: int) -> None:
+        document = self._documents.pop(item_id, None)
+        if not document:
+            return
+        for gram in document[2]:
+            postings = self._postings.get(gram)
+            if postings is None:
+                continue
+            postings.discard(item_id)
+            if not postings:
+                del self._postings[gram]
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Return `(id, score)` pairs ranked by relevance, best match first.
+
+        Candidates are the items sharing at least one trigram with the query.
+        Substring matches always qualify, anything else has to be close enough
+        by trigram similarity or by Levenshtein ratio to tolerate typos.
+        """
+        normalized_query = _normalize(query)
+        query_grams = _ngrams(normalized_query, self.n)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            shared_counts: dict[int, int] = defaultdict(int)
+            for gram in query_grams:
+                for item_id in self._postings.get(gram, ()):
+                    shared_counts[item_id] += 1
+            candidates = [(item_id, shared, self._documents[item_id]) for item_id, shared in shared_counts.items()]
+
+        results = []
+        for item_id, shared, (title, imdb_id, grams) in candidates:
+            similarity = shared / (len(query_grams) + len(grams) - shared)
+            # How much of the query is covered, so short queries can match long titles
+            coverage = shared / len(query_grams)
+            ratio = Levenshtein.ratio(normalized_query, title) if title else 0.0
+            substring = normalized_query in title or normalized_query in imdb_id
+
+            if not (substring or similarity >= MIN_SIMILARITY or ratio >= MIN_FUZZY_RATIO):
+                continue
+
+            score = max(similarity, ratio, coverage * 0.9 if substring else 0.0)
+            if title == normalized_query:
+                score += 1.0
+            elif title.startswith(normalized_query):
+                score += 0.5
+            results.append((item_id, round(score, 4)))
+
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+
+search_index = NGramIndex()
+
+
+def _uses_trigram_index() -> bool:
+    return db.engine.dialect.name == "postgresql"
+
+
+def build_search_index() -> None:
+    """Populate the in-process index from the database."""
+    with db.Session() as session:
+        rows = session.execute(
+            select(MediaItem._id, MediaItem.title, MediaItem.imdb_id)
+        ).all()
+    search_index.clear()
+    search_index.add_many(rows)
+    search_index.built = True
+    logger.debug(f"Built item search index with {len(search_index)} items")
+
+
+def refresh_search_index(session, item_ids: Iterable[int]) -> None:
+    """
+    Re-read items into the in-process index after bulk statements, which skip the
+    ORM events below. Items that are no longer in the database are dropped.
+    """
+    if not search_index.built:
+        return
+    item_ids = list(item_ids)
+    rows = session.execute(
+        select(MediaItem._id, MediaItem.title, MediaItem.imdb_id).where(MediaItem._id.in_(item_ids))
+    ).all()
+    found = {row[0] for row in rows}
+    search_index.add_many(rows)
+    for item_id in item_ids:
+        if item_id not in found:
+            search_index.remove(item_id)
+
+
+def apply_search(query: Select, term: str) -> Select:
+    """Filter and rank a MediaItem select by a free text search term."""
+    if _uses_trigram_index():
+        rank = func.greatest(
+            func.similarity(MediaItem.title, term),
+            func.similarity(MediaItem.imdb_id, term),
+        )
+        return query.where(
+            or_(
+                MediaItem.title.ilike(f"%{term}%"),
+                MediaItem.imdb_id.ilike(f"%{term}%"),
+                MediaItem.title.op("%")(term),
+            )
+        ).order_by(rank.desc(), MediaItem._id)
+
+    if not search_index.built:
+        build_search_index()
+
+    # Every match goes into the filter so the caller's filters and count see all of them,
+    # only the ranking is capped. The ids are rendered inline to stay clear of bind limits.
+    matched_ids = [item_id for item_id, _ in search_index.search(term)]
+    if not matched_ids:
+        return query.where(false())
+    positions = {item_id: position for position, item_id in enumerate(matched_ids[:MAX_RANKED])}
+    return query.where(
+        MediaItem._id.in_(bindparam("search_ids", matched_ids, expanding=True, literal_execute=True))
+    ).order_by(case(positions, value=MediaItem._id, else_=len(positions)), MediaItem._id)
+
+
+@event.listens_for(MediaItem, "after_insert", propagate=True)
+@event.listens_for(MediaItem, "after_update", propagate=True)
+def _index_item(_mapper, _connection, target: MediaItem) -> None:
+    if search_index.built:
+        search_index.add(target._id, target.title, target.imdb_id)
+
+
+@event.listens_for(MediaItem, "after_delete", propagate=True)
+def _unindex_item(_mapper, _connection, target: MediaItem) -> None:
+    if search_index.built:
+        search_index.remove(target._id)
@@ -1,7 +1,10 @@
 from program.media.item import MediaItem
+from program.settings.manager import settings_manager
 from utils.logger import logger
 
 from .alldebrid import AllDebridDownloader
+from .availability import AvailabilityPrefetcher
+from .multi import ProviderRace
 from .realdebrid import RealDebridDownloader
 from .torbox import TorBoxDownloader
 
@@ -10,6 +13,9 @@ class Downloader:
     def __init__(self):
         self.key = "downloader"
         self.initialized = False
+        self.race = None
+        prefetch = settings_manager.settings.downloaders.availability_prefetch
+        self.prefetcher = AvailabilityPrefetcher(prefetch) if prefetch > 0 else None
         self.services = {
             RealDebridDownloader: RealDebridDownloader(),
             TorBoxDownloader: TorBoxDownloader(),
@@ -24,10 +30,44 @@ class Downloader:
     def validate(self):
         initialized_services = [service for service in self.services.values() if service.initialized]
         if len(initialized_services) > 1:
-            logger.error("More than one downloader service is initialized. Only one downloader can be initialized at a time.")
-            return False
+            if not settings_manager.settings.downloaders.multi_provider:
+                logger.error("More than one downloader service is initialized. Enable multi_provider to use several at a time.")
+                return False
+            self.race = ProviderRace(initialized_services)
+            logger.info(f"Racing {len(initialized_services)} downloader services: {', '.join(service.key for service in initialized_services)}")
+            return True
         return len(initialized_services) == 1
 
+    @property
+    def tracked_services(self) -> list:
+        """Initialized services that wait on the state of the torrents they add."""
+        return [
+            service for service in self.services.values()
+            if service.initialized and getattr(service, "download_tracker", None)
+        ]
+
+    def is_waiting(self, item: MediaItem) -> bool:
+        """Whether a service is waiting for the torrent it added for the item to be ready."""
+        return any(service.download_tracker.is_waiting(item._id) for service in self.tracked_services)
+
+    def prefetch(self, item: MediaItem) -> None:
+        """Check the availability of a scraped item's best hashes before it gets its turn."""
+        if not self.prefetcher or not self.initialized:
+            return
+        services = self.race.services if self.race else [self.service]
+        self.prefetcher.submit(item, [service.availability_checker for service in services])
+
     def run(self, item: MediaItem):
-        self.service.run(item)
+        if self.prefetcher:
+            self.prefetcher.wait(item)
+        # The service that waited on the item's torrent picks up where it left off
+        waited = next(
+            (service for service in self.tracked_services if service.download_tracker.has_result(item._id)), None
+        )
+        if waited:
+            waited.run(item)
+        elif self.race:
+            self.race.run(item)
+        else:
+            self.service.run(item)
         yield item
\ No newline at end of file
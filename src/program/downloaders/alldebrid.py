@@ -1,26 +1,27 @@
-import contextlib
-import time
 from datetime import datetime
-from os.path import splitext
 from pathlib import Path
 from types import SimpleNamespace
-from typing import Generator, List
+from typing import List
 
+from program.downloaders.availability import AvailabilityChecker
+from program.downloaders.shared import file_finder_for, needed_episodes
+from program.downloaders.tracker import DownloadStateTracker
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.media.state import States
 from program.settings.manager import settings_manager
 from requests import ConnectTimeout
-from RTN.exceptions import GarbageTorrent
-from RTN.parser import parse
 from RTN.patterns import extract_episodes
 from utils.logger import logger
 from utils.ratelimiter import RateLimiter
 from utils.request import get, ping, post
 
-WANTED_FORMATS = {".mkv", ".mp4", ".avi"}
 AD_BASE_URL = "https://api.alldebrid.com/v4"
 AD_AGENT = "Riven"
 AD_PARAM_AGENT = f"agent={AD_AGENT}"
+AD_AVAILABILITY_BATCH = 25
+# Magnet status codes, 4 is ready and everything above it an error
+AD_READY_STATES = {4}
+AD_FAILED_STATES = set(range(5, 16))
 
 class AllDebridDownloader:
     """All-Debrid API Wrapper"""
@@ -34,6 +35,15 @@ class AllDebridDownloader:
         self.proxy = self.settings.proxy_url if self.settings.proxy_enabled else None
         self.inner_rate_limit = RateLimiter(12, 1)  # 12 requests per second
         self.overall_rate_limiter = RateLimiter(600, 60)  # 600 requests per minute
+        self.availability_checker = AvailabilityChecker(
+            self.key,
+            self._fetch_availability,
+            max_batch=AD_AVAILABILITY_BATCH,
+            base_url_length=len(f"{AD_BASE_URL}/magnet/instant?{AD_PARAM_AGENT}"),
+            hash_url_length=len("&magnets%5B100%5D=") + 40,
+            rate_limiter=self.overall_rate_limiter,
+        )
+        self.download_tracker = DownloadStateTracker(self.key, self._fetch_magnet_states, failed_states=AD_FAILED_STATES)
         self.initialized = self.validate()
         if not self.initialized:
             return
@@ -101,7 +111,11 @@ class AllDebridDownloader:
     def run(self, item: MediaItem) -> bool:
         """Download media item from all-debrid.com"""
         return_value = False
-        if self.is_cached(item) and not self._is_downloaded(item):
+        waited = self.download_tracker.pop_result(item._id)
+        if waited:
+            self._resume_download(item, *waited)
+            return_value = True
+        elif self.is_cached(item) and not self._is_downloaded(item):
             self._download_item(item)
             return_value = True
         self.log_item(item)
@@ -145,11 +159,6 @@ class AllDebridDownloader:
         if not item.get("streams", {}):
             return False
 
-        def _chunked(lst: List, n: int) -> Generator[List, None, None]:
-            """Yield successive n-sized chunks from lst."""
-            for i in range(0, len(lst), n):
-                yield lst[i:i + n]
-
         logger.log("DEBRID", f"Processing {len(item.streams)} streams for {item.log_string}")
 
         processed_stream_hashes = set()
@@ -158,21 +167,33 @@ class AllDebridDownloader:
             logger.log("NOT_FOUND", f"No streams found from filtering: {item.log_string}")
             return False
 
-        for stream_chunk in _chunked(filtered_streams, 5):
-            try:
-                params = {"agent": AD_AGENT}
-                for i, magnet in enumerate(stream_chunk):
-                    params[f"magnets[{i}]"] = magnet
+        def evaluate(stream_hash: str, magnet: dict) -> bool:
+            if not magnet:
+                return False
+            return self._evaluate_stream_response({"status": "success", "data": {"magnets": [magnet]}}, processed_stream_hashes, item)
 
-                response = get(f"{AD_BASE_URL}/magnet/instant", params=params, additional_headers=self.auth_headers, proxies=self.proxy, response_type=dict, specific_rate_limiter=self.inner_rate_limit, overall_rate_limiter=self.overall_rate_limiter)
-                if response.is_ok and self._evaluate_stream_response(response.data, processed_stream_hashes, item):
-                    return True
-            except Exception as e:
-                logger.error(f"Error checking cache for streams: {str(e)}", exc_info=True)
+        if self.availability_checker.check(filtered_streams, evaluate):
+            return True
 
         logger.log("NOT_FOUND", f"No wanted cached streams found for {item.log_string} out of {len(filtered_streams)}")
         return False
 
+    def _fetch_availability(self, hashes: List[str]) -> dict:
+        """Fetch instant availability for a batch of hashes, mapping uncached hashes to None."""
+        params = {"agent": AD_AGENT}
+        for i, magnet in enumerate(hashes):
+            params[f"magnets[{i}]"] = magnet
+
+        response = get(f"{AD_BASE_URL}/magnet/instant", params=params, additional_headers=self.auth_headers, proxies=self.proxy, response_type=dict, specific_rate_limiter=self.inner_rate_limit, overall_rate_limiter=self.overall_rate_limiter)
+        if not response.is_ok or response.data.get("status") != "success":
+            raise ValueError(f"Unexpected instant availability response: {response.data}")
+        magnets = {magnet.get("hash", "").lower(): magnet for magnet in response.data.get("data", {}).get("magnets", [])}
+        results = {}
+        for stream_hash in hashes:
+            magnet = magnets.get(stream_hash.lower())
+            results[stream_hash] = magnet if magnet and magnet.get("instant", False) else None
+        return results
+
     def _evaluate_stream_response(self, data, processed_stream_hashes, item):
         """Evaluate the response data from the stream availability check."""
         if data.get("status") != "success":
@@ -192,8 +213,9 @@ class AllDebridDownloader:
             if self._process_providers(item, magnet, stream_hash):
                 return True
             else:
-                stream = next(stream for stream in item.streams if stream.infohash == stream_hash)
-                stream.blacklisted = True
+                stream = item.get_stream(stream_hash)
+                if stream:
+                    item.blacklist_stream(stream)
         return False
 
     def _process_providers(self, item: MediaItem, magnet: dict, stream_hash: str) -> bool:
@@ -201,22 +223,16 @@ class AllDebridDownloader:
         if not magnet or not stream_hash:
             return False
     
-        sorted_files = sorted(
-            (file for file in magnet.get("files", [])),
-            key=lambda file: file.get("s", 0),
-            reverse=True
-        )
-    
+        files = _flatten_files(magnet.get("files", []))
+
         if isinstance(item, Movie):
-            for file in sorted_files:
-                if self._is_wanted_movie(file, item):
-                    item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
-                    return True
+            if self._is_wanted_movie(files, item):
+                item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
+                return True
         elif isinstance(item, Show):
-            for file in sorted_files:
-                if self._is_wanted_show(file, item):
-                    item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
-                    return True
+            if self._is_wanted_show(files, item):
+                item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
+                return True
         elif isinstance(item, Season):
             other_containers = [
                 s for s in item.parent.seasons
@@ -224,165 +240,69 @@ class AllDebridDownloader:
                    and s.state not in (States.Indexed, States.Unknown)
             ]
             for c in other_containers:
-                if self._is_wanted_season(c.active_stream["files"], item):
+                if self._is_wanted_season(_flatten_files(c.active_stream["files"]), item):
                     item.set("active_stream", {"hash": c.active_stream["hash"], "files": c.active_stream["files"], "id": None})
                     return True
-            for file in sorted_files:
-                if self._is_wanted_season(file, item):
-                    item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
-                    return True
+            if self._is_wanted_season(files, item):
+                item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
+                return True
         elif isinstance(item, Episode):
-            for file in sorted_files:
-                if self._is_wanted_episode(file, item):
-                    item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
-                    return True
+            if self._is_wanted_episode(files, item):
+                item.set("active_stream", {"hash": stream_hash, "files": magnet["files"], "id": None})
+                return True
         return False
 
-    def _is_wanted_movie(self, file: dict, item: Movie) -> bool:
-        """Check if file is wanted for a movie"""
+    def _is_wanted_movie(self, files: list, item: Movie) -> bool:
+        """Check if files are wanted for a movie"""
         if not isinstance(item, Movie):
             logger.error(f"Item is not a Movie instance: {item.log_string}")
             return False
-    
-        min_size = self.download_settings.movie_filesize_min * 1_000_000
-        max_size = self.download_settings.movie_filesize_max * 1_000_000 if self.download_settings.movie_filesize_max != -1 else float("inf")
-    
-        if not isinstance(file, dict) or file.get("s", 0) < min_size or file.get("s", 0) > max_size or splitext(file.get("n", "").lower())[1] not in WANTED_FORMATS:
+
+        file = file_finder_for(item, "n", "s", self.download_settings).find_movie(files)
+        if not file:
             return False
-    
-        with contextlib.suppress(GarbageTorrent, TypeError):
-            parsed_file = parse(file["n"], remove_trash=True)
-            if parsed_file and parsed_file.type == "movie":
-                item.set("folder", item.active_stream.get("name"))
-                item.set("alternative_folder", item.active_stream.get("alternative_name", None))
-                item.set("file", file["n"])
-                return True
-        return False
+        item.set("folder", item.active_stream.get("name"))
+        item.set("alternative_folder", item.active_stream.get("alternative_name", None))
+        item.set("file", file["n"])
+        return True
 
-    def _is_wanted_episode(self, file: dict, item: Episode) -> bool:
-        """Check if file is wanted for an episode"""
+    def _is_wanted_episode(self, files: list, item: Episode) -> bool:
+        """Check if files are wanted for an episode"""
         if not isinstance(item, Episode):
             logger.error(f"Item is not an Episode instance: {item.log_string}")
             return False
-    
-        min_size = self.download_settings.episode_filesize_min * 1_000_000
-        max_size = self.download_settings.episode_filesize_max * 1_000_000 if self.download_settings.episode_filesize_max != -1 else float("inf")
-    
-        if not isinstance(file, dict) or file.get("s", 0) < min_size or file.get("s", 0) > max_size or splitext(file.get("n", "").lower())[1] not in WANTED_FORMATS:
+
+        matches = file_finder_for(item, "n", "s", self.download_settings).match_episodes(files, item)
+        if not matches:
             return False
-    
-        one_season = len(item.parent.parent.seasons) == 1
-    
-        with contextlib.suppress(GarbageTorrent, TypeError):
-            parsed_file = parse(file["n"], remove_trash=True)
-            if parsed_file and item.number in parsed_file.episode and (item.parent.number in parsed_file.season or one_season):
-                item.set("folder", item.active_stream.get("name"))
-                item.set("alternative_folder", item.active_stream.get("alternative_name"))
-                item.set("file", file["n"])
-                return True
-        return False
+        item.set("folder", item.active_stream.get("name"))
+        item.set("alternative_folder", item.active_stream.get("alternative_name"))
+        item.set("file", next(iter(matches.values()))[0]["n"])
+        return True
 
     def _is_wanted_season(self, files: list, item: Season) -> bool:
         """Check if files are wanted for a season"""
         if not isinstance(item, Season):
             logger.error(f"Item is not a Season instance: {item.log_string}")
             return False
-    
-        min_size = self.download_settings.episode_filesize_min * 1_000_000
-        max_size = self.download_settings.episode_filesize_max * 1_000_000 if self.download_settings.episode_filesize_max != -1 else float("inf")
-    
-        filenames = [
-            file for file in files
-            if isinstance(file, dict) and file.get("s", 0) > min_size
-               and file.get("s", 0) < max_size
-               and splitext(file.get("n", "").lower())[1] in WANTED_FORMATS
-        ]
-    
-        if not filenames:
-            return False
-    
-        needed_episodes = {episode.number: episode for episode in item.episodes if episode.state in [States.Indexed, States.Scraped, States.Unknown, States.Failed]}
-        one_season = len(item.parent.seasons) == 1
-    
-        matched_files = {}
-        season_num = item.number
-    
-        for file in filenames:
-            with contextlib.suppress(GarbageTorrent, TypeError):
-                parsed_file = parse(file["n"], remove_trash=True)
-                if parsed_file and (season_num in parsed_file.season or one_season):
-                    for ep_num in parsed_file.episode:
-                        if ep_num in needed_episodes:
-                            matched_files[ep_num] = file["n"]
-    
-        if not matched_files:
-            return False
-    
-        if needed_episodes.keys() == matched_files.keys():
-            for ep_num, filename in matched_files.items():
-                ep = needed_episodes[ep_num]
-                ep.set("folder", item.active_stream.get("name"))
-                ep.set("alternative_folder", item.active_stream.get("alternative_name"))
-                ep.set("file", filename)
-            return True
-        return False
+        return self._assign_wanted_episodes(files, item)
 
     def _is_wanted_show(self, files: list, item: Show) -> bool:
         """Check if files are wanted for a show"""
         if not isinstance(item, Show):
             logger.error(f"Item is not a Show instance: {item.log_string}")
             return False
-    
-        min_size = self.download_settings.episode_filesize_min * 1_000_000
-        max_size = self.download_settings.episode_filesize_max * 1_000_000 if self.download_settings.episode_filesize_max != -1 else float("inf")
-    
-        filenames = [
-            file for file in files
-            if isinstance(file, dict) and file.get("s", 0) > min_size
-               and file.get("s", 0) < max_size
-               and splitext(file.get("n", "").lower())[1] in WANTED_FORMATS
-        ]
-    
-        if not filenames:
-            return False
-    
-        needed_episodes = {}
-        acceptable_states = [States.Indexed, States.Scraped, States.Unknown, States.Failed]
-    
-        for season in item.seasons:
-            if season.state in acceptable_states and season.is_released_nolog:
-                needed_episode_numbers = {episode.number for episode in season.episodes if episode.state in acceptable_states and episode.is_released_nolog}
-                if needed_episode_numbers:
-                    needed_episodes[season.number] = needed_episode_numbers
-        if not needed_episodes:
-            return False
-    
-        matched_files = {}
-        for file in filenames:
-            with contextlib.suppress(GarbageTorrent, TypeError):
-                parsed_file = parse(file["n"], remove_trash=True)
-                if parsed_file:
-                    for season_number, episodes in needed_episodes.items():
-                        if season_number in parsed_file.season:
-                            for episode_number in list(episodes):
-                                if episode_number in parsed_file.episode:
-                                    matched_files[(season_number, episode_number)] = file
-                                    episodes.remove(episode_number)
-    
-        if not matched_files:
+        return self._assign_wanted_episodes(files, item)
+
+    def _assign_wanted_episodes(self, files: list, item: MediaItem) -> bool:
+        """Give the needed episodes their files, only when every one of them is in the files."""
+        finder = file_finder_for(item, "n", "s", self.download_settings)
+        needed = needed_episodes(item)
+        matches = finder.match_episodes(files, item, needed)
+        if not matches or len(matches) < len(needed):
             return False
-    
-        all_found = all(len(episodes) == 0 for episodes in needed_episodes.values())
-    
-        if all_found:
-            for (season_number, episode_number), file in matched_files.items():
-                season = next(season for season in item.seasons if season.number == season_number)
-                episode = next(episode for episode in season.episodes if episode.number == episode_number)
-                episode.set("folder", item.active_stream.get("name"))
-                episode.set("alternative_folder", item.active_stream.get("alternative_name", None))
-                episode.set("file", file["n"])
-            return True
-        return False
+        finder.assign_files(matches, needed, item.active_stream.get("name"), item.active_stream.get("alternative_name"))
+        return True
 
     def _is_downloaded(self, item: MediaItem) -> bool:
         """Check if item is already downloaded after checking if it was cached"""
@@ -418,14 +338,22 @@ class AllDebridDownloader:
         return True
 
     def _download_item(self, item: MediaItem):
-        """Download item from all-debrid.com"""
+        """Add the item's magnet to all-debrid.com, its files are read once the magnet is ready"""
         logger.debug(f"Starting download for item: {item.log_string}")
         request_id = self.add_magnet(item)
         logger.debug(f"Magnet added to All-Debrid, request ID: {request_id} for {item.log_string}")
+        # The item is resubmitted, and comes back to `_resume_download`, once the magnet is ready
+        self.download_tracker.expect(item._id, request_id, AD_READY_STATES)
+        logger.debug(f"Waiting for magnet {request_id} to be ready for {item.log_string}")
+
+    def _resume_download(self, item: MediaItem, request_id: str, state) -> None:
+        """Read the files of the magnet the item waited on"""
+        if state in AD_FAILED_STATES:
+            logger.error(f"Magnet {request_id} for {item.log_string} failed with status code {state}")
+            return
         item.set("active_stream.id", request_id)
         self.set_active_files(item)
         logger.debug(f"Active files set for item: {item.log_string} with {len(item.active_stream.get('files', {}))} total files")
-        time.sleep(0.5)
         logger.debug(f"Item marked as downloaded: {item.log_string}")
 
     def set_active_files(self, item: MediaItem) -> None:
@@ -449,16 +377,13 @@ class AllDebridDownloader:
             item.set("alternative_folder", item.active_stream.get("alternative_name"))
     
         # Ensure that the folder and file attributes are set
+        files = [file for link in magnet_info.links for file in _flatten_files(getattr(link, "files", []))]
         if isinstance(item, (Movie, Episode)):
             if not item.file:
-                for link in magnet_info.links:
-                    if hasattr(link, "files"):
-                        for file in link.files:
-                            if isinstance(file, SimpleNamespace) and hasattr(file, "e"):
-                                for subfile in file.e:
-                                    if isinstance(item, Movie) and self._is_wanted_movie(subfile, item) or isinstance(item, Episode) and self._is_wanted_episode(subfile, item):
-                                        item.set("file", subfile.n)
-                                        break
+                if isinstance(item, Movie):
+                    self._is_wanted_movie(files, item)
+                else:
+                    self._is_wanted_episode(files, item)
             if not item.folder or not item.alternative_folder or not item.file:
                 logger.error(f"Missing folder or alternative_folder or file for item: {item.log_string}")
                 return
@@ -474,34 +399,10 @@ class AllDebridDownloader:
                     if episode.file and not episode.folder:
                         episode.set("folder", item.folder)
     
-        # Handle nested files in the links
-        for link in magnet_info.links:
-            if hasattr(link, "files"):
-                for file in link.files:
-                    if isinstance(file, SimpleNamespace) and hasattr(file, "e"):
-                        for subfile in file.e:
-                            if isinstance(item, Season) and self._is_wanted_season(link.files, item) or isinstance(item, Show) and self._is_wanted_show(link.files, item):
-                                break
-    
-        if isinstance(item, Season) and item.folder:
-            for episode in item.episodes:
-                if episode.file and not episode.folder:
-                    episode.set("folder", item.folder)
-    
-        if isinstance(item, Show) and item.folder:
-            for season in item.seasons:
-                for episode in season.episodes:
-                    if episode.file and not episode.folder:
-                        episode.set("folder", item.folder)
-    
-        # Handle nested files in the links
-        for link in magnet_info.links:
-            if hasattr(link, "files"):
-                for file in link.files:
-                    if isinstance(file, SimpleNamespace) and hasattr(file, "e"):
-                        for subfile in file.e:
-                            if isinstance(item, Season) and self._is_wanted_season(link.files, item) or isinstance(item, Show) and self._is_wanted_show(link.files, item):
-                                break
+        if isinstance(item, Season):
+            self._is_wanted_season(files, item)
+        elif isinstance(item, Show):
+            self._is_wanted_show(files, item)
 
     ### API Methods for All-Debrid below
     def add_magnet(self, item: MediaItem) -> str:
@@ -552,6 +453,19 @@ class AllDebridDownloader:
             logger.error(f"Error getting torrent info for {request_id or 'UNKNOWN'}: {e}")
         return SimpleNamespace()
 
+    def _fetch_magnet_states(self, magnet_ids: List[str]) -> dict[str, int]:
+        """Status codes of every magnet on the account, from one status request."""
+        response = get(
+            f"{AD_BASE_URL}/magnet/status?{AD_PARAM_AGENT}",
+            additional_headers=self.auth_headers,
+            proxies=self.proxy,
+            specific_rate_limiter=self.inner_rate_limit,
+            overall_rate_limiter=self.overall_rate_limiter
+        )
+        if not response.is_ok or getattr(response.data, "status", None) != "success":
+            raise ValueError(f"Failed to get magnet status: {response.data}")
+        return {str(magnet.id): magnet.statusCode for magnet in getattr(response.data.data, "magnets", None) or []}
+
     def get_torrent(self, hash_key: str) -> dict[str, SimpleNamespace]:
         """Get torrents from All-Debrid"""
         try:
@@ -630,4 +544,21 @@ class AllDebridDownloader:
             return True
     
         logger.debug(f"No matching item found for {item.log_string}")
-        return False
\ No newline at end of file
+        return False
+
+
+## Helper functions for All-Debrid below
+
+
+def _flatten_files(files) -> list[dict]:
+    """Flatten All-Debrid's nested file tree ("e" holds the entries of a folder) into name and size dicts."""
+    flat = []
+    for file in files or []:
+        entry = vars(file) if isinstance(file, SimpleNamespace) else file
+        if not isinstance(entry, dict):
+            continue
+        if entry.get("e"):
+            flat.extend(_flatten_files(entry["e"]))
+        elif entry.get("n"):
+            flat.append({"n": entry["n"], "s": entry.get("s", 0)})
+    return flat
@@ -0,0 +1,243 @@
+"""Instant availability cache and checker shared by the debrid downloaders"""
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from utils.cache import Cache
+from utils.logger import logger
+from utils.ratelimiter import RateLimiter
+
+# Cached torrents rarely disappear, uncached ones may become cached any moment
+AVAILABLE_TTL = 60 * 60
+UNAVAILABLE_TTL = 15 * 60
+MAX_ENTRIES = 50_000
+
+# Stay well below the ~8KB request line most proxies and servers accept
+MAX_URL_LENGTH = 2000
+MAX_IN_FLIGHT = 4
+
+# How long the Downloader waits on a prefetch still in flight for its item
+PREFETCH_WAIT = 30
+
+
+class AvailabilityCache:
+    """
+    Availability results keyed by (provider, infohash), shared across items.
+
+    Episodes of a season, retries and rescrapes ask about the same pack hashes over
+    and over, with this only the hashes that were never seen, or whose result has
+    expired, have to be checked with the provider. The value stored is whatever the
+    provider returned for the hash (its file containers), `None` marks a hash the
+    provider does not have cached.
+    """
+
+    def __init__(self, maxsize: int = MAX_ENTRIES, ttl: float = AVAILABLE_TTL, negative_ttl: float = UNAVAILABLE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = Cache("Availability", maxsize=maxsize, ttl=ttl)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @staticmethod
+    def _key(provider: str, infohash: str) -> Tuple[str, str]:
+        return provider, infohash.lower()
+
+    def get_many(self, provider: str, infohashes: Iterable[str]) -> Tuple[dict[str, Optional[Any]], list[str]]:
+        """
+        Split `infohashes` into known results and hashes still to be checked.
+
+        Known results map the infohash to its containers, or to `None` when the
+        provider is known not to have it cached.
+        """
+        known, unknown = {}, []
+        for infohash in infohashes:
+            entry = self._cache.get(self._key(provider, infohash))
+            if entry is None:
+                unknown.append(infohash)
+            else:
+                known[infohash] = entry.value
+        self.hits += len(known)
+        self.misses += len(unknown)
+        return known, unknown
+
+    def set(self, provider: str, infohash: str, containers: Optional[Any]) -> None:
+        """Store the containers for a cached hash, or `None` for an uncached one."""
+        ttl = self.ttl if containers else self.negative_ttl
+        self._cache.set(self._key(provider, infohash), containers or None, ttl=ttl, stale_ttl=0)
+
+    def invalidate(self, provider: str, infohash: str) -> None:
+        self._cache.delete(self._key(provider, infohash))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+availability_cache = AvailabilityCache()
+
+
+class AvailabilityChecker:
+    """
+    Pipelined availability checks for a single provider.
+
+    Hashes missing from the availability cache are split into batches as large
+    as the provider's batch and URL length limits allow, several batches are kept
+    in flight within the remaining rate limiter budget, and results are evaluated
+    in rank order as soon as they arrive. Once `evaluate` accepts a hash, batches
+    which have not been sent yet are cancelled. Batches already in flight still
+    complete and fill the cache for the next item.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        fetch: Callable[[List[str]], dict[str, Optional[Any]]],
+        max_batch: int,
+        base_url_length: int = 0,
+        hash_url_length: int = 41,
+        max_url_length: int = MAX_URL_LENGTH,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        rate_limiter: Optional[RateLimiter] = None,
+        cache: Optional[AvailabilityCache] = None,
+    ):
+        self.provider = provider
+        self.fetch = fetch
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.batch_size = max(1, min(max_batch, (max_url_length - base_url_length) // hash_url_length))
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"{provider}Availability")
+
+    @property
+    def _cache(self) -> AvailabilityCache:
+        return self.cache if self.cache is not None else availability_cache
+
+    def batches(self, infohashes: List[str]) -> List[List[str]]:
+        return [infohashes[i:i + self.batch_size] for i in range(0, len(infohashes), self.batch_size)]
+
+    def _allowed_in_flight(self) -> int:
+        if not self.rate_limiter:
+            return self.max_in_flight
+        return max(1, min(self.max_in_flight, int(self.rate_limiter.tokens)))
+
+    def _fetch(self, batch: List[str]) -> dict[str, Optional[Any]]:
+        results = self.fetch(batch)
+        for infohash in batch:
+            self._cache.set(self.provider, infohash, results.get(infohash))
+        return results
+
+    def check(self, infohashes: List[str], evaluate: Callable[[str, Optional[Any]], bool]) -> Optional[str]:
+        """
+        Call `evaluate(infohash, containers)` in the order of `infohashes` until it returns True.
+
+        `containers` is `None` for hashes the provider does not have cached. Hashes
+        whose batch failed are skipped. Returns the accepted infohash, if any.
+        """
+        infohashes = list(dict.fromkeys(infohashes))
+        known, unknown = self._cache.get_many(self.provider, infohashes)
+        pending = deque(self.batches(unknown))
+        futures: dict[str, Future] = {}
+
+        def submit():
+            while pending and sum(not f.done() for f in set(futures.values())) < self._allowed_in_flight():
+                batch = pending.popleft()
+                future = self._executor.submit(self._fetch, batch)
+                for infohash in batch:
+                    futures[infohash] = future
+
+        try:
+            for infohash in infohashes:
+                if infohash in known:
+                    result = known[infohash]
+                else:
+                    # Batches go out in rank order and every earlier batch has been waited
+                    # on already, so there is always room for the batch holding this hash
+                    submit()
+                    try:
+                        result = futures[infohash].result().get(infohash)
+                    except Exception as e:
+                        logger.debug(f"Availability check failed on {self.provider} for {infohash}: {e}")
+                        continue
+                if evaluate(infohash, result):
+                    return infohash
+            return None
+        finally:
+            for future in set(futures.values()):
+                future.cancel()
+
+    def lookup(self, infohashes: List[str]) -> dict[str, Optional[Any]]:
+        """Return the availability of every hash, fetching the ones not cached yet."""
+        results = {}
+
+        def collect(infohash: str, containers: Optional[Any]) -> bool:
+            results[infohash] = containers
+            return False
+
+        self.check(infohashes, collect)
+        return results
+
+
+class AvailabilityPrefetcher:
+    """
+    Looks up the best ranked hashes of scraped items in the background.
+
+    Scraped items can wait a while in the Downloader pool. Checking their top
+    ranked hashes meanwhile fills the availability cache, so by the time the
+    Downloader gets to an item the cached stream is known and the magnet can be
+    added right away. The Downloader waits for a prefetch still in flight instead
+    of checking the same hashes again.
+    """
+
+    def __init__(self, top_n: int, max_workers: int = 2):
+        self.top_n = top_n
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="AvailabilityPrefetch")
+        self._pending: dict[str, List[Future]] = {}
+        self._lock = threading.Lock()
+
+    def hashes(self, item: Any) -> List[str]:
+        """The item's top ranked hashes that are not blacklisted."""
+        streams = [stream for stream in item.streams if stream.infohash and not item.is_stream_blacklisted(stream)]
+        streams.sort(key=lambda stream: stream.rank, reverse=True)
+        return [stream.infohash for stream in streams[:self.top_n]]
+
+    def submit(self, item: Any, checkers: List[AvailabilityChecker]) -> int:
+        """Start looking the item's hashes up with every checker, returns the number of hashes."""
+        hashes = self.hashes(item)
+        if not hashes or not checkers:
+            return 0
+        key = item.item_id
+        futures = [self._executor.submit(checker.lookup, hashes) for checker in checkers]
+        with self._lock:
+            self._pending[key] = futures
+        for future in futures:
+            future.add_done_callback(lambda _, key=key, futures=futures: self._done(key, futures))
+        logger.debug(f"Prefetching availability of {len(hashes)} hashes for {item.log_string}")
+        return len(hashes)
+
+    def _done(self, key: str, futures: List[Future]) -> None:
+        with self._lock:
+            if self._pending.get(key) is futures and all(future.done() for future in futures):
+                del self._pending[key]
+
+    def pending(self, item: Any) -> bool:
+        with self._lock:
+            return item.item_id in self._pending
+
+    def wait(self, item: Any, timeout: float = PREFETCH_WAIT) -> None:
+        """Block until the item's prefetch, if any, has finished."""
+        with self._lock:
+            futures = self._pending.get(item.item_id)
+        if futures:
+            wait(futures, timeout=timeout)
@@ -0,0 +1,186 @@
+"""Racing several debrid providers against each other"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from program.media.item import MediaItem
+from utils.logger import logger
+
+# Consecutive failures before a provider is skipped for a while
+MAX_CONSECUTIVE_FAILURES = 3
+COOLDOWN = 5 * 60
+# Weight of the latest sample in the moving average latency
+LATENCY_SMOOTHING = 0.3
+
+
+@dataclass
+class ProviderStats:
+    """Health and latency of one provider, as seen by the downloader."""
+    name: str
+    lookups: int = 0
+    failed_lookups: int = 0
+    downloads: int = 0
+    failed_downloads: int = 0
+    consecutive_failures: int = 0
+    latency: Optional[float] = None
+    cooldown_until: float = 0.0
+    last_error: Optional[str] = None
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    @property
+    def success_ratio(self) -> float:
+        attempts = self.lookups + self.downloads
+        failures = self.failed_lookups + self.failed_downloads
+        return 1.0 if not attempts else (attempts - failures) / attempts
+
+    def record_latency(self, seconds: float) -> None:
+        self.latency = seconds if self.latency is None else (
+            LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * self.latency
+        )
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+
+    def record_failure(self, error: str) -> None:
+        self.last_error = error
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            self.cooldown_until = time.monotonic() + COOLDOWN
+            self.consecutive_failures = 0
+            logger.warning(f"{self.name} failed {MAX_CONSECUTIVE_FAILURES} times in a row, skipping it for {COOLDOWN}s")
+
+    def to_dict(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lookups": self.lookups,
+            "failed_lookups": self.failed_lookups,
+            "downloads": self.downloads,
+            "failed_downloads": self.failed_downloads,
+            "success_ratio": round(self.success_ratio, 4),
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+def rate_budget(service: Any) -> float:
+    """Fraction of the provider's overall rate limit still available, 1.0 without a limiter."""
+    limiter = getattr(service, "overall_rate_limiter", None)
+    if not limiter or not limiter.max_calls:
+        return 1.0
+    if time.time() - limiter.last_call >= limiter.period:
+        return 1.0
+    return max(0.0, limiter.tokens / limiter.max_calls)
+
+
+class ProviderRace:
+    """
+    Picks, per item, which of several enabled debrid providers downloads it.
+
+    Availability of the item's streams is looked up on every healthy provider at
+    once (filling each provider's availability cache). Walking the streams by rank,
+    the first stream cached anywhere decides the candidates: the providers that have
+    it cached, best rate budget, health and latency first. The chosen provider then
+    runs as it would on its own, answered from its availability cache. If it cannot
+    use any of its cached streams the next candidate gets a go with the item's
+    streams as they were before.
+    """
+
+    def __init__(self, services: List[Any]):
+        self.services = services
+        self.stats: Dict[str, ProviderStats] = {service.key: ProviderStats(service.key) for service in services}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(services)), thread_name_prefix="DebridRace")
+
+    def _lookup(self, service: Any, hashes: List[str]) -> Optional[dict]:
+        stats = self.stats[service.key]
+        started = time.monotonic()
+        try:
+            results = service.availability_checker.lookup(hashes)
+        except Exception as e:
+            with self._lock:
+                stats.lookups += 1
+                stats.failed_lookups += 1
+                stats.record_failure(str(e))
+            logger.debug(f"Availability lookup failed on {service.key}: {e}")
+            return None
+        with self._lock:
+            stats.lookups += 1
+            stats.record_latency(time.monotonic() - started)
+            if len(results) < len(hashes):
+                stats.failed_lookups += 1
+                stats.record_failure(f"{len(hashes) - len(results)} hashes could not be checked")
+            else:
+                stats.record_success()
+        return results
+
+    def _score(self, service: Any) -> tuple:
+        stats = self.stats[service.key]
+        latency = stats.latency if stats.latency is not None else 0.0
+        return (-rate_budget(service) * stats.success_ratio, latency)
+
+    def _availability(self, item: MediaItem) -> tuple[List[str], Dict[Any, dict]]:
+        """The item's usable hashes best ranked first, and their availability on every provider that answered."""
+        services = [service for service in self.services if self.stats[service.key].healthy]
+        streams = sorted(item.streams, key=lambda stream: stream.rank, reverse=True)
+        hashes = [stream.infohash for stream in streams if not item.is_stream_blacklisted(stream)]
+        if not services or not hashes:
+            return hashes, {}
+
+        futures = {service: self._executor.submit(self._lookup, service, hashes) for service in services}
+        availability = {service: future.result() for service, future in futures.items()}
+        return hashes, {service: results for service, results in availability.items() if results is not None}
+
+    def candidates(self, hashes: List[str], available: Dict[Any, dict]) -> List[Any]:
+        """Providers to try, ordered by their best ranked cached hash, then by budget, health and latency."""
+        ordered, seen = [], set()
+        for infohash in hashes:
+            cached = [service for service, results in available.items() if results.get(infohash) and service not in seen]
+            for service in sorted(cached, key=self._score):
+                ordered.append(service)
+                seen.add(service)
+        return ordered
+
+    def run(self, item: MediaItem) -> bool:
+        hashes, available = self._availability(item)
+        candidates = self.candidates(hashes, available)
+        if not candidates:
+            if available:
+                # Every provider that answered knows these are not cached
+                uncached = {h for h in hashes if all(h in results and not results[h] for results in available.values())}
+                item.blacklist_streams([stream for stream in item.streams if stream.infohash in uncached])
+            logger.log("NOT_FOUND", f"No cached streams found on any debrid provider for {item.log_string}")
+            return False
+
+        streams, blacklisted = list(item.streams), list(item.blacklisted_streams)
+        files = {key: getattr(item, key) for key in ("file", "folder", "alternative_folder")}
+        for service in candidates:
+            stats = self.stats[service.key]
+            try:
+                downloaded = service.run(item) or bool((item.active_stream or {}).get("id"))
+            except Exception as e:
+                logger.error(f"{service.key} failed to download {item.log_string}: {e}")
+                downloaded = False
+                with self._lock:
+                    stats.record_failure(str(e))
+            with self._lock:
+                stats.downloads += 1
+                if not downloaded:
+                    stats.failed_downloads += 1
+            if downloaded:
+                logger.log("DEBRID", f"Downloaded {item.log_string} with {service.key}")
+                return True
+            if service is not candidates[-1]:
+                # Streams blacklisted by this provider may be usable on the next one
+                item.set("active_stream", {})
+                item.streams, item.blacklisted_streams = list(streams), list(blacklisted)
+                for key, value in files.items():
+                    item.set(key, value)
+        return False
+
+    def get_stats(self) -> dict:
+        return {key: stats.to_dict() for key, stats in self.stats.items()}
@@ -1,19 +1,20 @@
 """Realdebrid module"""
 
-import contextlib
-import time
 from datetime import datetime
 from os.path import splitext
 from pathlib import Path
 from types import SimpleNamespace
-from typing import Generator, List
+from typing import List
 
+from program.downloaders.availability import AvailabilityChecker
+from program.downloaders.registry import TorrentRegistry, assign_pack_files
+from program.downloaders.shared import file_finder_for, needed_episodes
+from program.downloaders.torrents import PAGE_SIZE, TorrentMirror
+from program.downloaders.tracker import DownloadStateTracker
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.media.state import States
 from program.settings.manager import settings_manager
 from requests import ConnectTimeout
-from RTN.exceptions import GarbageTorrent
-from RTN.parser import parse
 from RTN.patterns import extract_episodes
 from utils.logger import logger
 from utils.ratelimiter import RateLimiter
@@ -21,6 +22,9 @@ from utils.request import get, ping, post
 
 WANTED_FORMATS = {".mkv", ".mp4", ".avi"}
 RD_BASE_URL = "https://api.real-debrid.com/rest/1.0"
+RD_AVAILABILITY_BATCH = 40
+RD_SELECTABLE_STATES = {"waiting_files_selection", "downloaded"}
+RD_FAILED_STATES = {"magnet_error", "error", "virus", "dead"}
 
 
 class RealDebridDownloader:
@@ -35,6 +39,16 @@ class RealDebridDownloader:
         self.proxy = self.settings.proxy_url if self.settings.proxy_enabled else None
         self.torrents_rate_limiter = RateLimiter(1, 1)
         self.overall_rate_limiter = RateLimiter(60, 60)
+        self.availability_checker = AvailabilityChecker(
+            self.key,
+            self._fetch_availability,
+            max_batch=RD_AVAILABILITY_BATCH,
+            base_url_length=len(f"{RD_BASE_URL}/torrents/instantAvailability/"),
+            rate_limiter=self.overall_rate_limiter,
+        )
+        self.torrents = TorrentMirror(self.key, self._fetch_torrents)
+        self.registry = TorrentRegistry(self.key)
+        self.download_tracker = DownloadStateTracker(self.key, self._fetch_torrent_states, failed_states=RD_FAILED_STATES)
         self.initialized = self.validate()
         if not self.initialized:
             return
@@ -105,7 +119,11 @@ class RealDebridDownloader:
         return_value = False
         if not item:
             return return_value
-        if self.is_cached(item) and not self._is_downloaded(item):
+        waited = self.download_tracker.pop_result(item._id)
+        if waited:
+            self._resume_download(item, *waited)
+            return_value = True
+        elif self.is_cached(item) and not self._is_downloaded(item):
             self._download_item(item)
             return_value = True
         self.log_item(item)
@@ -134,11 +152,6 @@ class RealDebridDownloader:
         if not item.get("streams", []):
             return False
 
-        def _chunked(lst: List, n: int) -> Generator[List, None, None]:
-            """Yield successive n-sized chunks from lst."""
-            for i in range(0, len(lst), n):
-                yield lst[i:i + n]
-
         logger.log("DEBRID", f"Processing {len(item.streams)} streams for {item.log_string}")
 
         processed_stream_hashes = set()
@@ -151,32 +164,35 @@ class RealDebridDownloader:
             logger.log("NOT_FOUND", f"No streams found from filtering out processed and blacklisted hashes for: {item.log_string}")
             return False
 
-        for stream_chunk in _chunked(filtered_streams, 5):
-            streams = "/".join(stream_chunk)
-            try:
-                response = get(f"{RD_BASE_URL}/torrents/instantAvailability/{streams}/", additional_headers=self.auth_headers, proxies=self.proxy, response_type=dict, specific_rate_limiter=self.torrents_rate_limiter, overall_rate_limiter=self.overall_rate_limiter)
-                if response.is_ok and response.data and isinstance(response.data, dict):
-                    if self._evaluate_stream_response(response.data, processed_stream_hashes, item):
-                        return True
-                    processed_stream_hashes.update(stream_chunk)
-            except Exception as e:
-                logger.exception(f"Error checking cache for streams: {str(e)}", exc_info=True)
-                continue
+        def evaluate(stream_hash: str, provider_list: dict) -> bool:
+            processed_stream_hashes.add(stream_hash)
+            return self._evaluate_stream_response({stream_hash: provider_list or {}}, processed_stream_hashes, item)
+
+        if self.availability_checker.check(filtered_streams, evaluate):
+            return True
 
         if item.type == "movie" or item.type == "episode":
-            for hash in filtered_streams:
-                stream = next((stream for stream in item.streams if stream.infohash == hash), None)
-                if stream and not item.is_stream_blacklisted(stream):
-                    item.blacklist_stream(stream)
-                    logger.debug(f"Blacklisted stream for {item.log_string} with hash: {hash}")
+            unavailable = set(filtered_streams)
+            item.blacklist_streams([stream for stream in item.streams if stream.infohash in unavailable])
 
         logger.log("NOT_FOUND", f"No wanted cached streams found for {item.log_string} out of {len(filtered_streams)}")
         return False
 
+    def _fetch_availability(self, hashes: List[str]) -> dict:
+        """Fetch instant availability for a batch of hashes, mapping uncached hashes to None."""
+        response = get(f"{RD_BASE_URL}/torrents/instantAvailability/{'/'.join(hashes)}/", additional_headers=self.auth_headers, proxies=self.proxy, response_type=dict, overall_rate_limiter=self.overall_rate_limiter)
+        if not response.is_ok or not isinstance(response.data, dict):
+            raise ValueError(f"Unexpected instant availability response: {response.data}")
+        results = {}
+        for stream_hash in hashes:
+            provider_list = response.data.get(stream_hash) or response.data.get(stream_hash.lower())
+            results[stream_hash] = provider_list if isinstance(provider_list, dict) and provider_list.get("rd") else None
+        return results
+
     def _evaluate_stream_response(self, data: dict, processed_stream_hashes: set, item: MediaItem) -> bool:
         """Evaluate the response data from the stream availability check."""
         for stream_hash, provider_list in data.items():
-            stream = next((stream for stream in item.streams if stream.infohash == stream_hash), None)
+            stream = item.get_stream(stream_hash)
             if not stream or item.is_stream_blacklisted(stream):
                 continue
 
@@ -244,31 +260,13 @@ class RealDebridDownloader:
             logger.error(f"Item is not a Movie instance: {item.log_string}")
             return False
 
-        min_size = self.download_settings.movie_filesize_min * 1_000_000
-        max_size = self.download_settings.movie_filesize_max * 1_000_000 if self.download_settings.movie_filesize_max != -1 else float("inf")
-
-        filenames = sorted(
-            (file for file in container.values() if file and file["filesize"] > min_size
-            and file["filesize"] < max_size
-            and splitext(file["filename"].lower())[1] in WANTED_FORMATS),
-            key=lambda file: file["filesize"], reverse=True
-        )
-
-        if not filenames:
+        file = file_finder_for(item, "filename", "filesize", self.download_settings).find_movie(container)
+        if not file:
             return False
-
-        for file in filenames:
-            if not file or "sample" in file["filename"].lower():
-                continue
-            with contextlib.suppress(GarbageTorrent, TypeError):
-                parsed_file = parse(file["filename"], remove_trash=True)
-                if not parsed_file or not parsed_file.parsed_title:
-                    continue
-                item.set("folder", item.active_stream.get("name"))
-                item.set("alternative_folder", item.active_stream.get("alternative_name", None))
-                item.set("file", file["filename"])
-                return True
-        return False
+        item.set("folder", item.active_stream.get("name"))
+        item.set("alternative_folder", item.active_stream.get("alternative_name", None))
+        item.set("file", file["filename"])
+        return True
 
     def _is_wanted_episode(self, container: dict, item: Episode) -> bool:
         """Check if container has wanted files for an episode"""
@@ -276,161 +274,37 @@ class RealDebridDownloader:
             logger.error(f"Item is not an Episode instance: {item.log_string}")
             return False
 
-        min_size = self.download_settings.episode_filesize_min * 1_000_000
-        max_size = self.download_settings.episode_filesize_max * 1_000_000 if self.download_settings.episode_filesize_max != -1 else float("inf")
-
-        filenames = [
-            file for file in container.values()
-            if file and file["filesize"] > min_size
-            and file["filesize"] < max_size
-            and splitext(file["filename"].lower())[1] in WANTED_FORMATS
-        ]
-
-        if not filenames:
+        matches = file_finder_for(item, "filename", "filesize", self.download_settings).match_episodes(container, item)
+        if not matches:
             return False
-
-        one_season = len(item.parent.parent.seasons) == 1
-
-        for file in filenames:
-            if not file or not file.get("filename"):
-                continue
-            with contextlib.suppress(GarbageTorrent, TypeError):
-                parsed_file = parse(file["filename"], remove_trash=True)
-                if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
-                    continue
-                if item.number in parsed_file.episode and item.parent.number in parsed_file.season or one_season and item.number in parsed_file.episode:
-                    item.set("folder", item.active_stream.get("name"))
-                    item.set("alternative_folder", item.active_stream.get("alternative_name"))
-                    item.set("file", file["filename"])
-                    return True
-        return False
+        item.set("folder", item.active_stream.get("name"))
+        item.set("alternative_folder", item.active_stream.get("alternative_name"))
+        item.set("file", next(iter(matches.values()))[0]["filename"])
+        return True
 
     def _is_wanted_season(self, container: dict, item: Season) -> bool:
         """Check if container has wanted files for a season"""
         if not isinstance(item, Season):
             logger.error(f"Item is not a Season instance: {item.log_string}")
             return False
-
-        min_size = self.download_settings.episode_filesize_min * 1_000_000
-        max_size = self.download_settings.episode_filesize_max * 1_000_000 if self.download_settings.episode_filesize_max != -1 else float("inf")
-
-        # Filter and sort files once to improve performance
-        filenames = [
-            file for file in container.values()
-            if file and file["filesize"] > min_size
-            and file["filesize"] < max_size
-            and splitext(file["filename"].lower())[1] in WANTED_FORMATS
-        ]
-
-        if not filenames:
-            return False
-
-        acceptable_states = [States.Indexed, States.Scraped, States.Unknown, States.Failed, States.PartiallyCompleted]
-
-        needed_episodes = []
-        for episode in item.episodes:
-            if episode.state in acceptable_states and episode.is_released_nolog:
-                needed_episodes.append(episode.number)
-
-        if not needed_episodes:
-            return False
-
-        # Dictionary to hold the matched files for each episode
-        matched_files = {}
-        one_season = len(item.parent.seasons) == 1
-
-        # Parse files once and assign to episodes
-        for file in filenames:
-            with contextlib.suppress(GarbageTorrent, TypeError):
-                parsed_file = parse(file["filename"], remove_trash=True)
-                if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
-                    continue
-
-                if one_season or item.number in parsed_file.season:
-                    for episode_number in parsed_file.episode:
-                        if episode_number in needed_episodes:
-                            matched_files.setdefault(episode_number, []).append(file["filename"])
-
-        if any(matched_files.values()):
-            for ep_num, filenames in matched_files.items():
-                for filename in filenames:
-                    if not filename or "sample" in filename.lower():
-                        continue
-                    ep = next(episode for episode in item.episodes if episode.number == ep_num)
-                    ep.set("folder", item.active_stream.get("name"))
-                    ep.set("alternative_folder", item.active_stream.get("alternative_name"))
-                    ep.set("file", filename)
-            return True
-        return False
+        return self._assign_wanted_episodes(container, item)
 
     def _is_wanted_show(self, container: dict, item: Show) -> bool:
         """Check if container has wanted files for a show"""
         if not isinstance(item, Show):
             logger.error(f"Item is not a Show instance: {item.log_string}")
             return False
-
-        min_size = self.download_settings.episode_filesize_min * 1_000_000
-        max_size = self.download_settings.episode_filesize_max * 1_000_000 if self.download_settings.episode_filesize_max != -1 else float("inf")
-
-        # Filter and sort files once to improve performance
-        filenames = [
-            file for file in container.values()
-            if file and min_size < file["filesize"] < max_size
-            and splitext(file["filename"].lower())[1] in WANTED_FORMATS
-        ]
-
-        if not filenames:
+        return self._assign_wanted_episodes(container, item)
+
+    def _assign_wanted_episodes(self, container: dict, item: MediaItem) -> bool:
+        """Give every needed episode of a season or show with a file in the container that file."""
+        finder = file_finder_for(item, "filename", "filesize", self.download_settings)
+        needed = needed_episodes(item)
+        matches = finder.match_episodes(container, item, needed)
+        if not matches:
             return False
-
-        # Create a dictionary to map seasons and episodes needed
-        needed_episodes = {}
-        acceptable_states = [States.Indexed, States.Scraped, States.Unknown, States.Failed, States.PartiallyCompleted]
-
-        for season in item.seasons:
-            if season.state in acceptable_states and season.is_released_nolog:
-                needed_episode_numbers = {episode.number for episode in season.episodes if episode.state in acceptable_states and episode.is_released_nolog}
-                if needed_episode_numbers:
-                    needed_episodes[season.number] = needed_episode_numbers
-
-        if not any(needed_episodes.values()):
-            return False
-
-        # logger.debug(f"Checking {len(filenames)} files in container for {item.log_string}")
-        # for file in filenames:
-        #     logger.debug(f"Looking at file: {file['filename']} with size: {file['filesize']}")
-
-        # Iterate over each file to check if it matches
-        # the season and episode within the show
-        matched_files = {}
-        one_season = len(item.seasons) == 1
-
-        for file in filenames:
-            with contextlib.suppress(GarbageTorrent, TypeError):
-                parsed_file = parse(file["filename"], remove_trash=True)
-                if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
-                    continue
-
-                # Check each season and episode to find a match
-                for season_number, episodes in needed_episodes.items():
-                    if one_season or season_number in parsed_file.season:
-                        for episode_number in parsed_file.episode:
-                            if episode_number in episodes:
-                                # Store the matched file for this episode
-                                matched_files.setdefault((season_number, episode_number), []).append(file["filename"])
-
-        if any(matched_files.values()):
-            for key, filenames in matched_files.items():
-                season_number, episode_number = key
-                for filename in filenames:
-                    if not filename or "sample" in filename.lower():
-                        continue
-                    season = next(season for season in item.seasons if season.number == season_number)
-                    episode = next(episode for episode in season.episodes if episode.number == episode_number)
-                    episode.set("folder", item.active_stream.get("name"))
-                    episode.set("alternative_folder", item.active_stream.get("alternative_name", None))
-                    episode.set("file", filename)
-            return True
-        return False
+        finder.assign_files(matches, needed, item.active_stream.get("name"), item.active_stream.get("alternative_name"))
+        return True
 
     def _is_downloaded(self, item: MediaItem) -> bool:
         """Check if item is already downloaded after checking if it was cached"""
@@ -439,9 +313,17 @@ class RealDebridDownloader:
             logger.log("DEBRID", f"Item missing hash, skipping check: {item.log_string}")
             return False
 
+        entry = self._registered_torrent(hash_key)
+        if entry and entry.files is None:
+            # Added for another item and not ready yet, the download waits on it as well
+            return False
+        if entry:
+            logger.debug(f"Reusing torrent {entry.torrent_id} already added for hash: {hash_key}")
+            self._use_registered_torrent(item, entry)
+            return True
+
         logger.debug(f"Checking if torrent is already downloaded for item: {item.log_string}")
-        torrents = self.get_torrents(1000)
-        torrent = torrents.get(hash_key)
+        torrent = self.torrents.get_by_hash(hash_key)
 
         if not torrent:
             logger.debug(f"No matching torrent found for hash: {hash_key}")
@@ -463,19 +345,74 @@ class RealDebridDownloader:
         item.set("active_stream.id", torrent.id)
         self.set_active_files(item)
         logger.debug(f"Set active files for item: {item.log_string} with {len(item.active_stream.get('files', {}))} total files")
+        self.registry.register(
+            hash_key, torrent.id, files=item.active_stream.get("files"),
+            name=item.active_stream.get("name"), alternative_name=item.active_stream.get("alternative_name")
+        )
+        self._assign_pack_files(item)
         return True
 
+    def _registered_torrent(self, hash_key: str):
+        """Get the registered torrent for the hash, dropping it if it is no longer on the account."""
+        entry = self.registry.get(hash_key)
+        if entry and not self.torrents.get_by_id(entry.torrent_id):
+            logger.debug(f"Registered torrent {entry.torrent_id} is no longer on the account, forgetting it")
+            self.registry.remove(entry.torrent_id)
+            return None
+        return entry
+
+    def _use_registered_torrent(self, item: MediaItem, entry) -> None:
+        """Point the item at a torrent that was already added and had its files selected."""
+        item.set("active_stream.id", entry.torrent_id)
+        self._set_folders(item, entry.name, entry.alternative_name)
+        self._assign_pack_files(item)
+
+    def _assign_pack_files(self, item: MediaItem) -> None:
+        files = item.active_stream.get("files") or {}
+        assign_pack_files(item, [file["filename"] for file in files.values() if file and file.get("filename")])
+
     def _download_item(self, item: MediaItem):
-        """Download item from real-debrid.com"""
+        """Add the item's torrent to real-debrid.com, its files are selected once the torrent is ready"""
         logger.debug(f"Starting download for item: {item.log_string}")
-        request_id = self.add_magnet(item) # uses item.active_stream.hash
-        logger.debug(f"Magnet added to Real-Debrid, request ID: {request_id} for {item.log_string}")
+        hash_key = item.active_stream.get("hash")
+        entry, added = self.registry.get_or_add(hash_key, lambda: self.add_magnet(item))
+        if not entry:
+            logger.error(f"Failed to add magnet for {item.log_string}")
+            return
+        if added:
+            logger.debug(f"Magnet added to Real-Debrid, request ID: {entry.torrent_id} for {item.log_string}")
+        elif entry.files is not None:
+            logger.debug(f"Torrent {entry.torrent_id} was added meanwhile, reusing it for {item.log_string}")
+            self._use_registered_torrent(item, entry)
+            return
+        # The item is resubmitted, and comes back to `_resume_download`, once the torrent is ready
+        self.download_tracker.expect(item._id, entry.torrent_id, RD_SELECTABLE_STATES)
+        logger.debug(f"Waiting for torrent {entry.torrent_id} to be ready for file selection for {item.log_string}")
+
+    def _resume_download(self, item: MediaItem, request_id: str, state) -> None:
+        """Select the files of the torrent the item waited on, unless another item waiting on it already did"""
+        hash_key = item.active_stream.get("hash")
+        if state in RD_FAILED_STATES:
+            logger.error(f"Torrent {request_id} for {item.log_string} failed with status {state}")
+            self.registry.remove(request_id)
+            return
+        entry = self.registry.get(hash_key)
+        if entry and entry.files is not None:
+            logger.debug(f"Files of torrent {entry.torrent_id} were selected meanwhile, reusing it for {item.log_string}")
+            self._use_registered_torrent(item, entry)
+            return
+        if state is None:
+            logger.warning(f"Torrent {request_id} did not become ready for file selection, selecting files anyway")
         item.set("active_stream.id", request_id)
         self.set_active_files(item)
         logger.debug(f"Active files set for item: {item.log_string} with {len(item.active_stream.get('files', {}))} total files")
-        time.sleep(0.5)
         self.select_files(request_id, item)
         logger.debug(f"Files selected for request ID: {request_id} for {item.log_string}")
+        self.registry.set_files(
+            hash_key, item.active_stream.get("files"),
+            name=item.active_stream.get("name"), alternative_name=item.active_stream.get("alternative_name")
+        )
+        self._assign_pack_files(item)
         logger.debug(f"Item marked as downloaded: {item.log_string}")
 
     def set_active_files(self, item: MediaItem) -> None:
@@ -490,8 +427,13 @@ class RealDebridDownloader:
             logger.error(f"Failed to get torrent info for item: {item.log_string}")
             return
 
-        item.active_stream["alternative_name"] = getattr(info, "original_filename", None)
-        item.active_stream["name"] = getattr(info, "filename", None)
+        self._set_folders(item, getattr(info, "filename", None), getattr(info, "original_filename", None))
+
+    @staticmethod
+    def _set_folders(item: MediaItem, name: str, alternative_name: str) -> None:
+        """Set the torrent's folder names on the item and the episodes it holds."""
+        item.active_stream["alternative_name"] = alternative_name
+        item.active_stream["name"] = name
 
         if not item.folder or not item.alternative_folder:
             item.set("folder", item.active_stream.get("name"))
@@ -534,6 +476,7 @@ class RealDebridDownloader:
                 overall_rate_limiter=self.overall_rate_limiter
             )
             if response.is_ok:
+                self.torrents.add(SimpleNamespace(id=response.data.id, hash=hash.lower()))
                 return response.data.id
             logger.error(f"Failed to add magnet: {response.data}")
         except Exception as e:
@@ -584,6 +527,34 @@ class RealDebridDownloader:
             logger.error(f"Error selecting files for {item.log_string}: {e}")
             return False
 
+    def _fetch_torrents(self, offset: int, limit: int) -> List[SimpleNamespace]:
+        """Fetch a page of the torrent list, newest first."""
+        response = get(
+            f"{RD_BASE_URL}/torrents?offset={offset}&limit={limit}",
+            additional_headers=self.auth_headers,
+            proxies=self.proxy,
+            specific_rate_limiter=self.torrents_rate_limiter,
+            overall_rate_limiter=self.overall_rate_limiter
+        )
+        if not response.is_ok:
+            raise ValueError(f"Failed to list torrents: {response.data}")
+        return response.data or []
+
+    def _fetch_torrent_states(self, torrent_ids: List[str]) -> dict[str, str]:
+        """Status of the given torrents, from one listing of the newest torrents."""
+        wanted = set(torrent_ids)
+        states = {
+            torrent.id: torrent.status
+            for torrent in self._fetch_torrents(0, max(PAGE_SIZE, len(wanted)))
+            if torrent.id in wanted
+        }
+        # Torrents added long ago fall off the first page
+        for torrent_id in wanted - states.keys():
+            info = self.get_torrent_info(torrent_id)
+            if getattr(info, "status", None):
+                states[torrent_id] = info.status
+        return states
+
     def get_torrents(self, limit: int) -> dict[str, SimpleNamespace]:
         """Get torrents from real-debrid.com"""
         try:
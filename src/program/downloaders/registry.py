@@ -0,0 +1,131 @@
+"""Registry of the torrents added to each debrid account, persisted in the database"""
+import threading
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from program.db.db import db
+from program.downloaders.shared import parse_filename
+from program.media.item import Episode
+from program.media.state import States
+from program.media.torrent import DebridTorrent
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from utils.logger import logger
+
+LOCK_STRIPES = 64
+ASSIGNABLE_STATES = (States.Indexed, States.Scraped, States.Unknown, States.Failed)
+
+
+class TorrentRegistry:
+    """
+    Maps (provider, infohash) to the debrid torrent id and its files.
+
+    Every item that resolves to a hash already in the registry reuses the torrent
+    instead of adding it again, so a season pack picked by each of its episodes is
+    only added, and has its files selected, once. Adds of the same hash are
+    serialized within the process and the unique (provider, infohash) constraint
+    rejects a second row from anywhere else.
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _lock(self, infohash: str) -> threading.Lock:
+        return self._locks[hash(infohash) % LOCK_STRIPES]
+
+    def get(self, infohash: str) -> Optional[DebridTorrent]:
+        with db.Session(expire_on_commit=False) as session:
+            return session.execute(
+                select(DebridTorrent)
+                .where(DebridTorrent.provider == self.provider, DebridTorrent.infohash == infohash.lower())
+            ).scalar_one_or_none()
+
+    def register(self, infohash: str, torrent_id: Any, **fields) -> DebridTorrent:
+        """Record a torrent found on the account, returns the existing entry if there is one."""
+        entry = DebridTorrent(self.provider, infohash, torrent_id, **fields)
+        with db.Session(expire_on_commit=False) as session:
+            session.add(entry)
+            try:
+                session.commit()
+                return entry
+            except IntegrityError:
+                session.rollback()
+        return self.get(infohash)
+
+    def get_or_add(self, infohash: str, add: Callable[[], Any]) -> Tuple[Optional[DebridTorrent], bool]:
+        """
+        Return the registered torrent for `infohash`, calling `add` to add it when there is none.
+
+        `add` returns the new torrent id, or None when adding failed. The second value
+        returned is True when the torrent was added by this call.
+        """
+        with self._lock(infohash.lower()):
+            entry = self.get(infohash)
+            if entry:
+                return entry, False
+            torrent_id = add()
+            if torrent_id is None:
+                return None, False
+            entry = self.register(infohash, torrent_id)
+            return entry, entry is not None and entry.torrent_id == str(torrent_id)
+
+    def set_files(self, infohash: str, files: Any, name: Optional[str] = None, alternative_name: Optional[str] = None) -> None:
+        with db.Session() as session:
+            session.execute(
+                update(DebridTorrent)
+                .where(DebridTorrent.provider == self.provider, DebridTorrent.infohash == infohash.lower())
+                .values(files=files, name=name, alternative_name=alternative_name)
+            )
+            session.commit()
+
+    def remove(self, torrent_id: Any) -> None:
+        """Forget a torrent that was deleted from the account."""
+        with db.Session() as session:
+            session.execute(
+                delete(DebridTorrent)
+                .where(DebridTorrent.provider == self.provider, DebridTorrent.torrent_id == str(torrent_id))
+            )
+            session.commit()
+
+
+def assign_pack_files(item: Episode, filenames: Iterable[str]) -> List[Episode]:
+    """
+    Give the other episodes of `item`'s season their file from the same torrent.
+
+    Each filename is parsed once and matched against every episode of the season
+    still waiting for a file, the episodes share `item`'s active stream and folders.
+    Returns the episodes that were assigned a file.
+    """
+    if not isinstance(item, Episode) or not item.parent or not item.active_stream:
+        return []
+
+    waiting = {
+        episode.number: episode for episode in item.parent.episodes
+        if episode is not item and not episode.file and episode.state in ASSIGNABLE_STATES
+    }
+    if not waiting:
+        return []
+
+    one_season = len(item.parent.parent.seasons) == 1 if item.parent.parent else False
+    assigned = []
+    for filename in filenames:
+        parsed_file = parse_filename(filename)
+        if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
+            continue
+        if item.parent.number not in parsed_file.season and not one_season:
+            continue
+        for number in parsed_file.episode:
+            episode = waiting.pop(number, None)
+            if not episode:
+                continue
+            episode.set("active_stream", dict(item.active_stream))
+            episode.set("folder", item.folder)
+            episode.set("alternative_folder", item.alternative_folder)
+            episode.set("file", filename)
+            assigned.append(episode)
+        if not waiting:
+            break
+
+    if assigned:
+        logger.debug(f"Assigned files from {item.active_stream.get('hash')} to {len(assigned)} more episodes of {item.parent.log_string}")
+    return assigned
@@ -1,15 +1,70 @@
-import contextlib
+from functools import lru_cache
 from posixpath import splitext
+from typing import Optional
+
 from RTN import parse
 from RTN.exceptions import GarbageTorrent
+from RTN.models import ParsedData
 
+from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.media.state import States
 
 WANTED_FORMATS = {".mkv", ".mp4", ".avi"}
+ACCEPTABLE_STATES = (States.Indexed, States.Scraped, States.Unknown, States.Failed, States.PartiallyCompleted)
+PARSE_CACHE_SIZE = 50_000
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_filename(filename: str) -> Optional[ParsedData]:
+    """Parse a filename once, every container and item asking about it afterwards shares the result."""
+    try:
+        return parse(filename, remove_trash=True)
+    except (GarbageTorrent, TypeError):
+        return None
+
+
+def needed_episodes(item: MediaItem) -> dict[tuple[int, int], Episode]:
+    """Map the (season, episode) numbers still wanted for a show, season or episode to their episode."""
+    if isinstance(item, Episode):
+        return {(item.parent.number, item.number): item}
+    if isinstance(item, Season):
+        seasons = [item]
+    elif isinstance(item, Show):
+        seasons = [season for season in item.seasons if season.state in ACCEPTABLE_STATES and season.is_released_nolog]
+    else:
+        return {}
+    return {
+        (season.number, episode.number): episode
+        for season in seasons
+        for episode in season.episodes
+        if episode.state in ACCEPTABLE_STATES and episode.is_released_nolog
+    }
+
+
+def _show_of(item: MediaItem) -> Optional[Show]:
+    if isinstance(item, Episode):
+        return item.parent.parent if item.parent else None
+    if isinstance(item, Season):
+        return item.parent
+    return item if isinstance(item, Show) else None
+
+
+def file_finder_for(item: MediaItem, name: str, size: str, download_settings) -> "FileFinder":
+    """File matcher for a provider's `name` and `size` file keys, with the size limits for the item's type."""
+    if isinstance(item, Movie):
+        min_size, max_size = download_settings.movie_filesize_min, download_settings.movie_filesize_max
+    else:
+        min_size, max_size = download_settings.episode_filesize_min, download_settings.episode_filesize_max
+    return FileFinder(name, size, min_size * 1_000_000, max_size * 1_000_000 if max_size != -1 else float("inf"))
+
 
 class FileFinder:
     """
-    A class that helps you find files.
+    Matches the files of a debrid container against a movie, show, season or episode.
+
+    Each file is parsed once (parses are memoized across containers and items) and
+    looked up in a set of the (season, episode) pairs the item needs, so matching a
+    pack is linear in its number of files.
 
     Attributes:
         filename_attr (str): The name of the file attribute.
@@ -18,12 +73,69 @@ class FileFinder:
         max_filesize (int): The maximum file size.
     """
 
-    def __init__(self, name, size, min, max):
+    def __init__(self, name, size, min=0, max=float("inf")):
         self.filename_attr = name
         self.filesize_attr = size
         self.min_filesize = min
         self.max_filesize = max
-        
+
+    def wanted_files(self, container) -> list:
+        """Files of the container in a wanted format and within the size limits."""
+        files = container.values() if isinstance(container, dict) else container
+        return [
+            file for file in files
+            if isinstance(file, dict) and file.get(self.filename_attr)
+            and self.min_filesize < file.get(self.filesize_attr, 0) < self.max_filesize
+            and splitext(file[self.filename_attr].lower())[1] in WANTED_FORMATS
+        ]
+
+    def find_movie(self, container) -> Optional[dict]:
+        """The largest movie file of the container which is not a sample."""
+        files = sorted(self.wanted_files(container), key=lambda file: file[self.filesize_attr], reverse=True)
+        for file in files:
+            if "sample" in file[self.filename_attr].lower():
+                continue
+            parsed_file = parse_filename(file[self.filename_attr])
+            if parsed_file and parsed_file.parsed_title and parsed_file.type == "movie":
+                return file
+        return None
+
+    def match_episodes(self, container, item: MediaItem, needed: Optional[dict] = None) -> dict[tuple[int, int], list]:
+        """
+        Map every needed (season, episode) of the item to the files holding it.
+
+        Shows with a single season also match files that carry no season number.
+        """
+        needed = needed_episodes(item) if needed is None else needed
+        if not needed:
+            return {}
+        show = _show_of(item)
+        one_season = bool(show) and len(show.seasons) == 1
+        needed_seasons = {season for season, _ in needed}
+
+        matches: dict[tuple[int, int], list] = {}
+        for file in self.wanted_files(container):
+            filename = file[self.filename_attr]
+            if "sample" in filename.lower():
+                continue
+            parsed_file = parse_filename(filename)
+            if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
+                continue
+            seasons = needed_seasons if one_season else parsed_file.season
+            for season in seasons:
+                for episode in parsed_file.episode:
+                    if (season, episode) in needed:
+                        matches.setdefault((season, episode), []).append(file)
+        return matches
+
+    def assign_files(self, matches: dict, needed: dict, folder: Optional[str], alternative_folder: Optional[str]) -> None:
+        """Set the first matched file, and the torrent's folders, on each matched episode."""
+        for key, files in matches.items():
+            episode = needed[key]
+            episode.set("folder", folder)
+            episode.set("alternative_folder", alternative_folder)
+            episode.set("file", files[0][self.filename_attr])
+
     def find_required_files(self, item, container):
         """
         Find the required files based on the given item and container.
@@ -34,111 +146,16 @@ class FileFinder:
 
         Returns:
             list: A list of files that match the criteria based on the item type.
-                Returns an empty list if no files match the criteria.
+                Returns an empty list unless every needed episode has a file.
 
         """
-        files = [
-            file
-            for file in container
-            if file and self.min_filesize < file[self.filesize_attr] < self.max_filesize
-            and file[self.filesize_attr] > 10000
-            and splitext(file[self.filename_attr].lower())[1] in WANTED_FORMATS
-        ]
-        return_files = []
+        if isinstance(item, Movie):
+            movie = self.find_movie(container)
+            return [movie] if movie else []
 
-        if not files:
+        needed = needed_episodes(item)
+        matches = self.match_episodes(container, item, needed)
+        if not matches or len(matches) < len(needed):
             return []
-
-        if item.type == "movie":
-            for file in files:
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file[self.filename_attr], remove_trash=True)
-                    if parsed_file.type == "movie":
-                        return_files.append(file)
-        if item.type == "show":
-            needed_episodes = {}
-            acceptable_states = [States.Indexed, States.Scraped, States.Unknown, States.Failed, States.PartiallyCompleted]
-
-            for season in item.seasons:
-                if season.state in acceptable_states and season.is_released_nolog:
-                    needed_episode_numbers = {episode.number for episode in season.episodes if episode.state in acceptable_states and episode.is_released_nolog}
-                    if needed_episode_numbers:
-                        needed_episodes[season.number] = needed_episode_numbers
-
-            if not any(needed_episodes.values()):
-                return return_files
-
-            matched_files = {}
-            one_season = len(item.seasons) == 1
-
-            for file in files:
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file[self.filename_attr], remove_trash=True)
-                    if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
-                        continue
-
-                    # Check each season and episode to find a match
-                    for season_number, episodes in needed_episodes.items():
-                        if one_season or season_number in parsed_file.season:
-                            for episode_number in parsed_file.episode:
-                                if episode_number in episodes:
-                                    # Store the matched file for this episode
-                                    matched_files.setdefault((season_number, episode_number), []).append(file)
-                                    
-            # total_needed_episodes = sum(len(episodes) for episodes in needed_episodes.values())
-            # matched_episodes = sum(len(files) for files in matched_files.values())
-                    
-            if set(needed_episodes).issubset(matched_files):
-                for key, files in matched_files.items():
-                    season_number, episode_number = key
-                    for file in files:
-                        if not file or "sample" in file[self.filename_attr].lower():
-                            continue
-                        return_files.append(file)
-                                    
-        if item.type == "season":
-            acceptable_states = [States.Indexed, States.Scraped, States.Unknown, States.Failed, States.PartiallyCompleted]
-            needed_episodes = []
-            for episode in item.episodes:
-                if episode.state in acceptable_states and episode.is_released_nolog:
-                    needed_episodes.append(episode.number)
-
-            if not needed_episodes:
-                return return_files
-            
-            matched_files = {}
-            one_season = len(item.parent.seasons) == 1
-            
-            for file in files:
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file[self.filename_attr], remove_trash=True)
-                    if not parsed_file or not parsed_file.episode or 0 in parsed_file.season:
-                        continue
-
-                    if one_season or item.number in parsed_file.season:
-                        for episode_number in parsed_file.episode:
-                            if episode_number in needed_episodes:
-                                matched_files.setdefault(episode_number, []).append(file)
-                                
-            matched_episodes = sum(len(files) for files in matched_files.values())
-
-            if set(needed_episodes).issubset(matched_files):
-                for files in matched_files.values():
-                    for file in files:
-                        if not file or "sample" in file[self.filename_attr].lower():
-                            continue
-                        return_files.append(file)
-
-        if item.type == "episode":
-            for file in files:
-                if not file or not file.get(self.filename_attr):
-                    continue
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file[self.filename_attr], remove_trash=True)
-                    if (
-                        item.number in parsed_file.episode
-                        and item.parent.number in parsed_file.season
-                    ):
-                        return_files.append(file)
-
-        return return_files
+        # Multi-episode files are matched once per episode
+        return list({id(file): file for files in matches.values() for file in files}.values())
@@ -1,21 +1,19 @@
-import contextlib
 from datetime import datetime
 from pathlib import Path
-from posixpath import splitext
-from typing import Generator
 
+from program.downloaders.availability import AvailabilityChecker
+from program.downloaders.registry import TorrentRegistry, assign_pack_files
+from program.downloaders.shared import FileFinder, needed_episodes
+from program.downloaders.torrents import TorrentMirror
 from program.media.item import MediaItem
-from program.media.state import States
 from program.media.stream import Stream
 from program.settings.manager import settings_manager
 from requests import ConnectTimeout
-from RTN import parse
-from RTN.exceptions import GarbageTorrent
 from utils.logger import logger
 from utils.request import get, post
 
 API_URL = "https://api.torbox.app/v1/api"
-WANTED_FORMATS = {".mkv", ".mp4", ".avi"}
+AVAILABILITY_BATCH = 100
 
 
 class TorBoxDownloader:
@@ -27,6 +25,15 @@ class TorBoxDownloader:
         self.api_key = self.settings.api_key
         self.base_url = "https://api.torbox.app/v1/api"
         self.headers = {"Authorization": f"Bearer {self.api_key}"}
+        self.file_finder = FileFinder("name", "size", min=10000)
+        self.availability_checker = AvailabilityChecker(
+            self.key,
+            self._fetch_availability,
+            max_batch=AVAILABILITY_BATCH,
+            base_url_length=len(f"{API_URL}/torrents/checkcached?hash=&list_files=True"),
+        )
+        self.torrents = TorrentMirror(self.key, self._fetch_torrents)
+        self.registry = TorrentRegistry(self.key)
         self.initialized = self.validate()
         if not self.initialized:
             return
@@ -70,33 +77,37 @@ class TorBoxDownloader:
 
     def run(self, item: MediaItem) -> bool:
         """Download media item from torbox.app"""
-        return_value = False
-        cached_hashes = self.get_torrent_cached([stream.infohash for stream in item.streams])
-        if cached_hashes:
-            for cache in cached_hashes.values():
-                item.active_stream = cache
-                if self.find_required_files(item, cache["files"]):
-                    logger.log(
-                        "DEBRID", f"Item is cached, proceeding with: {item.log_string}"
-                    )
-                    item.set(
-                        "active_stream",
-                        {"hash": cache["hash"], "files": cache["files"], "id": None},
-                    )
-                    self.download(item)
-                    return_value = True
-                    break
-                else:
-                    stream = next(stream for stream in item.streams if stream.infohash == cache["hash"])
-                    stream.blacklisted = True
-        else:
-            logger.log("DEBRID", f"Item is not cached: {item.log_string}")
-            for stream in item.streams:
+        any_cached = False
+
+        def evaluate(stream_hash: str, cache: dict) -> bool:
+            nonlocal any_cached
+            if not cache:
+                return False
+            any_cached = True
+            item.active_stream = cache
+            if self.find_required_files(item, cache["files"]):
                 logger.log(
-                    "DEBUG", f"Blacklisting uncached hash ({stream.infohash}) for item: {item.log_string}"
+                    "DEBRID", f"Item is cached, proceeding with: {item.log_string}"
                 )
-                stream.blacklisted = True
-        return return_value
+                item.set(
+                    "active_stream",
+                    {"hash": cache["hash"], "files": cache["files"], "id": None},
+                )
+                return True
+            stream = item.get_stream(stream_hash)
+            if stream:
+                item.blacklist_stream(stream)
+            return False
+
+        if self.availability_checker.check([stream.infohash for stream in list(item.streams)], evaluate):
+            self.download(item)
+            return True
+
+        if not any_cached:
+            logger.log("DEBRID", f"Item is not cached: {item.log_string}")
+            logger.log("DEBUG", f"Blacklisting {len(item.streams)} uncached hashes for item: {item.log_string}")
+            item.blacklist_streams(list(item.streams))
+        return False
     
     def get_cached_hashes(self, item: MediaItem, streams: list[str]) -> list[str]:
         """Check if the item is cached in torbox.app"""
@@ -110,178 +121,62 @@ class TorBoxDownloader:
         self.download(item)
 
     def find_required_files(self, item, container):
-
-        files = [
-            file
-            for file in container
-            if file
-            and file["size"] > 10000
-            and splitext(file["name"].lower())[1] in WANTED_FORMATS
-        ]
-
-        if item.type == "movie":
-            for file in files:
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file["name"], remove_trash=True)
-                    if parsed_file.type == "movie":
-                        return [file]
-        if item.type == "show":
-            # Create a dictionary to map seasons and episodes needed
-            needed_episodes = {}
-            acceptable_states = [
-                States.Indexed,
-                States.Scraped,
-                States.Unknown,
-                States.Failed,
-            ]
-
-            for season in item.seasons:
-                if season.state in acceptable_states and season.is_released_nolog:
-                    needed_episode_numbers = {
-                        episode.number
-                        for episode in season.episodes
-                        if episode.state in acceptable_states
-                        and episode.is_released_nolog
-                    }
-                    if needed_episode_numbers:
-                        needed_episodes[season.number] = needed_episode_numbers
-            if not needed_episodes:
-                return False
-
-            # Iterate over each file to check if it matches
-            # the season and episode within the show
-            matched_files = []
-            for file in files:
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file["name"], remove_trash=True)
-                    if (
-                        not parsed_file
-                        or not parsed_file.parsed_title
-                        or 0 in parsed_file.season
-                    ):
-                        continue
-                    # Check each season and episode to find a match
-                    for season_number, episodes in needed_episodes.items():
-                        if season_number in parsed_file.season:
-                            for episode_number in list(episodes):
-                                if episode_number in parsed_file.episode:
-                                    # Store the matched file for this episode
-                                    matched_files.append(file)
-                                    episodes.remove(episode_number)
-            if not matched_files:
-                return False
-
-            if all(len(episodes) == 0 for episodes in needed_episodes.values()):
-                return matched_files
-        if item.type == "season":
-            needed_episodes = {
-                episode.number: episode
-                for episode in item.episodes
-                if episode.state
-                in [States.Indexed, States.Scraped, States.Unknown, States.Failed]
-            }
-            one_season = len(item.parent.seasons) == 1
-
-            # Dictionary to hold the matched files for each episode
-            matched_files = []
-            season_num = item.number
-
-            # Parse files once and assign to episodes
-            for file in files:
-                if not file or not file.get("name"):
-                    continue
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file["name"], remove_trash=True)
-                    if (
-                        not parsed_file
-                        or not parsed_file.episode
-                        or 0 in parsed_file.season
-                    ):
-                        continue
-                    # Check if the file's season matches the item's season or if there's only one season
-                    if season_num in parsed_file.season or one_season:
-                        for ep_num in parsed_file.episode:
-                            if ep_num in needed_episodes:
-                                matched_files.append(file)
-            if not matched_files:
-                return False
-
-            # Check if all needed episodes are captured (or atleast half)
-            if len(needed_episodes) == len(matched_files):
-                return matched_files
-        if item.type == "episode":
-            for file in files:
-                if not file or not file.get("name"):
-                    continue
-                with contextlib.suppress(GarbageTorrent, TypeError):
-                    parsed_file = parse(file["name"], remove_trash=True)
-                    if (
-                        item.number in parsed_file.episode
-                        and item.parent.number in parsed_file.season
-                    ):
-                        return [file]
-
-        return []
+        return self.file_finder.find_required_files(item, container)
 
     def download(self, item: MediaItem):
-        # Check if the torrent already exists
-        exists = False
-        torrent_list = self.get_torrent_list()
-        for torrent in torrent_list:
-            if item.active_stream["hash"] == torrent["hash"]:
-                id = torrent["id"]
-                exists = True
-                break
-
-        # If it doesnt, lets download it and refresh the torrent_list
-        if not exists:
-            id = self.create_torrent(item.active_stream["hash"])
-            torrent_list = self.get_torrent_list()
+        # Check if the torrent already exists, if it doesnt, lets download it
+        stream_hash = item.active_stream["hash"]
+        entry, _ = self.registry.get_or_add(stream_hash, lambda: self._find_or_create_torrent(stream_hash))
+        if entry and not self.torrents.get_by_id(int(entry.torrent_id)):
+            # Deleted from the account since it was registered
+            self.registry.remove(entry.torrent_id)
+            entry, _ = self.registry.get_or_add(stream_hash, lambda: self._find_or_create_torrent(stream_hash))
+        if not entry:
+            logger.error(f"Failed to add torrent for {item.log_string}")
+            return
+        id = int(entry.torrent_id)
+        item.set("active_stream.id", id)
 
         # Find the torrent, correct file and we gucci
-        for torrent in torrent_list:
-            if torrent["id"] == id:
-                if item.type == "movie":
-                    file = self.find_required_files(item, item.active_stream["files"])[
-                        0
-                    ]
-                    _file_path = Path(file["name"])
-                    item.set("folder", _file_path.parent.name)
-                    item.set("alternative_folder", ".")
-                    item.set("file", _file_path.name)
-                if item.type == "show":
-                    files = self.find_required_files(item, item.active_stream["files"])
-                    for season in item.seasons:
-                        for episode in season.episodes:
-                            file = self.find_required_files(episode, files)[0]
-                            _file_path = Path(file["name"])
-                            episode.set("folder", _file_path.parent.name)
-                            episode.set("alternative_folder", ".")
-                            episode.set("file", _file_path.name)
-                if item.type == "season":
-                    files = self.find_required_files(item, item.active_stream["files"])
-                    for episode in item.episodes:
-                        file = self.find_required_files(episode, files)[0]
-                        _file_path = Path(file["name"])
-                        episode.set("folder", _file_path.parent.name)
-                        episode.set("alternative_folder", ".")
-                        episode.set("file", _file_path.name)
+        if self.torrents.get_by_id(id, refresh=False):
+            files = item.active_stream["files"]
+            if item.type == "movie":
+                movie = self.file_finder.find_movie(files)
+                if movie:
+                    self._set_file(item, movie)
+            else:
+                needed = needed_episodes(item)
+                for key, matched in self.file_finder.match_episodes(files, item, needed).items():
+                    self._set_file(needed[key], matched[0])
                 if item.type == "episode":
-                    file = self.find_required_files(episode, files)[0]
-                    _file_path = Path(file["name"])
-                    item.set("folder", _file_path.parent.name)
-                    item.set("alternative_folder", ".")
-                    item.set("file", _file_path.name)
-                logger.log("DEBRID", f"Downloaded {item.log_string}")
+                    assign_pack_files(item, [Path(file["name"]).name for file in files if file and file.get("name")])
+            logger.log("DEBRID", f"Downloaded {item.log_string}")
+
+    @staticmethod
+    def _set_file(item: MediaItem, file: dict) -> None:
+        _file_path = Path(file["name"])
+        item.set("folder", _file_path.parent.name)
+        item.set("alternative_folder", ".")
+        item.set("file", _file_path.name)
+
+    def _find_or_create_torrent(self, stream_hash: str):
+        torrent = self.torrents.get_by_hash(stream_hash)
+        return torrent["id"] if torrent else self.create_torrent(stream_hash)
 
     def get_torrent_cached(self, hash_list):
+        availability = self.availability_checker.lookup(hash_list)
+        return {stream_hash: cache for stream_hash, cache in availability.items() if cache}
+
+    def _fetch_availability(self, hash_list: list[str]) -> dict:
+        """Fetch instant availability for a batch of hashes, mapping uncached hashes to None."""
         hash_string = ",".join(hash_list)
         response = get(
             f"{self.base_url}/torrents/checkcached?hash={hash_string}&list_files=True",
             additional_headers=self.headers,
             response_type=dict,
         )
-        return response.data["data"]
+        cached = {stream_hash.lower(): cache for stream_hash, cache in (response.data["data"] or {}).items()}
+        return {stream_hash: cached.get(stream_hash.lower()) for stream_hash in hash_list}
 
     def create_torrent(self, hash) -> int:
         magnet_url = f"magnet:?xt=urn:btih:{hash}&dn=&tr="
@@ -290,7 +185,18 @@ class TorBoxDownloader:
             data={"magnet": magnet_url, "seed": 1, "allow_zip": False},
             additional_headers=self.headers,
         )
-        return response.data.data.torrent_id
+        torrent_id = response.data.data.torrent_id
+        self.torrents.add({"id": torrent_id, "hash": hash.lower()})
+        return torrent_id
+
+    def _fetch_torrents(self, offset: int, limit: int) -> list:
+        """Fetch a page of the torrent list, newest first."""
+        response = get(
+            f"{self.base_url}/torrents/mylist?bypass_cache=true&offset={offset}&limit={limit}",
+            additional_headers=self.headers,
+            response_type=dict,
+        )
+        return response.data["data"] or []
 
     def get_torrent_list(self) -> list:
         response = get(
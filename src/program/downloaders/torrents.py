@@ -0,0 +1,152 @@
+"""In-process mirror of a debrid account's torrent list"""
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from utils.logger import logger
+
+PAGE_SIZE = 50
+FULL_PAGE_SIZE = 1000
+# A full listing picks up torrents removed outside of riven
+MAX_AGE = 30 * 60
+# Misses only trigger a new incremental refresh this often
+MIN_REFRESH_INTERVAL = 5
+
+
+def _field(torrent: Any, name: str) -> Any:
+    if isinstance(torrent, dict):
+        return torrent.get(name)
+    return getattr(torrent, name, None)
+
+
+class TorrentMirror:
+    """
+    Torrents on the account indexed by infohash and id, shared by all workers.
+
+    `fetch_page(offset, limit)` returns a page of the provider's torrent list, newest
+    first. The first lookup, and every lookup once the mirror is older than `max_age`,
+    lists the whole account. Lookups in between only fetch the newest pages, stopping
+    at the first torrent the mirror has already seen listed. Torrents we add or delete
+    ourselves are applied directly with `add` and `remove`.
+
+    Entries are the provider's list objects as they were when listed, use the
+    provider's info endpoint for the current status of a torrent.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        fetch_page: Callable[[int, int], List[Any]],
+        page_size: int = PAGE_SIZE,
+        full_page_size: int = FULL_PAGE_SIZE,
+        max_age: float = MAX_AGE,
+        min_refresh_interval: float = MIN_REFRESH_INTERVAL,
+    ):
+        self.provider = provider
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.full_page_size = full_page_size
+        self.max_age = max_age
+        self.min_refresh_interval = min_refresh_interval
+        self._by_hash: dict[str, Any] = {}
+        self._by_id: dict[Any, Any] = {}
+        self._listed: set = set()
+        self._synced_at: Optional[float] = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def _index(self, torrent: Any) -> None:
+        torrent_id = _field(torrent, "id")
+        infohash = (_field(torrent, "hash") or "").lower()
+        previous = self._by_id.get(torrent_id)
+        if previous is not None:
+            self._by_hash.pop((_field(previous, "hash") or "").lower(), None)
+        self._by_id[torrent_id] = torrent
+        if infohash:
+            self._by_hash[infohash] = torrent
+
+    def _list(self, page_size: int, stop_at_known: bool) -> Optional[List[Any]]:
+        """Fetch pages newest first, returns None when a page could not be fetched."""
+        torrents, offset = [], 0
+        while True:
+            try:
+                page = self.fetch_page(offset, page_size) or []
+            except Exception as e:
+                logger.error(f"Failed to list {self.provider} torrents: {e}")
+                return None
+            for torrent in page:
+                if stop_at_known and _field(torrent, "id") in self._listed:
+                    return torrents
+                torrents.append(torrent)
+            if len(page) < page_size:
+                return torrents
+            offset += page_size
+
+    def refresh(self, full: bool = False, requested_at: Optional[float] = None) -> None:
+        """
+        Bring the mirror up to date, listing the whole account when `full` or stale.
+
+        Threads that queued up behind a refresh started after their `requested_at`
+        reuse its result instead of listing again.
+        """
+        with self._refresh_lock:
+            if not full and requested_at is not None and self._refreshed_at >= requested_at:
+                return
+            full = full or self._synced_at is None or time.monotonic() - self._synced_at > self.max_age
+            started = time.monotonic()
+            torrents = self._list(self.full_page_size if full else self.page_size, stop_at_known=not full)
+            if torrents is None:
+                return
+            with self._lock:
+                if full:
+                    self._by_hash.clear()
+                    self._by_id.clear()
+                    self._listed.clear()
+                    self._synced_at = started
+                for torrent in reversed(torrents):
+                    self._index(torrent)
+                    self._listed.add(_field(torrent, "id"))
+            self._refreshed_at = time.monotonic()
+            logger.debug(f"Refreshed {self.provider} torrent mirror, {len(torrents)} {'listed' if full else 'new'} torrents")
+
+    def _lookup(self, index: dict, key: Any, refresh: bool) -> Optional[Any]:
+        torrent = index.get(key)
+        if torrent is not None or not refresh:
+            return torrent
+        now = time.monotonic()
+        stale = self._synced_at is None or now - self._synced_at > self.max_age
+        if stale or now - self._refreshed_at >= self.min_refresh_interval:
+            self.refresh(requested_at=now)
+        return index.get(key)
+
+    def get_by_hash(self, infohash: str, refresh: bool = True) -> Optional[Any]:
+        """Return the torrent with `infohash`, refreshing the mirror on a miss."""
+        return self._lookup(self._by_hash, infohash.lower(), refresh)
+
+    def get_by_id(self, torrent_id: Any, refresh: bool = True) -> Optional[Any]:
+        """Return the torrent with `torrent_id`, refreshing the mirror on a miss."""
+        return self._lookup(self._by_id, torrent_id, refresh)
+
+    def add(self, torrent: Any) -> None:
+        """Record a torrent we added ourselves."""
+        with self._lock:
+            self._index(torrent)
+
+    def remove(self, torrent_id: Any) -> None:
+        """Forget a torrent we deleted ourselves."""
+        with self._lock:
+            torrent = self._by_id.pop(torrent_id, None)
+            self._listed.discard(torrent_id)
+            if torrent is not None:
+                self._by_hash.pop((_field(torrent, "hash") or "").lower(), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_hash.clear()
+            self._by_id.clear()
+            self._listed.clear()
+            self._synced_at = None
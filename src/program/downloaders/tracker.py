@@ -0,0 +1,174 @@
+"""Batched status polling for torrents added to a debrid account"""
+import random
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from utils.logger import logger
+
+MIN_INTERVAL = 0.25
+MAX_INTERVAL = 10
+JITTER = 0.2
+WAIT_TIMEOUT = 60
+
+
+class _Watch:
+    __slots__ = ("states", "callback", "deadline")
+
+    def __init__(self, states: set, callback: Callable[[str, Optional[Any]], None], deadline: float):
+        self.states = states
+        self.callback = callback
+        self.deadline = deadline
+
+
+class DownloadStateTracker:
+    """
+    Waits for torrents to reach a state, polling the provider in one batch.
+
+    `fetch_states(torrent_ids)` returns the current state of as many of the given
+    torrents as possible in one request, keyed by torrent id. A single poller
+    thread runs while anything is being watched. It polls right away, then backs
+    off exponentially (with jitter) while no watched torrent changes state, and
+    drops back to the minimum interval when one does or a new watch comes in.
+
+    Watchers are called with the torrent id and the state it reached, a state from
+    `failed_states`, or `None` when their timeout ran out.
+
+    Downloaders use `expect` rather than blocking a worker: the outcome is kept for
+    `pop_result` and `on_done(key)` is called so the item can be resubmitted.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        fetch_states: Callable[[List[str]], dict[str, Any]],
+        failed_states: Iterable[Any] = (),
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        jitter: float = JITTER,
+    ):
+        self.provider = provider
+        self.fetch_states = fetch_states
+        self.failed_states = set(failed_states)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.polls = 0
+        self.on_done: Optional[Callable[[Any], None]] = None
+        self._waiting: set = set()
+        self._results: dict[Any, Tuple[str, Optional[Any]]] = {}
+        self._interval = min_interval
+        self._last_poll = 0.0
+        self._last_states: dict[str, Any] = {}
+        self._watches: dict[str, List[_Watch]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, torrent_id: Any, states: Iterable[Any], callback: Callable[[str, Optional[Any]], None], timeout: float = WAIT_TIMEOUT) -> None:
+        """Call `callback` from the poller thread once the torrent is in one of `states`."""
+        torrent_id = str(torrent_id)
+        with self._lock:
+            self._watches.setdefault(torrent_id, []).append(_Watch(set(states), callback, time.monotonic() + timeout))
+            self._interval = self.min_interval
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name=f"{self.provider}StateTracker", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def expect(self, key: Any, torrent_id: Any, states: Iterable[Any], timeout: float = WAIT_TIMEOUT) -> bool:
+        """
+        Watch the torrent on behalf of `key` without blocking, `on_done(key)` is called once it is done.
+
+        Returns False if the key is already waiting.
+        """
+        with self._lock:
+            if key in self._waiting:
+                return False
+            self._waiting.add(key)
+            self._results.pop(key, None)
+
+        def done(torrent_id, state):
+            with self._lock:
+                self._waiting.discard(key)
+                self._results[key] = (torrent_id, state)
+            if self.on_done:
+                self.on_done(key)
+
+        self.watch(torrent_id, states, done, timeout)
+        return True
+
+    def is_waiting(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._waiting
+
+    def has_result(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._results
+
+    def pop_result(self, key: Any) -> Optional[Tuple[str, Optional[Any]]]:
+        """
+        The outcome of the key's last wait: the torrent id and the state it reached, which
+        is `None` on timeout. `None` if the key is still waiting or never waited.
+        """
+        with self._lock:
+            return self._results.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(watches) for watches in self._watches.values())
+
+    def _run(self) -> None:
+        while True:
+            delay = self._interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            remaining = self._last_poll + delay - time.monotonic()
+            if remaining > 0:
+                self._wake.wait(remaining)
+                self._wake.clear()
+                continue
+
+            with self._lock:
+                if not self._watches:
+                    self._thread = None
+                    return
+                torrent_ids = list(self._watches)
+            self._poll(torrent_ids)
+
+    def _poll(self, torrent_ids: List[str]) -> None:
+        self._last_poll = time.monotonic()
+        self.polls += 1
+        try:
+            states = {str(torrent_id): state for torrent_id, state in (self.fetch_states(torrent_ids) or {}).items()}
+        except Exception as e:
+            logger.debug(f"Failed to poll {self.provider} torrent states: {e}")
+            states = {}
+
+        now = time.monotonic()
+        fired = []
+        with self._lock:
+            changed = False
+            for torrent_id in torrent_ids:
+                state = states.get(torrent_id)
+                if torrent_id in states and self._last_states.get(torrent_id) != state:
+                    self._last_states[torrent_id] = state
+                    changed = True
+                waiting = []
+                for watch in self._watches.get(torrent_id, []):
+                    if torrent_id in states and (state in watch.states or state in self.failed_states):
+                        fired.append((watch.callback, torrent_id, state))
+                    elif now >= watch.deadline:
+                        fired.append((watch.callback, torrent_id, None))
+                    else:
+                        waiting.append(watch)
+                if waiting:
+                    self._watches[torrent_id] = waiting
+                else:
+                    self._watches.pop(torrent_id, None)
+                    self._last_states.pop(torrent_id, None)
+            self._interval = self.min_interval if changed else min(self._interval * 2, self.max_interval)
+
+        for callback, torrent_id, state in fired:
+            try:
+                callback(torrent_id, state)
+            except Exception as e:
+                logger.error(f"Error in {self.provider} state callback for torrent {torrent_id}: {e}")
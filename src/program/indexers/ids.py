@@ -0,0 +1,142 @@
+"""Persistent mapping of tmdb and tvdb ids to imdb ids"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from cachetools import LRUCache
+from program.db.db import db
+from program.media.external_id import ExternalId
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from utils.logger import logger
+
+SOURCES = ("tmdb", "tvdb")
+# How long a failed lookup is trusted before the id is asked for again
+NEGATIVE_TTL = timedelta(days=1)
+FETCH_WORKERS = 4
+QUERY_CHUNK = 500
+
+
+class ExternalIdResolver:
+    """
+    Resolves tmdb and tvdb ids to imdb ids from memory, then from the ExternalId
+    table, and only then with `fetch`. Whatever `fetch` finds is stored for every
+    later lookup, along with the other ids of the same item it returned.
+
+    `fetch(source, external_id, type)` returns the ids of the matching item keyed by
+    source, imdb included, or None when nothing matches. Misses are remembered for
+    `negative_ttl`, errors raised by `fetch` are not remembered at all.
+    """
+
+    def __init__(self, fetch: Callable[[str, str, str], Optional[dict]], maxsize: int = 4096,
+                 negative_ttl: timedelta = NEGATIVE_TTL, max_workers: int = FETCH_WORKERS):
+        self.fetch = fetch
+        self.negative_ttl = negative_ttl
+        self.max_workers = max_workers
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stored_hits = 0
+        self.fetches = 0
+
+    def _usable(self, imdb_id: Optional[str], resolved_at: datetime) -> bool:
+        return imdb_id is not None or datetime.now() - resolved_at < self.negative_ttl
+
+    def _remember(self, key: Tuple[str, str, str], imdb_id: Optional[str], resolved_at: datetime) -> None:
+        with self._lock:
+            self._memory[key] = (imdb_id, resolved_at)
+
+    def resolve(self, source: str, external_id, type: str) -> Optional[str]:
+        """Return the imdb id of the `type` item with the `source` id `external_id`."""
+        if not external_id:
+            return None
+        return self.resolve_many(source, [external_id], type).get(str(external_id))
+
+    def resolve_many(self, source: str, external_ids: Iterable, type: str) -> Dict[str, Optional[str]]:
+        """Resolve a whole list of ids, the unknown ones are fetched `max_workers` at a time."""
+        ids = list(dict.fromkeys(str(external_id) for external_id in external_ids if external_id))
+        results: Dict[str, Optional[str]] = {}
+        missing = []
+        with self._lock:
+            for external_id in ids:
+                entry = self._memory.get((source, external_id, type))
+                if entry and self._usable(*entry):
+                    results[external_id] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(external_id)
+
+        if missing:
+            for external_id, (imdb_id, resolved_at) in self._load(source, missing, type).items():
+                if self._usable(imdb_id, resolved_at):
+                    results[external_id] = imdb_id
+                    self.stored_hits += 1
+                    self._remember((source, external_id, type), imdb_id, resolved_at)
+            missing = [external_id for external_id in missing if external_id not in results]
+
+        if missing:
+            results.update(self._fetch_many(source, missing, type))
+        return results
+
+    def _load(self, source: str, external_ids: List[str], type: str) -> Dict[str, Tuple[Optional[str], datetime]]:
+        stored = {}
+        with db.Session() as session:
+            for start in range(0, len(external_ids), QUERY_CHUNK):
+                rows = session.execute(
+                    select(ExternalId.external_id, ExternalId.imdb_id, ExternalId.resolved_at)
+                    .where(ExternalId.source == source, ExternalId.type == type)
+                    .where(ExternalId.external_id.in_(external_ids[start:start + QUERY_CHUNK]))
+                ).all()
+                stored.update((external_id, (imdb_id, resolved_at)) for external_id, imdb_id, resolved_at in rows)
+        return stored
+
+    def _fetch_one(self, source: str, external_id: str, type: str):
+        try:
+            return external_id, self.fetch(source, external_id, type) or {}, True
+        except Exception as e:
+            logger.error(f"Failed to resolve {source} id {external_id}: {e}")
+            return external_id, None, False
+
+    def _fetch_many(self, source: str, external_ids: List[str], type: str) -> Dict[str, Optional[str]]:
+        if len(external_ids) == 1:
+            fetched = [self._fetch_one(source, external_ids[0], type)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(external_ids)), thread_name_prefix="IdResolver") as executor:
+                fetched = list(executor.map(lambda external_id: self._fetch_one(source, external_id, type), external_ids))
+
+        now = datetime.now()
+        results, rows = {}, {}
+        for external_id, found, ok in fetched:
+            self.fetches += 1
+            if not ok:
+                results[external_id] = None
+                continue
+            imdb_id = found.get("imdb")
+            results[external_id] = imdb_id
+            rows[(source, external_id, type)] = imdb_id
+            # The same answer maps the item's other ids too
+            for other in SOURCES:
+                if other != source and imdb_id and found.get(other):
+                    rows.setdefault((other, str(found[other]), type), imdb_id)
+
+        if rows:
+            with db.Session() as session:
+                for (row_source, external_id, row_type), imdb_id in rows.items():
+                    session.merge(ExternalId(row_source, external_id, row_type, imdb_id, now))
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # Another thread stored the same ids first, its answer is as good as ours
+                    session.rollback()
+            for key, imdb_id in rows.items():
+                self._remember(key, imdb_id, now)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._memory),
+            "hits": self.hits,
+            "stored_hits": self.stored_hits,
+            "fetches": self.fetches,
+        }
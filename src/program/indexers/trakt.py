@@ -1,20 +1,105 @@
 """Trakt updater module"""
 
-from datetime import datetime, timedelta
-from types import SimpleNamespace
-from typing import Generator, List, Optional, Union
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Generator, Iterable, List, Optional, Set, Union
 
+from program.indexers.ids import ExternalIdResolver
+from program.media.cursor import get_cursor, set_cursor
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.settings.manager import settings_manager
 from utils.logger import logger
-from utils.request import get
+from utils.ratelimiter import RateLimitExceeded, TokenBucket
+from utils.request import CachePolicy, ResponseCache, create_session, get
 
 CLIENT_ID = "0183a05ad97098d87287fe46da4ae286f434f32e8e951caad4cc147c947d79a3"
+TRAKT_HEADERS = {"trakt-api-version": "2", "trakt-api-key": CLIENT_ID}
+
+# Trakt allows 1000 GET calls every 5 minutes, every caller in the process shares the bucket
+trakt_rate_limiter = TokenBucket(rate=1000 / 300, capacity=50)
+BATCH_WORKERS = 8
+trakt_session = create_session(pool_size=BATCH_WORKERS)
+
+# Show data changes as episodes air, the ids of an item practically never do
+trakt_cache = ResponseCache.for_service("trakt", CachePolicy(ttl=6 * 60 * 60, max_ttl=24 * 60 * 60), maxsize=2048)
+trakt_ids_cache = ResponseCache.for_service("trakt_ids", CachePolicy(ttl=7 * 24 * 60 * 60), maxsize=4096)
+
+UPDATES_CURSOR = "trakt_updates"
+UPDATES_PAGE_LIMIT = 100
+# Trakt only serves the updates of the last month, an older cursor can't be caught up
+UPDATES_MAX_AGE = timedelta(days=30)
+# Attributes a re-index may change on an item that is already in the library
+REINDEXED_ATTRIBUTES = ("title", "aired_at", "year", "network", "genres")
+
+
+class TraktUpdates:
+    """
+    Imdb ids of the shows and movies Trakt reported as updated since the stored cursor.
+
+    While the sync keeps running, `TraktIndexer.should_submit` re-indexes an item
+    that was already indexed only once it shows up in here, instead of every
+    `update_interval`. When the sync stops, or its cursor is too old to catch up,
+    re-indexing falls back to the timer.
+    """
+
+    def __init__(self):
+        self.updated: Set[str] = set()
+        self.synced_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        settings = settings_manager.settings.indexer
+        if not settings.incremental_updates or not self.synced_at:
+            return False
+        return datetime.now() - self.synced_at < timedelta(seconds=settings.update_interval * 2)
+
+    def sync(self) -> Set[str]:
+        """
+        Fetch what Trakt updated since the cursor and move the cursor, returns the updated imdb ids.
+        The feed covers all of Trakt, the caller marks the ids that are in the library.
+        """
+        started = datetime.now(timezone.utc)
+        cursor = get_cursor(UPDATES_CURSOR)
+        since = datetime.fromisoformat(cursor) if cursor else None
+        if not since or started - since > UPDATES_MAX_AGE:
+            logger.log("TRAKT", "No recent Trakt updates cursor, re-indexing on a timer until the next sync")
+            set_cursor(UPDATES_CURSOR, started.isoformat())
+            self.synced_at = None
+            return set()
+
+        shows = get_updated_ids("shows", since)
+        movies = get_updated_ids("movies", since)
+        if shows is None or movies is None:
+            return set()
+        ids = shows | movies
+        set_cursor(UPDATES_CURSOR, started.isoformat())
+        self.synced_at = datetime.now()
+        logger.log("TRAKT", f"Trakt reported {len(ids)} updated shows and movies since {since:%Y-%m-%d %H:%M}")
+        return ids
+
+    def mark(self, imdb_ids: Set[str]) -> None:
+        """Remember the updated ids that are in the library until they are re-indexed."""
+        with self._lock:
+            self.updated |= imdb_ids
+
+    def is_updated(self, imdb_id: str) -> bool:
+        with self._lock:
+            return imdb_id in self.updated
+
+    def done(self, imdb_id: str) -> None:
+        with self._lock:
+            self.updated.discard(imdb_id)
+
+
+trakt_updates = TraktUpdates()
 
 
 class TraktIndexer:
     """Trakt updater class"""
     key = "TraktIndexer"
+    max_workers = BATCH_WORKERS
 
     def __init__(self):
         self.key = "traktindexer"
@@ -29,11 +114,15 @@ class TraktIndexer:
             target.set(attr, getattr(source, attr, None))
 
     def copy_items(self, itema: MediaItem, itemb: MediaItem):
-        """Copy attributes from itema to itemb recursively."""
+        """Copy attributes from itema to itemb recursively, seasons and episodes are matched by number."""
         if isinstance(itema, Show) and isinstance(itemb, Show):
-            for seasona, seasonb in zip(itema.seasons, itemb.seasons):
-                for episodea, episodeb in zip(seasona.episodes, seasonb.episodes):
-                    self.copy_attributes(episodea, episodeb)
+            seasons = {season.number: season for season in itema.seasons}
+            for seasonb in itemb.seasons:
+                if seasona := seasons.get(seasonb.number):
+                    episodes = {episode.number: episode for episode in seasona.episodes}
+                    for episodeb in seasonb.episodes:
+                        if episodea := episodes.get(episodeb.number):
+                            self.copy_attributes(episodea, episodeb)
                 seasonb.set("is_anime", itema.is_anime)
             itemb.set("is_anime", itema.is_anime)
         elif isinstance(itema, Movie) and isinstance(itemb, Movie):
@@ -42,29 +131,95 @@ class TraktIndexer:
             
     def run(self, in_item: MediaItem) -> Generator[Union[Movie, Show, Season, Episode], None, None]:
         """Run the Trakt indexer for the given item."""
+        if item := self._index(in_item):
+            yield item
+
+    def run_batch(self, items: Iterable[MediaItem], max_workers: int = BATCH_WORKERS) -> Generator[Union[Movie, Show], None, None]:
+        """
+        Index many items at once, `max_workers` at a time, and yield each one as soon as it
+        is indexed. Items that fail to index are logged and left out. `items` is consumed
+        lazily, so indexing starts before the caller has produced all of them.
+        """
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="TraktIndexer")
+        pending: Set[Future] = set()
+        try:
+            for in_item in items:
+                pending.add(executor.submit(self._index, in_item))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self._completed(done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from self._completed(done)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _completed(futures: Iterable[Future]) -> Generator[MediaItem, None, None]:
+        for future in futures:
+            try:
+                item = future.result()
+            except Exception as e:
+                logger.error(f"Failed to index item: {e}")
+                continue
+            if item:
+                yield item
+
+    def _index(self, in_item: MediaItem) -> Optional[MediaItem]:
         if not in_item:
             logger.error("Item is None")
-            return
+            return None
         if not (imdb_id := in_item.imdb_id):
             logger.error(f"Item {in_item.log_string} does not have an imdb_id, cannot index it")
-            return
-        
-        item = create_item_from_imdb_id(imdb_id)
+            return None
+
+        # Trakt reported a change, a cached response would bring back the old metadata
+        fresh = trakt_updates.is_updated(imdb_id)
+        item = create_item_from_imdb_id(imdb_id, fresh=fresh)
 
         if not isinstance(item, MediaItem):
             logger.error(f"Failed to get item from imdb_id: {imdb_id}")
-            return
+            return None
         if isinstance(item, Show):
-            self._add_seasons_to_show(item, imdb_id)
+            self._add_seasons_to_show(item, imdb_id, fresh)
         item = self.copy_items(in_item, item)
         item.indexed_at = datetime.now()
-        yield item
+        trakt_updates.done(imdb_id)
+        return item
+
+    @staticmethod
+    def merge(existing: MediaItem, indexed: MediaItem) -> int:
+        """Merge a re-indexed item into the stored one, returns how many items were added or changed."""
+        changed = _update_attributes(existing, indexed)
+        if not isinstance(existing, Show) or not isinstance(indexed, Show):
+            return changed
+        seasons = {season.number: season for season in existing.seasons}
+        # Adding a season or episode moves it out of the list it came from
+        for season in list(indexed.seasons):
+            if not (existing_season := seasons.get(season.number)):
+                existing.add_season(season)
+                changed += 1
+                continue
+            changed += _update_attributes(existing_season, season)
+            episodes = {episode.number: episode for episode in existing_season.episodes}
+            for episode in list(season.episodes):
+                if not (existing_episode := episodes.get(episode.number)):
+                    existing_season.add_episode(episode)
+                    changed += 1
+                else:
+                    changed += _update_attributes(existing_episode, episode)
+        return changed
 
     @staticmethod
     def should_submit(item: MediaItem) -> bool:
         if not item.indexed_at or not item.title:
             return True
 
+        if trakt_updates.active:
+            return trakt_updates.is_updated(item.imdb_id)
+
         settings = settings_manager.settings.indexer
 
         try:
@@ -75,7 +230,7 @@ class TraktIndexer:
             return False
 
     @staticmethod
-    def _add_seasons_to_show(show: Show, imdb_id: str):
+    def _add_seasons_to_show(show: Show, imdb_id: str, fresh: bool = False):
         """Add seasons to the given show using Trakt API."""
         if not isinstance(show, Show):
             logger.error(f"Item {show.log_string} is not a show")
@@ -85,7 +240,7 @@ class TraktIndexer:
             logger.error(f"Item {show.log_string} does not have an imdb_id, cannot index it")
             return
 
-        seasons = get_show(imdb_id)
+        seasons = get_show(imdb_id, fresh=fresh)
         for season in seasons:
             if season.number == 0:
                 continue
@@ -98,6 +253,17 @@ class TraktIndexer:
                 show.add_season(season_item)
 
 
+def _update_attributes(target: MediaItem, source: MediaItem) -> int:
+    """Copy the re-indexed attributes that differ, returns 1 when anything changed."""
+    changed = 0
+    for attribute in REINDEXED_ATTRIBUTES:
+        value = getattr(source, attribute, None)
+        if value is not None and value != getattr(target, attribute, None):
+            setattr(target, attribute, value)
+            changed = 1
+    return changed
+
+
 def _map_item_from_data(data, item_type: str, show_genres: List[str] = None) -> Optional[MediaItem]:
     """Map trakt.tv API data to MediaItemContainer."""
     if item_type not in ["movie", "show", "season", "episode"]:
@@ -154,17 +320,53 @@ def _get_formatted_date(data, item_type: str) -> Optional[datetime]:
     return None
 
 
-def get_show(imdb_id: str) -> dict:
+def _trakt_get(url: str, cache: Optional[ResponseCache] = None, fresh: bool = False):
+    """GET from the Trakt API through the shared session and rate limiter, `fresh` skips the cached response."""
+    if fresh and cache:
+        cache.evict("GET", url, headers=TRAKT_HEADERS)
+    try:
+        return get(url, additional_headers=TRAKT_HEADERS, specific_rate_limiter=trakt_rate_limiter, session=trakt_session, cache=cache)
+    except RateLimitExceeded as e:
+        # Hold every caller back for as long as Trakt asks
+        response = getattr(e, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        trakt_rate_limiter.limit_hit(float(retry_after or 10))
+        raise
+
+
+def get_show(imdb_id: str, fresh: bool = False) -> dict:
     """Wrapper for trakt.tv API show method."""
     url = f"https://api.trakt.tv/shows/{imdb_id}/seasons?extended=episodes,full"
-    response = get(url, additional_headers={"trakt-api-version": "2", "trakt-api-key": CLIENT_ID})
+    response = _trakt_get(url, cache=trakt_cache, fresh=fresh)
     return response.data if response.is_ok and response.data else {}
 
 
-def create_item_from_imdb_id(imdb_id: str) -> Optional[MediaItem]:
+def get_updated_ids(kind: str, since: datetime) -> Optional[Set[str]]:
+    """Imdb ids of the `kind`, "shows" or "movies", that Trakt updated since `since`, None when the feed failed."""
+    ids, page, pages = set(), 1, 1
+    start_date = since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    while page <= pages:
+        url = f"https://api.trakt.tv/{kind}/updates/{start_date}?page={page}&limit={UPDATES_PAGE_LIMIT}"
+        try:
+            response = _trakt_get(url)
+        except Exception as e:
+            logger.error(f"Failed to fetch updated {kind} from Trakt: {e}")
+            return None
+        if not response.is_ok:
+            return None
+        for entry in response.data or []:
+            media = getattr(entry, kind[:-1], None)
+            if imdb_id := getattr(getattr(media, "ids", None), "imdb", None):
+                ids.add(imdb_id)
+        pages = int(response.response.headers.get("X-Pagination-Page-Count", 1))
+        page += 1
+    return ids
+
+
+def create_item_from_imdb_id(imdb_id: str, fresh: bool = False) -> Optional[MediaItem]:
     """Wrapper for trakt.tv API search method."""
     url = f"https://api.trakt.tv/search/imdb/{imdb_id}?extended=full"
-    response = get(url, additional_headers={"trakt-api-version": "2", "trakt-api-key": CLIENT_ID})
+    response = _trakt_get(url, cache=trakt_cache, fresh=fresh)
     if not response.is_ok or not response.data:
         logger.error(f"Failed to create item using imdb id: {imdb_id}")  # This returns an empty list for response.data
         return None
@@ -180,13 +382,25 @@ def create_item_from_imdb_id(imdb_id: str) -> Optional[MediaItem]:
     return _map_item_from_data(getattr(data, data.type), data.type) if data else None
 
 
-def get_imdbid_from_tmdb(tmdb_id: str, type: str = "movie") -> Optional[str]:
-    """Wrapper for trakt.tv API search method."""
-    url = f"https://api.trakt.tv/search/tmdb/{tmdb_id}" # ?extended=full
-    response = get(url, additional_headers={"trakt-api-version": "2", "trakt-api-key": CLIENT_ID})
+def search_ids(source: str, external_id: str, type: str) -> Optional[dict]:
+    """Wrapper for trakt.tv API search method, returns the ids of the `type` item with the `source` id."""
+    url = f"https://api.trakt.tv/search/{source}/{external_id}"
+    response = _trakt_get(url, cache=trakt_ids_cache)
     if not response.is_ok or not response.data:
         return None
-    imdb_id = get_imdb_id_from_list(response.data, id_type="tmdb", _id=tmdb_id, type=type)
+    for ns in response.data:
+        ids = getattr(getattr(ns, type, None), "ids", None)
+        if ids and str(getattr(ids, source, None)) == str(external_id):
+            return {key: getattr(ids, key, None) for key in ("imdb", "tmdb", "tvdb")}
+    return None
+
+
+id_resolver = ExternalIdResolver(search_ids)
+
+
+def get_imdbid_from_tmdb(tmdb_id: str, type: str = "movie") -> Optional[str]:
+    """Resolve a tmdb id to an imdb id, through the id mapping and Trakt when it is unknown."""
+    imdb_id = id_resolver.resolve("tmdb", tmdb_id, type)
     if imdb_id and imdb_id.startswith("tt"):
         return imdb_id
     logger.error(f"Failed to fetch imdb_id for tmdb_id: {tmdb_id}")
@@ -194,34 +408,9 @@ def get_imdbid_from_tmdb(tmdb_id: str, type: str = "movie") -> Optional[str]:
 
 
 def get_imdbid_from_tvdb(tvdb_id: str, type: str = "show") -> Optional[str]:
-    """Wrapper for trakt.tv API search method."""
-    url = f"https://api.trakt.tv/search/tvdb/{tvdb_id}"
-    response = get(url, additional_headers={"trakt-api-version": "2", "trakt-api-key": CLIENT_ID})
-    if not response.is_ok or not response.data:
-        return None
-    imdb_id = get_imdb_id_from_list(response.data, id_type="tvdb", _id=tvdb_id, type=type)
+    """Resolve a tvdb id to an imdb id, through the id mapping and Trakt when it is unknown."""
+    imdb_id = id_resolver.resolve("tvdb", tvdb_id, type)
     if imdb_id and imdb_id.startswith("tt"):
         return imdb_id
     logger.error(f"Failed to fetch imdb_id for tvdb_id: {tvdb_id}")
-    return None
-
-
-def get_imdb_id_from_list(namespaces: List[SimpleNamespace], id_type: str = None, _id: str = None, type: str = None) -> Optional[str]:
-    """Get the imdb_id from the list of namespaces."""
-    if not any([id_type, _id, type]):
-        return None
-
-    for ns in namespaces:
-        if type == "movie" and hasattr(ns, 'movie') and hasattr(ns.movie, 'ids') and hasattr(ns.movie.ids, 'imdb'):
-            if str(getattr(ns.movie.ids, id_type)) == str(_id):
-                return ns.movie.ids.imdb
-        elif type == "show" and hasattr(ns, 'show') and hasattr(ns.show, 'ids') and hasattr(ns.show.ids, 'imdb'):
-            if str(getattr(ns.show.ids, id_type)) == str(_id):
-                return ns.show.ids.imdb
-        elif type == "season" and hasattr(ns, 'season') and hasattr(ns.season, 'ids') and hasattr(ns.season.ids, 'imdb'):
-            if str(getattr(ns.season.ids, id_type)) == str(_id):
-                return ns.season.ids.imdb
-        elif type == "episode" and hasattr(ns, 'episode') and hasattr(ns.episode, 'ids') and hasattr(ns.episode.ids, 'imdb'):
-            if str(getattr(ns.episode.ids, id_type)) == str(_id):
-                return ns.episode.ids.imdb
     return None
\ No newline at end of file
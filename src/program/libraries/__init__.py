@@ -1 +1,2 @@
 from .symlink import SymlinkLibrary  # noqa: F401
+from .integrity import SymlinkIntegrityScanner  # noqa: F401
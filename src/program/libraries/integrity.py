@@ -0,0 +1,109 @@
+"""Background check of the library symlinks for targets that disappeared"""
+import os
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from program.mount import get_mount_index
+from utils.logger import logger
+
+# Symlinks checked per run, runs are scheduled so the mount is never hammered
+BATCH_SIZE = 500
+
+
+class SymlinkIntegrityScanner:
+    """
+    Finds library symlinks whose target is gone from the rclone mount.
+
+    The library is walked with `os.scandir` in sorted order and links are read with
+    `os.readlink`, nothing is resolved through the mount. Targets are looked up in
+    the mount index, only a miss is confirmed with a stat of the target. Each run
+    checks at most `batch_size` links and remembers the last one, the next run
+    continues after it and starts over once the whole library was checked.
+    """
+
+    def __init__(self, library_path: Path, rclone_path: Path, batch_size: int = BATCH_SIZE):
+        self.library_path = Path(library_path)
+        self.rclone_path = Path(rclone_path)
+        self.batch_size = batch_size
+        self.cursor: Optional[tuple] = None
+        self.runs = 0
+        self.passes = 0
+        self.checked = 0
+        self.broken = 0
+        self.last_checked = 0
+        self.last_broken = 0
+        self.last_duration = 0.0
+        self.last_run_at: Optional[float] = None
+
+    def _walk(self, folder: str, parts: tuple) -> Iterator[tuple]:
+        try:
+            with os.scandir(folder) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.debug(f"Could not list {folder}: {e}")
+            return
+        for entry in entries:
+            entry_parts = parts + (entry.name,)
+            # Everything before the cursor was checked by an earlier run
+            if self.cursor and entry_parts < self.cursor[:len(entry_parts)]:
+                continue
+            if entry.is_symlink():
+                if not self.cursor or entry_parts > self.cursor:
+                    yield entry_parts, entry.path
+            elif entry.is_dir(follow_symlinks=False):
+                yield from self._walk(entry.path, entry_parts)
+
+    def _is_broken(self, link: str, index) -> bool:
+        try:
+            target = os.readlink(link)
+        except OSError:
+            return False
+        if not os.path.isabs(target):
+            target = os.path.normpath(os.path.join(os.path.dirname(link), target))
+        relative = os.path.relpath(target, self.rclone_path)
+        if not relative.startswith(os.pardir):
+            folder, filename = os.path.split(relative)
+            if index.contains(Path(folder or ".").as_posix(), filename):
+                return False
+        return not os.path.exists(target)
+
+    def run(self) -> List[str]:
+        """Check the next batch of symlinks, returns the paths of the broken ones."""
+        started = time.monotonic()
+        index = get_mount_index(self.rclone_path)
+        index.refresh()
+        checked, broken = 0, []
+        for parts, link in self._walk(str(self.library_path), ()):
+            if checked >= self.batch_size:
+                break
+            checked += 1
+            self.cursor = parts
+            if self._is_broken(link, index):
+                broken.append(link)
+        else:
+            self.cursor = None
+            self.passes += 1
+
+        self.runs += 1
+        self.checked += checked
+        self.broken += len(broken)
+        self.last_checked, self.last_broken = checked, len(broken)
+        self.last_duration = time.monotonic() - started
+        self.last_run_at = time.time()
+        log = logger.warning if broken else logger.debug
+        log(f"Checked {checked} symlinks in {self.last_duration:.2f}s, found {len(broken)} broken")
+        return broken
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "full_passes": self.passes,
+            "checked": self.checked,
+            "broken": self.broken,
+            "last_checked": self.last_checked,
+            "last_broken": self.last_broken,
+            "last_duration": round(self.last_duration, 4),
+            "last_run_at": self.last_run_at,
+            "cursor": "/".join(self.cursor) if self.cursor else None,
+        }
@@ -0,0 +1,130 @@
+"""Persisted snapshot of the library directories, used to rescan only what changed"""
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.logger import logger
+
+SNAPSHOT_VERSION = 1
+# Directories modified this close to the snapshot are listed again on the next
+# rescan, a change within the same mtime tick would otherwise go unnoticed
+RACY_WINDOW_NS = 2_000_000_000
+
+
+@dataclass
+class SnapshotDiff:
+    """Directories, relative to the library root, that differ from the previous snapshot."""
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+class LibrarySnapshot:
+    """
+    The (mtime, entry count) of every directory under the given top level folders of
+    the library, kept in a compact json file between runs.
+
+    `update` stats every known directory but only lists the ones whose mtime moved,
+    which is where entries were added, removed or renamed. A directory that was never
+    seen before is listed, and so are its subdirectories.
+    """
+
+    def __init__(self, root: Path, path: Path, folders: Iterable[str]):
+        self.root = Path(root)
+        self.path = Path(path)
+        self.folders = list(folders)
+        self.dirs: Dict[str, Tuple[int, int]] = {}
+        self.taken_at: Optional[int] = None
+        self.listed = 0
+        self.load()
+
+    def load(self) -> bool:
+        """Read the snapshot file, a missing or outdated file leaves the snapshot empty."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable library snapshot {self.path}: {e}")
+            return False
+        if data.get("version") != SNAPSHOT_VERSION or data.get("root") != str(self.root):
+            return False
+        self.dirs = {folder: tuple(value) for folder, value in data["dirs"].items()}
+        self.taken_at = data.get("taken_at")
+        return True
+
+    def save(self) -> None:
+        """Write the snapshot next to the old one and swap it in, so a crash never leaves half a file."""
+        data = {"version": SNAPSHOT_VERSION, "root": str(self.root), "taken_at": self.taken_at, "dirs": self.dirs}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temporary, self.path)
+
+    @property
+    def empty(self) -> bool:
+        return not self.dirs
+
+    def _children(self) -> Dict[str, List[str]]:
+        children: Dict[str, List[str]] = {}
+        for folder in self.dirs:
+            parent = os.path.dirname(folder)
+            if parent:
+                children.setdefault(parent, []).append(folder)
+        return children
+
+    def update(self) -> SnapshotDiff:
+        """Bring the snapshot up to date with the library and return the directories that differ."""
+        started = time.time_ns()
+        children = self._children()
+        diff = SnapshotDiff()
+        dirs: Dict[str, Tuple[int, int]] = {}
+        self.listed = 0
+        pending = list(reversed(self.folders))
+        while pending:
+            folder = pending.pop()
+            previous = self.dirs.get(folder)
+            try:
+                mtime = os.stat(self.root / folder).st_mtime_ns
+            except OSError:
+                if previous:
+                    diff.removed.append(folder)
+                continue
+            racy = self.taken_at is not None and mtime >= self.taken_at - RACY_WINDOW_NS
+            if previous and previous[0] == mtime and not racy:
+                # Nothing was added to or removed from it, only its subdirectories can differ
+                dirs[folder] = previous
+                pending.extend(reversed(children.get(folder, [])))
+                continue
+
+            try:
+                with os.scandir(self.root / folder) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except OSError as e:
+                logger.error(f"Can't list {self.root / folder}: {e}")
+                if previous:
+                    dirs[folder] = previous
+                continue
+            self.listed += 1
+            dirs[folder] = (mtime, len(entries))
+            if not previous:
+                diff.added.append(folder)
+            elif previous != dirs[folder]:
+                diff.changed.append(folder)
+            subfolders = [os.path.join(folder, entry.name) for entry in entries if entry.is_dir(follow_symlinks=False)]
+            listed = set(subfolders)
+            diff.removed.extend(child for child in children.get(folder, []) if child not in listed)
+            pending.extend(reversed(subfolders))
+
+        self.dirs = dirs
+        self.taken_at = started
+        return diff
+
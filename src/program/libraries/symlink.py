@@ -1,21 +1,40 @@
 import os
 import re
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
 from pathlib import Path
+from typing import List
 
+from program.libraries.snapshot import LibrarySnapshot
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.media.subtitle import Subtitle
 from program.settings.manager import settings_manager
+from utils import data_dir_path
 from utils.logger import logger
 
+SNAPSHOT_FILE = data_dir_path / "library_snapshot.json"
+
+
+@dataclass
+class LibraryChange:
+    """A show or movie folder that was added, changed or removed since the previous rescan."""
+    kind: str
+    path: Path
+    items: List[MediaItem] = field(default_factory=list)
+
 
 class SymlinkLibrary:
     def __init__(self):
         self.key = "symlinklibrary"
         self.settings = settings_manager.settings.symlink
+        self.snapshot = None
         self.initialized = self.validate()
         if not self.initialized:
             logger.error("SymlinkLibrary initialization failed due to invalid configuration.")
             return
+        self.snapshot = LibrarySnapshot(self.settings.library_path, SNAPSHOT_FILE, [d for d, _, _ in self._directories()])
 
     def validate(self) -> bool:
         """Validate the symlink library settings."""
@@ -36,32 +55,148 @@ class SymlinkLibrary:
             return False
         return True
 
+    def _directories(self):
+        """The (directory, item type, is anime) of every top level folder in use."""
+        directories = [("shows", "show", False), ("anime_shows", "anime show", True),
+                       ("movies", "movie", False), ("anime_movies", "anime movie", True)]
+        return [d for d in directories if self.settings.separate_anime_dirs or not d[2]]
+
     def run(self):
         """
         Create a library from the symlink paths. Return stub items that should
         be fed into an Indexer to have the rest of the metadata filled in.
         """
-        for directory, item_type, is_anime in [("shows", "show", False), ("anime_shows", "anime show", True)]:
-            if not self.settings.separate_anime_dirs and is_anime:
+        for directory, item_type, is_anime in self._directories():
+            if "show" in item_type:
+                yield from process_shows(self.settings.library_path / directory, item_type, is_anime)
+            else:
+                yield from process_items(self.settings.library_path / directory, Movie, item_type, is_anime)
+
+    def rescan(self) -> List[LibraryChange]:
+        """
+        Compare the library with the snapshot of the previous rescan and scan only the
+        show and movie folders in which something changed. The first rescan records the
+        snapshot and reports nothing, the library is imported in full by `run`.
+        """
+        first = self.snapshot.empty
+        diff = self.snapshot.update()
+        self.snapshot.save()
+        logger.debug(f"Library rescan listed {self.snapshot.listed} of {len(self.snapshot.dirs)} folders")
+        if first or not diff:
+            return []
+
+        library_path = Path(self.settings.library_path)
+        types = {directory: (item_type, is_anime) for directory, item_type, is_anime in self._directories()}
+        removed = {tuple(folder.split(os.sep)) for folder in diff.removed}
+        added = {tuple(folder.split(os.sep)) for folder in diff.added}
+        folders = {}
+        for parts in sorted(added | {tuple(folder.split(os.sep)) for folder in diff.changed} | removed):
+            # Top level folders only gain or lose show and movie folders, which are in the diff themselves
+            if len(parts) == 1:
                 continue
-            yield from process_shows(self.settings.library_path / directory, item_type, is_anime)
+            directory = parts[0]
+            # A show is scanned as a whole, whichever of its seasons changed
+            key = parts[:2] if "show" in types[directory][0] else parts
+            if key in removed:
+                folders[key] = "removed"
+            elif key not in folders:
+                folders[key] = "added" if key in added else "changed"
+
+        changes = []
+        for key, kind in folders.items():
+            path = library_path.joinpath(*key)
+            if kind == "removed":
+                changes.append(LibraryChange(kind, path))
+                continue
+            item_type, is_anime = types[key[0]]
+            if "show" in item_type:
+                show = process_show(library_path / key[0], key[1], item_type, is_anime)
+                items = [show] if show else []
+            else:
+                try:
+                    items = list(process_folder_items(path, _scandir(path), Movie, item_type, is_anime))
+                except OSError as e:
+                    logger.error(f"Can't list {path}: {e}")
+                    continue
+            changes.append(LibraryChange(kind, path, items))
+        logger.log("FILES", f"Library rescan found {len(changes)} changed folders")
+        return changes
+
+
+# Show folders scanned at once, listing the library is bound by the filesystem
+SCAN_WORKERS = 8
+
+
+def _scandir(directory) -> list:
+    """Entries of a directory, listed once, in name order."""
+    with os.scandir(directory) as entries:
+        return sorted(entries, key=lambda entry: entry.name)
+
+
+def _walk(directory):
+    """Yield the entries of every folder under `directory`, one folder at a time."""
+    pending = [str(directory)]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = _scandir(folder)
+        except OSError as e:
+            logger.error(f"Can't list {folder}: {e}")
+            continue
+        pending.extend(entry.path for entry in reversed(entries) if entry.is_dir(follow_symlinks=False))
+        yield Path(folder), entries
+
+
+def _subtitle_names(entries) -> list[str]:
+    return sorted(entry.name for entry in entries if entry.name.endswith(".srt"))
+
+
+# What a rescan knows about a link, copied onto the stored item it belongs to
+LINK_ATTRIBUTES = ("file", "folder", "symlink_path", "symlinked", "update_folder")
 
-        for directory, item_type, is_anime in [("movies", "movie", False), ("anime_movies", "anime movie", True)]:
-            if not self.settings.separate_anime_dirs and is_anime:
+
+def link_scanned_files(scanned: MediaItem, stored: MediaItem) -> int:
+    """
+    Record the symlinks a rescan found for a movie or show on the stored item, matching
+    seasons and episodes by number. Returns how many movies or episodes got a new link,
+    episodes the stored show doesn't have yet are left to the next re-index.
+    """
+    if isinstance(scanned, Show) and isinstance(stored, Show):
+        stored_seasons = {season.number: season for season in stored.seasons}
+        pairs = []
+        for season in scanned.seasons:
+            if not (stored_season := stored_seasons.get(season.number)):
                 continue
-            yield from process_items(self.settings.library_path / directory, Movie, item_type, is_anime)
+            episodes = {episode.number: episode for episode in stored_season.episodes}
+            pairs.extend((episode, episodes[episode.number]) for episode in season.episodes if episode.number in episodes)
+    elif isinstance(scanned, Movie) and isinstance(stored, Movie):
+        pairs = [(scanned, stored)]
+    else:
+        return 0
+
+    linked = 0
+    for source, target in pairs:
+        if target.symlinked and target.symlink_path == source.symlink_path:
+            continue
+        for attribute in LINK_ATTRIBUTES:
+            target.set(attribute, getattr(source, attribute))
+        target.set("symlinked_at", datetime.now())
+        linked += 1
+    return linked
 
 
 def process_items(directory: Path, item_class, item_type: str, is_anime: bool = False):
     """Process items in the given directory and yield MediaItem instances."""
-    items = [
-        (Path(root), file)
-        for root, _, files in os.walk(directory)
-        for file in files
-        if not file.endswith('.srt')
-    ]
-    for path, filename in items:
-        if filename.endswith(".srt"):
+    for path, entries in _walk(directory):
+        yield from process_folder_items(path, entries, item_class, item_type, is_anime)
+
+
+def process_folder_items(path: Path, entries: list, item_class, item_type: str, is_anime: bool = False):
+    """Yield a MediaItem for every file in one folder, `entries` is its listing."""
+    subtitles = _subtitle_names(entries)
+    for entry in entries:
+        filename = entry.name
+        if filename.endswith(".srt") or entry.is_dir(follow_symlinks=False):
             continue
         imdb_id = re.search(r"(tt\d+)", filename)
         title = re.search(r"(.+)?( \()", filename)
@@ -71,7 +206,7 @@ def process_items(directory: Path, item_class, item_type: str, is_anime: bool =
 
         item = item_class({"imdb_id": imdb_id.group(), "title": title.group(1)})
         resolve_symlink_and_set_attrs(item, path / filename)
-        find_subtitles(item, path / filename)
+        find_subtitles(item, path / filename, subtitles)
 
         if settings_manager.settings.force_refresh:
             item.set("symlinked", True)
@@ -84,62 +219,95 @@ def process_items(directory: Path, item_class, item_type: str, is_anime: bool =
         yield item
 
 def resolve_symlink_and_set_attrs(item, path: Path) -> Path:
-    # Resolve the symlink path
-    resolved_path = (path).resolve()
+    # Read where the symlink points without following it into the mount
+    try:
+        target = os.readlink(path)
+        resolved_path = Path(os.path.normpath(os.path.join(os.path.dirname(path), target)))
+    except OSError:
+        resolved_path = Path(path)
     item.file = str(resolved_path.stem)
     item.folder = str(resolved_path.parent.stem)
     item.symlink_path = str(path)
+    return resolved_path
 
-def find_subtitles(item, path: Path):
-    # Scan for subtitle files
-    for file in os.listdir(path.parent):
-        if file.startswith(Path(item.symlink_path).stem) and file.endswith(".srt"):
-            lang_code = file.split(".")[1]
-            item.subtitles.append(Subtitle({lang_code: (path.parent / file).__str__()}))
-            logger.debug(f"Found subtitle file {file}.")
+def find_subtitles(item, path: Path, subtitles: list[str] = None):
+    # Subtitles are the .srt files starting with the symlink name, `subtitles` is the
+    # sorted list of .srt files in the folder when the caller already listed it
+    if subtitles is None:
+        subtitles = _subtitle_names(_scandir(path.parent))
+    stem = Path(item.symlink_path).stem
+    for file in subtitles[bisect_left(subtitles, stem):]:
+        if not file.startswith(stem):
+            break
+        lang_code = file.split(".")[1]
+        item.subtitles.append(Subtitle({lang_code: (path.parent / file).__str__()}))
+        logger.debug(f"Found subtitle file {file}.")
 
 def process_shows(directory: Path, item_type: str, is_anime: bool = False) -> Show:
-    """Process shows in the given directory and yield Show instances."""
-    for show in os.listdir(directory):
-        imdb_id = re.search(r"(tt\d+)", show)
-        title = re.search(r"(.+)?( \()", show)
-        if not imdb_id or not title:
-            logger.log("NOT_FOUND", f"Can't extract {item_type} imdb_id or title at path {directory / show}")
+    """Process shows in the given directory and yield Show instances as they are scanned."""
+    shows = [entry for entry in _scandir(directory) if entry.is_dir(follow_symlinks=False)]
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="LibraryScan") as executor:
+        futures = [executor.submit(process_show, Path(directory), show.name, item_type, is_anime) for show in shows]
+        for future in as_completed(futures):
+            try:
+                show_item = future.result()
+            except Exception as e:
+                logger.error(f"Failed to scan {item_type} in {directory}: {e}")
+                continue
+            if show_item:
+                yield show_item
+
+def process_show(directory: Path, show: str, item_type: str, is_anime: bool = False) -> Show | None:
+    """Scan one show folder into a Show with its seasons and episodes."""
+    imdb_id = re.search(r"(tt\d+)", show)
+    title = re.search(r"(.+)?( \()", show)
+    if not imdb_id or not title:
+        logger.log("NOT_FOUND", f"Can't extract {item_type} imdb_id or title at path {directory / show}")
+        return None
+    show_item = Show({"imdb_id": imdb_id.group(), "title": title.group(1)})
+    if is_anime:
+        show_item.is_anime = True
+    force_refresh = settings_manager.settings.force_refresh
+    seasons = {}
+    for season_entry in _scandir(directory / show):
+        season = season_entry.name
+        if not season_entry.is_dir():
             continue
-        show_item = Show({"imdb_id": imdb_id.group(), "title": title.group(1)})
-        if is_anime:
-            show_item.is_anime = True
-        seasons = {}
-        for season in os.listdir(directory / show):
-            if not (season_number := re.search(r"(\d+)", season)):
-                logger.log("NOT_FOUND", f"Can't extract season number at path {directory / show / season}")
+        if not (season_number := re.search(r"(\d+)", season)):
+            logger.log("NOT_FOUND", f"Can't extract season number at path {directory / show / season}")
+            continue
+        season_item = Season({"number": int(season_number.group())})
+        episodes = {}
+        entries = _scandir(season_entry.path)
+        subtitles = _subtitle_names(entries)
+        for episode_entry in entries:
+            episode = episode_entry.name
+            if episode.endswith(".srt"):
+                continue
+            if not (episode_number := re.search(r"s\d+e(\d+)", episode, re.IGNORECASE)):
+                logger.log("NOT_FOUND", f"Can't extract episode number at path {directory / show / season / episode}")
+                # Delete the episode since it can't be indexed
+                os.remove(episode_entry.path)
                 continue
-            season_item = Season({"number": int(season_number.group())})
-            episodes = {}
-            for episode in os.listdir(directory / show / season):
-                if not (episode_number := re.search(r"s\d+e(\d+)", episode, re.IGNORECASE)):
-                    logger.log("NOT_FOUND", f"Can't extract episode number at path {directory / show / season / episode}")
-                    # Delete the episode since it can't be indexed
-                    os.remove(directory / show / season / episode)
-                    continue
 
-                episode_item = Episode({"number": int(episode_number.group(1))})
-                resolve_symlink_and_set_attrs(episode_item, Path(directory) / show / season / episode)
-                find_subtitles(episode_item, Path(directory) / show / season / episode)
-                if settings_manager.settings.force_refresh:
-                    episode_item.set("symlinked", True)
-                    episode_item.set("update_folder", str(Path(directory) / show / season / episode))
-                else:
-                    episode_item.set("symlinked", True)
-                    episode_item.set("update_folder", "updated")
-                if is_anime:
-                    episode_item.is_anime = True
-                episodes[int(episode_number.group(1))] = episode_item
-            if len(episodes) > 0:
-                for i in range(1, max(episodes.keys())+1):
-                    season_item.add_episode(episodes.get(i, Episode({"number": i})))
-                seasons[int(season_number.group())] = season_item
-        if len(seasons) > 0:
-            for i in range(1, max(seasons.keys())+1):
-                show_item.add_season(seasons.get(i, Season({"number": i})))
-        yield show_item
\ No newline at end of file
+            episode_path = Path(directory) / show / season / episode
+            episode_item = Episode({"number": int(episode_number.group(1))})
+            resolve_symlink_and_set_attrs(episode_item, episode_path)
+            find_subtitles(episode_item, episode_path, subtitles)
+            if force_refresh:
+                episode_item.set("symlinked", True)
+                episode_item.set("update_folder", str(episode_path))
+            else:
+                episode_item.set("symlinked", True)
+                episode_item.set("update_folder", "updated")
+            if is_anime:
+                episode_item.is_anime = True
+            episodes[int(episode_number.group(1))] = episode_item
+        if len(episodes) > 0:
+            for i in range(1, max(episodes.keys())+1):
+                season_item.add_episode(episodes.get(i, Episode({"number": i})))
+            seasons[int(season_number.group())] = season_item
+    if len(seasons) > 0:
+        for i in range(1, max(seasons.keys())+1):
+            show_item.add_season(seasons.get(i, Season({"number": i})))
+    return show_item
@@ -0,0 +1,33 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from program.db.db import db
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class SyncCursor(db.Model):
+    """Where an incremental sync against an external service left off, one row per sync."""
+    __tablename__ = "SyncCursor"
+
+    name: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    value: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(sqlalchemy.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __init__(self, name: str, value: str):
+        self.name = name
+        self.value = value
+
+
+def get_cursor(name: str) -> Optional[str]:
+    """Return the stored cursor of the sync `name`, or None when it never ran."""
+    with db.Session() as session:
+        cursor = session.get(SyncCursor, name)
+        return cursor.value if cursor else None
+
+
+def set_cursor(name: str, value: str) -> None:
+    """Store the cursor of the sync `name`, the next run continues from it."""
+    with db.Session() as session:
+        session.merge(SyncCursor(name, value))
+        session.commit()
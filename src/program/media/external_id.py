@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from program.db.db import db
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class ExternalId(db.Model):
+    """A tmdb or tvdb id resolved to its imdb id, a row without imdb_id records a failed lookup."""
+    __tablename__ = "ExternalId"
+
+    source: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    external_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    type: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    imdb_id: Mapped[Optional[str]] = mapped_column(sqlalchemy.String, nullable=True, index=True)
+    resolved_at: Mapped[datetime] = mapped_column(sqlalchemy.DateTime, default=datetime.now)
+
+    def __init__(self, source: str, external_id: str, type: str, imdb_id: Optional[str], resolved_at: Optional[datetime] = None):
+        self.source = source
+        self.external_id = str(external_id)
+        self.type = type
+        self.imdb_id = imdb_id
+        self.resolved_at = resolved_at or datetime.now()
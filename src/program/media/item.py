@@ -9,6 +9,7 @@ import sqlalchemy
 from program.db.db import db
 from program.media.state import States
 from RTN import parse
+from sqlalchemy import event
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from program.media.subtitle import Subtitle
@@ -58,6 +59,18 @@ class MediaItem(db.Model):
     last_state: Mapped[Optional[str]] = mapped_column(sqlalchemy.String, default="Unknown")
     subtitles: Mapped[list[Subtitle]] = relationship(Subtitle, back_populates="parent")
 
+    __table_args__ = (
+        # Trigram indexes backing `/items?search=`, requires the pg_trgm extension
+        sqlalchemy.Index(
+            "ix_mediaitem_title_trgm", "title",
+            postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+        sqlalchemy.Index(
+            "ix_mediaitem_imdb_id_trgm", "imdb_id",
+            postgresql_using="gin", postgresql_ops={"imdb_id": "gin_trgm_ops"},
+        ),
+    )
+
     __mapper_args__ = {
         "polymorphic_identity": "mediaitem",
         "polymorphic_on":"type",
@@ -115,19 +128,48 @@ class MediaItem(db.Model):
             asyncio.run(manager.send_item_update(json.dumps(self.to_dict())))
         self.last_state = self._determine_state().name
         
+    def _stream_index(self, collection: str) -> dict[str, Stream]:
+        """
+        Streams of `collection` keyed by lowercased infohash.
+
+        Built on first use, for items loaded from the database as well, and kept
+        in sync by the collection events registered below the class.
+        """
+        key = f"_{collection}_index"
+        index = self.__dict__.get(key)
+        if index is None:
+            index = {stream.infohash.lower(): stream for stream in getattr(self, collection)}
+            self.__dict__[key] = index
+        return index
+
+    def get_stream(self, infohash: str) -> Optional[Stream]:
+        """Get a stream of this item by infohash."""
+        return self._stream_index("streams").get(infohash.lower()) if infohash else None
+
     def is_stream_blacklisted(self, stream: Stream):
         """Check if a stream is blacklisted for this item."""
-        return stream in self.blacklisted_streams
+        return stream.infohash.lower() in self._stream_index("blacklisted_streams")
 
     def blacklist_stream(self, stream: Stream):
         """Blacklist a stream for this item."""
-        if stream in self.streams:
+        stream = self.get_stream(stream.infohash)
+        if stream:
             self.streams.remove(stream)
             self.blacklisted_streams.append(stream)
             logger.debug(f"Stream {stream.infohash} blacklisted for {self.log_string}")
             return True
         return False
 
+    def blacklist_streams(self, streams: List[Stream]) -> int:
+        """Blacklist many streams for this item at once, returns how many were blacklisted."""
+        index = self._stream_index("streams")
+        blacklisted = {key: index[key] for key in (stream.infohash.lower() for stream in streams) if key in index}
+        if blacklisted:
+            self.streams = [stream for stream in self.streams if stream.infohash.lower() not in blacklisted]
+            self.blacklisted_streams.extend(blacklisted.values())
+            logger.debug(f"{len(blacklisted)} streams blacklisted for {self.log_string}")
+        return len(blacklisted)
+
     @property
     def is_released(self) -> bool:
         """Check if an item has been released."""
@@ -185,8 +227,8 @@ class MediaItem(db.Model):
         self.overseerr_id = getattr(other, "overseerr_id", None)
 
     def is_scraped(self):
-        return (len(self.streams) > 0 
-                and any(not stream in self.blacklisted_streams for stream in self.streams))
+        blacklisted = self._stream_index("blacklisted_streams")
+        return any(infohash not in blacklisted for infohash in self._stream_index("streams"))
 
     def to_dict(self):
         """Convert item to dictionary (API response)"""
@@ -305,7 +347,7 @@ class MediaItem(db.Model):
         self.set("alternative_folder", None)
 
         if hasattr(self, "active_stream"):
-            stream: Stream = next((stream for stream in self.streams if stream.infohash == self.active_stream["hash"]), None)
+            stream = self.get_stream((self.active_stream or {}).get("hash"))
             if stream:
                 self.blacklist_stream(stream)
 
@@ -330,6 +372,34 @@ class MediaItem(db.Model):
         return self.parent.collection if self.parent else self.item_id
 
 
+def _index_stream_collection(collection: str) -> None:
+    """Keep `MediaItem._stream_index(collection)` in step with the relationship collection."""
+    key = f"_{collection}_index"
+    attribute = getattr(MediaItem, collection)
+
+    @event.listens_for(attribute, "append", propagate=True)
+    def _append(target, value, _initiator):
+        index = target.__dict__.get(key)
+        if index is not None and value is not None:
+            index[value.infohash.lower()] = value
+
+    @event.listens_for(attribute, "remove", propagate=True)
+    def _remove(target, value, _initiator):
+        index = target.__dict__.get(key)
+        if index is not None and value is not None and index.get(value.infohash.lower()) is value:
+            del index[value.infohash.lower()]
+
+    @event.listens_for(attribute, "bulk_replace", propagate=True)
+    @event.listens_for(attribute, "init_collection", propagate=True)
+    @event.listens_for(attribute, "dispose_collection", propagate=True)
+    def _reset(target, *_args):
+        target.__dict__.pop(key, None)
+
+
+_index_stream_collection("streams")
+_index_stream_collection("blacklisted_streams")
+
+
 class Movie(MediaItem):
     """Movie class"""
     __tablename__ = "Movie"
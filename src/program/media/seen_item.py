@@ -0,0 +1,20 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from program.db.db import db
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class SeenItem(db.Model):
+    """An imdb id a content source already emitted, one row per source."""
+    __tablename__ = "SeenItem"
+
+    source: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    imdb_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True, index=True)
+    seen_at: Mapped[datetime] = mapped_column(sqlalchemy.DateTime, default=datetime.now, index=True)
+
+    def __init__(self, source: str, imdb_id: str, seen_at: Optional[datetime] = None):
+        self.source = source
+        self.imdb_id = imdb_id
+        self.seen_at = seen_at or datetime.now()
@@ -39,7 +39,7 @@ class Stream(db.Model):
         self.lev_ratio = torrent.lev_ratio
 
     def __hash__(self):
-        return self.infohash
+        return hash(self.infohash)
     
     def __eq__(self, other):
         return isinstance(other, Stream) and self.infohash == other.infohash
\ No newline at end of file
@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+from program.db.db import db
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class DebridTorrent(db.Model):
+    """A torrent we added to a debrid account, one row per (provider, infohash)."""
+    __tablename__ = "DebridTorrent"
+
+    _id: Mapped[int] = mapped_column(sqlalchemy.Integer, primary_key=True)
+    provider: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    infohash: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    torrent_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    name: Mapped[Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
+    alternative_name: Mapped[Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
+    files: Mapped[Optional[dict | list]] = mapped_column(sqlalchemy.JSON, nullable=True)
+    added_at: Mapped[datetime] = mapped_column(sqlalchemy.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint("provider", "infohash", name="uq_debridtorrent_provider_infohash"),
+        sqlalchemy.Index("ix_debridtorrent_provider_torrent_id", "provider", "torrent_id"),
+    )
+
+    def __init__(self, provider: str, infohash: str, torrent_id: str, files: Optional[dict | list] = None,
+                 name: Optional[str] = None, alternative_name: Optional[str] = None):
+        self.provider = provider
+        self.infohash = infohash.lower()
+        self.torrent_id = str(torrent_id)
+        self.files = files
+        self.name = name
+        self.alternative_name = alternative_name
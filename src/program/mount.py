@@ -0,0 +1,267 @@
+"""In-memory index of the files on the rclone mount, and waiting for files to show up on it"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Union
+
+from utils.logger import logger
+
+SCAN_WORKERS = 8
+# Lookups that miss only trigger a new refresh this often
+MIN_REFRESH_INTERVAL = 10
+
+
+class _Directory(NamedTuple):
+    mtime: int
+    files: tuple
+    dirs: tuple
+
+
+class MountIndex:
+    """
+    Filenames on the rclone mount mapped to the folders holding them.
+
+    Walking a mount with tens of thousands of torrents is thousands of slow FUSE
+    readdir calls, with this index finding a file is a dictionary lookup. The index
+    is built with `os.scandir`, one directory level at a time with the directories
+    of a level listed in parallel. A refresh only stats the directories it already
+    knows and lists again the ones whose mtime changed.
+
+    Folders are relative to the mount root in posix form, "." being the root itself.
+    """
+
+    def __init__(self, root: Path, workers: int = SCAN_WORKERS, min_refresh_interval: float = MIN_REFRESH_INTERVAL):
+        self.root = Path(root)
+        self.min_refresh_interval = min_refresh_interval
+        self.scans = 0
+        self._dirs: dict[str, _Directory] = {}
+        self._files: dict[str, tuple] = {}
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="MountIndex")
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @staticmethod
+    def _join(folder: str, name: str) -> str:
+        return name if folder == "." else f"{folder}/{name}"
+
+    def _visit(self, folder: str, known: dict[str, _Directory]) -> Optional[_Directory]:
+        path = self.root / folder
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            cached = known.get(folder)
+            if cached and cached.mtime == mtime:
+                return cached
+            files, dirs = [], []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    (dirs if entry.is_dir() else files).append(entry.name)
+            self.scans += 1
+            return _Directory(mtime, tuple(files), tuple(dirs))
+        except OSError as e:
+            logger.debug(f"Could not list {path}: {e}")
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """Bring the index up to date with the mount, returns False if it was refreshed too recently."""
+        requested_at = time.monotonic()
+        with self._refresh_lock:
+            if not force and self._refreshed_at is not None and (
+                self._refreshed_at >= requested_at or requested_at - self._refreshed_at < self.min_refresh_interval
+            ):
+                return False
+            started = time.monotonic()
+            known, dirs = self._dirs, {}
+            level = ["."]
+            while level:
+                listed = self._executor.map(lambda folder: self._visit(folder, known), level)
+                next_level = []
+                for folder, directory in zip(level, listed):
+                    if directory is None:
+                        continue
+                    dirs[folder] = directory
+                    next_level.extend(self._join(folder, name) for name in directory.dirs)
+                level = next_level
+
+            files: dict[str, list] = {}
+            for folder, directory in dirs.items():
+                for name in directory.files:
+                    files.setdefault(name, []).append(folder)
+            self._dirs = dirs
+            self._files = {name: tuple(sorted(folders)) for name, folders in files.items()}
+            self._refreshed_at = time.monotonic()
+            logger.debug(f"Indexed {len(self._files)} files in {len(dirs)} folders of {self.root} in {self._refreshed_at - started:.2f}s")
+            return True
+
+    def folders(self, filename: str) -> tuple:
+        """Every folder holding a file with this name."""
+        if self._refreshed_at is None:
+            self.refresh()
+        return self._files.get(filename, ())
+
+    def contains(self, folder: str, filename: str) -> bool:
+        return folder in self.folders(filename)
+
+    def find(self, filename: str, refresh: bool = True) -> Optional[str]:
+        """The folder holding the file, refreshing the index once if it is not known yet."""
+        folders = self.folders(filename)
+        if not folders and refresh and self.refresh():
+            folders = self.folders(filename)
+        return folders[0] if folders else None
+
+    def add(self, folder: str, filename: str) -> None:
+        """Record a file found on the mount outside of a refresh."""
+        folders = self._files.get(filename, ())
+        if folder not in folders:
+            self._files[filename] = tuple(sorted((*folders, folder)))
+
+
+_indexes: dict[Path, MountIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_mount_index(root: Path) -> MountIndex:
+    """The shared index of the mount at `root`."""
+    root = Path(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = MountIndex(root)
+        return _indexes[root]
+
+
+WAIT_INTERVAL = 5
+WAIT_TIMEOUT = 90
+# Look for files anywhere on the mount once they are this late at their expected path
+SEARCH_AFTER = 30
+
+
+class _Waiter(NamedTuple):
+    root: Path
+    files: tuple  # (filename, candidate folders) pairs
+    started: float
+    deadline: float
+
+
+class FileWaiter:
+    """
+    Waits for files to show up on the mount, for any number of items at once.
+
+    Items register the files they expect with `expect` instead of blocking a thread
+    until they appear. One watcher thread checks the expected paths of every waiting
+    item each `interval`. Files still missing after `search_after` seconds are also
+    looked up by name in the mount index, which gets refreshed for it. Once all files
+    of an item are found, or its timeout ran out, the result is kept for `pop_result`
+    and `on_done(key)` is called so the item can be resubmitted.
+    """
+
+    def __init__(self, interval: float = WAIT_INTERVAL, timeout: float = WAIT_TIMEOUT, search_after: float = SEARCH_AFTER):
+        self.interval = interval
+        self.timeout = timeout
+        self.search_after = search_after
+        self.on_done: Optional[Callable[[Any], None]] = None
+        self._waiting: dict[Any, _Waiter] = {}
+        self._found: dict[Any, dict[str, str]] = {}
+        self._results: dict[Any, Any] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._waiting)
+
+    def is_waiting(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._waiting
+
+    def expect(self, key: Any, root: Path, files: Iterable[tuple[str, Iterable[str]]], timeout: Optional[float] = None) -> bool:
+        """
+        Wait for every `(filename, candidate_folders)` of `files` under `root`.
+
+        Returns False if the key is already waiting.
+        """
+        now = time.monotonic()
+        waiter = _Waiter(
+            Path(root),
+            tuple((filename, tuple(folder for folder in folders if folder)) for filename, folders in files),
+            now,
+            now + (self.timeout if timeout is None else timeout),
+        )
+        with self._lock:
+            if key in self._waiting:
+                return False
+            self._waiting[key] = waiter
+            self._found[key] = {}
+            self._results.pop(key, None)
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="FileWaiter", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return True
+
+    def pop_result(self, key: Any) -> Optional[Union[dict[str, str], bool]]:
+        """
+        The outcome of the key's last wait: the folder of every filename once all were
+        found, False on timeout, or None if it is still waiting or never waited.
+        """
+        with self._lock:
+            return self._results.pop(key, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._waiting:
+                    self._thread = None
+                    return
+                waiting = dict(self._waiting)
+            self._check(waiting)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _check(self, waiting: dict[Any, _Waiter]) -> None:
+        now = time.monotonic()
+        refreshed = set()
+        done = []
+        for key, waiter in waiting.items():
+            found = self._found[key]
+            index = get_mount_index(waiter.root)
+            for filename, folders in waiter.files:
+                if filename in found:
+                    continue
+                for folder in folders:
+                    if index.contains(folder, filename) or (waiter.root / folder / filename).exists():
+                        index.add(folder, filename)
+                        found[filename] = folder
+                        break
+                else:
+                    if now - waiter.started >= self.search_after:
+                        if waiter.root not in refreshed:
+                            index.refresh()
+                            refreshed.add(waiter.root)
+                        folder = index.find(filename, refresh=False)
+                        if folder:
+                            found[filename] = folder
+            if len(found) == len(waiter.files):
+                done.append((key, dict(found)))
+            elif now >= waiter.deadline:
+                done.append((key, False))
+
+        for key, result in done:
+            with self._lock:
+                self._waiting.pop(key, None)
+                self._found.pop(key, None)
+                self._results[key] = result
+            if result is False:
+                logger.log("SYMLINKER", f"Files of {key} not found after waiting {self.timeout} seconds")
+            if self.on_done:
+                try:
+                    self.on_done(key)
+                except Exception as e:
+                    logger.error(f"Failed to resubmit {key} after waiting for its files: {e}")
+
+
+file_waiter = FileWaiter()
@@ -5,14 +5,17 @@ import time
 import traceback
 from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from multiprocessing import Lock
 from queue import Empty, Queue
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from program.content import Listrr, Mdblist, Overseerr, PlexWatchlist, TraktContent
+from program.content.seen import EXPIRE_INTERVAL, expire_seen
 from program.downloaders import Downloader
-from program.indexers.trakt import TraktIndexer
-from program.libraries import SymlinkLibrary
+from program.indexers.trakt import TraktIndexer, trakt_updates
+from program.libraries import SymlinkIntegrityScanner, SymlinkLibrary
+from program.libraries.symlink import link_scanned_files
 from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.media.state import States
 from program.post_processing import PostProcessing
@@ -25,6 +28,7 @@ from utils import data_dir_path
 from utils.logger import logger, scrub_logs
 from utils.notifications import notify_on_complete
 
+from .mount import file_waiter
 from .state_transition import process_event
 from .symlink import Symlinker
 from .types import Event, Service
@@ -35,6 +39,7 @@ if settings_manager.settings.tracemalloc:
 import program.db.db_functions as DB
 from program.db.db import db, run_migrations
 from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
 
 
 class Program(threading.Thread):
@@ -146,21 +151,17 @@ class Program(threading.Thread):
             res = session.execute(select(func.count(MediaItem._id))).scalar_one()
             added = []
             if res == 0:
-                for item in self.services[SymlinkLibrary].run():
-                    if settings_manager.settings.map_metadata:
-                        if isinstance(item, (Movie, Show)):
-                            try:
-                                item = next(self.services[TraktIndexer].run(item))
-                            except StopIteration as e:
-                                logger.error(f"Failed to enhance metadata for {item.title} ({item.item_id}): {e}")
-                                continue
-                            if item.item_id in added:
-                                logger.error(f"Cannot enhance metadata, {item.title} ({item.item_id}) contains multiple folders. Manual resolution required. Skipping.")
-                                continue
-                            added.append(item.item_id)
-                            item.store_state()
-                            session.add(item)
-                            logger.debug(f"Mapped metadata to {item.type.title()}: {item.log_string}")
+                if settings_manager.settings.map_metadata:
+                    library_items = (item for item in self.services[SymlinkLibrary].run() if isinstance(item, (Movie, Show)))
+                    # Items are indexed concurrently and stored in the order they finish
+                    for item in self.services[TraktIndexer].run_batch(library_items):
+                        if item.item_id in added:
+                            logger.error(f"Cannot enhance metadata, {item.title} ({item.item_id}) contains multiple folders. Manual resolution required. Skipping.")
+                            continue
+                        added.append(item.item_id)
+                        item.store_state()
+                        session.add(item)
+                        logger.debug(f"Mapped metadata to {item.type.title()}: {item.log_string}")
                 session.commit()
 
             movies_symlinks = session.execute(select(func.count(Movie._id)).where(Movie.symlinked == True)).scalar_one() # noqa
@@ -179,6 +180,14 @@ class Program(threading.Thread):
             logger.log("ITEM", f"Total Items: {total_items} (Symlinks: {total_symlinks})")
 
         self.executors = []
+        file_waiter.on_done = self._resubmit_waiting_item
+        for service in self.services[Downloader].tracked_services:
+            service.download_tracker.on_done = partial(self._resubmit_waiting_item, emitted_by="DownloadTracker")
+        self.symlink_scanner = None
+        if self.services[Symlinker].initialized:
+            self.symlink_scanner = SymlinkIntegrityScanner(
+                settings_manager.settings.symlink.library_path, settings_manager.settings.symlink.rclone_path
+            )
         self.scheduler = BackgroundScheduler()
         self._schedule_services()
         self._schedule_functions()
@@ -213,6 +222,100 @@ class Program(threading.Thread):
                 for item in items_to_submit:
                     self._push_event_queue(Event(emitted_by="RetryLibrary", item=item))
 
+    def _resubmit_waiting_item(self, item_id: int, emitted_by: str = "FileWaiter") -> None:
+        """Put an item back in the queue once what it waited for showed up, or the wait timed out."""
+        with db.Session() as session:
+            item = session.execute(select(MediaItem).where(MediaItem._id == item_id)).unique().scalar_one_or_none()
+        if item:
+            self._push_event_queue(Event(emitted_by=emitted_by, item=item))
+
+    def _check_symlink_integrity(self) -> None:
+        """Reset and requeue the items whose symlink target disappeared from the mount."""
+        if not self.symlink_scanner:
+            return
+        broken = self.symlink_scanner.run()
+        if not broken:
+            return
+        with db.Session() as session:
+            session.expire_on_commit = False
+            items = session.execute(select(MediaItem).where(MediaItem.symlink_path.in_(broken))).unique().scalars().all()
+            for item in items:
+                logger.log("SYMLINKER", f"Symlink of {item.log_string} is broken, resetting it")
+                symlink_path = item.symlink_path
+                item.reset()
+                if os.path.islink(symlink_path):
+                    os.unlink(symlink_path)
+                item.store_state()
+            session.commit()
+        for item in items:
+            self.add_to_queue(item, emitted_by="SymlinkIntegrity")
+
+    def _rescan_library(self) -> None:
+        """Queue the library folders that changed since the last rescan, reset the items whose symlinks are gone."""
+        changes = self.services[SymlinkLibrary].rescan()
+        if not changes:
+            return
+        with db.Session() as session:
+            session.expire_on_commit = False
+            removed = {}
+            for change in changes:
+                prefix = f"{change.path}{os.sep}"
+                items = session.execute(
+                    select(MediaItem).where(MediaItem.symlink_path.startswith(prefix, autoescape=True))
+                ).unique().scalars().all()
+                removed.update((item._id, item) for item in items if not os.path.lexists(item.symlink_path))
+            for item in removed.values():
+                logger.log("SYMLINKER", f"Symlink of {item.log_string} was removed from the library, resetting it")
+                item.reset()
+                item.store_state()
+
+            # Links found for items in the library are recorded on them, only new items go through the pipeline
+            linked, new_items = {}, []
+            for scanned in (item for change in changes for item in change.items):
+                stored = session.execute(
+                    select(MediaItem)
+                    .where(MediaItem.type.in_(["movie", "show"]))
+                    .where(MediaItem.imdb_id == scanned.imdb_id)
+                    .options(joinedload("*"))
+                ).unique().scalar_one_or_none()
+                if stored is None:
+                    new_items.append(scanned)
+                elif count := link_scanned_files(scanned, stored):
+                    logger.log("SYMLINKER", f"Library rescan found {count} new links for {stored.log_string}")
+                    stored.store_state()
+                    linked[stored._id] = stored
+            session.commit()
+        for item in [*removed.values(), *linked.values()]:
+            self.add_to_queue(item, emitted_by="LibraryRescan")
+        self._push_events_queue(Event(emitted_by=SymlinkLibrary, item=item) for item in new_items)
+
+    def _sync_trakt_updates(self) -> None:
+        """Re-index the shows and movies in the library that Trakt updated since the last sync."""
+        ids = sorted(trakt_updates.sync())
+        items = []
+        with db.Session() as session:
+            session.expire_on_commit = False
+            for start in range(0, len(ids), 500):
+                items.extend(session.execute(
+                    select(MediaItem)
+                    .where(MediaItem.type.in_(["movie", "show"]))
+                    .where(MediaItem.imdb_id.in_(ids[start:start + 500]))
+                    .where(MediaItem.indexed_at.isnot(None))
+                    .options(joinedload("*"))
+                ).unique().scalars().all())
+        # The feed covers all of Trakt, only what is in the library is kept until it is re-indexed
+        trakt_updates.mark({item.imdb_id for item in items})
+        for item in items:
+            if self._id_in_queue(item._id) or self._id_in_running_events(item._id):
+                continue
+            self.add_to_running(Event(TraktIndexer.__name__, item))
+            self._submit_job(TraktIndexer, item)
+
+    def _expire_seen_items(self) -> None:
+        """Let the content services emit items again that left the library or never reached it."""
+        if removed := expire_seen():
+            logger.debug(f"Expired {removed} seen items that are not in the library")
+
     def _download_subtitles(self) -> None:
         if settings_manager.settings.post_processing.subliminal.enabled:
             self.services[PostProcessing].services[Subliminal].scan_files_and_download()
@@ -221,7 +324,13 @@ class Program(threading.Thread):
         """Schedule each service based on its update interval."""
         scheduled_functions = {
             self._retry_library: {"interval": 60 * 10},
+            self._check_symlink_integrity: {"interval": 60 * 5},
+            self._expire_seen_items: {"interval": EXPIRE_INTERVAL},
         }
+        if settings_manager.settings.indexer.incremental_updates:
+            scheduled_functions[self._sync_trakt_updates] = {"interval": settings_manager.settings.indexer.update_interval}
+        if self.services[SymlinkLibrary].initialized and settings_manager.settings.symlink.library_rescan_interval:
+            scheduled_functions[self._rescan_library] = {"interval": settings_manager.settings.symlink.library_rescan_interval}
         if settings_manager.settings.post_processing.subliminal.enabled:
             pass
             # scheduled_functions[self._download_subtitles] = {"interval": 60 * 60 * 24}
@@ -269,41 +378,50 @@ class Program(threading.Thread):
 
     def _push_event_queue(self, event):
         with self.mutex:
-            if any(event.item.imdb_id and qi.item.imdb_id == event.item.imdb_id for qi in self.queued_events):
-                logger.debug(f"Item {event.item.log_string} is already in the queue, skipping.")
-                return False
-            elif any(event.item.imdb_id and ri.item.imdb_id == event.item.imdb_id for ri in self.running_events):
-                logger.debug(f"Item {event.item.log_string} is already running, skipping.")
-                return False
-
-            if isinstance(event.item, MediaItem) and hasattr(event.item, "_id"):
-                if event.item.type == "show":
-                    for s in event.item.seasons:
-                        if self._id_in_queue(s._id) or self._id_in_running_events(s._id):
-                            return False
-                        for e in s.episodes:
-                            if self._id_in_queue(e._id) or self._id_in_running_events(e._id):
-                                return False
+            return self._queue_event(event)
 
-                elif event.item.type == "season":
-                    for e in event.item.episodes:
+    def _push_events_queue(self, events) -> int:
+        """Push many events while holding the mutex once, returns how many were queued."""
+        with self.mutex:
+            return sum(1 for event in events if self._queue_event(event))
+
+    def _queue_event(self, event) -> bool:
+        """Queue an event unless it, or a related item, is already queued or running. Caller must hold the mutex."""
+        if any(event.item.imdb_id and qi.item.imdb_id == event.item.imdb_id for qi in self.queued_events):
+            logger.debug(f"Item {event.item.log_string} is already in the queue, skipping.")
+            return False
+        elif any(event.item.imdb_id and ri.item.imdb_id == event.item.imdb_id for ri in self.running_events):
+            logger.debug(f"Item {event.item.log_string} is already running, skipping.")
+            return False
+
+        if isinstance(event.item, MediaItem) and hasattr(event.item, "_id"):
+            if event.item.type == "show":
+                for s in event.item.seasons:
+                    if self._id_in_queue(s._id) or self._id_in_running_events(s._id):
+                        return False
+                    for e in s.episodes:
                         if self._id_in_queue(e._id) or self._id_in_running_events(e._id):
                             return False
 
-                elif hasattr(event.item, "parent"):
-                    parent = event.item.parent
-                    if self._id_in_queue(parent._id) or self._id_in_running_events(parent._id):
-                        return False
-                    elif hasattr(parent, "parent") and (self._id_in_queue(parent.parent._id) or self._id_in_running_events(parent.parent._id)):
+            elif event.item.type == "season":
+                for e in event.item.episodes:
+                    if self._id_in_queue(e._id) or self._id_in_running_events(e._id):
                         return False
 
-            if not isinstance(event.item, (Show, Movie, Episode, Season)):
-                logger.log("NEW", f"Added {event.item.log_string} to the queue")
-            else:
-                logger.log("DISCOVERY", f"Re-added {event.item.log_string} to the queue")
-            self.queued_events.append(event)
-            self.event_queue.put(event)
-            return True
+            elif hasattr(event.item, "parent"):
+                parent = event.item.parent
+                if self._id_in_queue(parent._id) or self._id_in_running_events(parent._id):
+                    return False
+                elif hasattr(parent, "parent") and (self._id_in_queue(parent.parent._id) or self._id_in_running_events(parent.parent._id)):
+                    return False
+
+        if not isinstance(event.item, (Show, Movie, Episode, Season)):
+            logger.log("NEW", f"Added {event.item.log_string} to the queue")
+        else:
+            logger.log("DISCOVERY", f"Re-added {event.item.log_string} to the queue")
+        self.queued_events.append(event)
+        self.event_queue.put(event)
+        return True
 
     def _pop_event_queue(self, event):
         with self.mutex:
@@ -317,6 +435,16 @@ class Program(threading.Thread):
                 self.running_events.remove(event)
                 logger.log("PROGRAM", f"Item {item.log_string} finished running section {service_name}" )
 
+    def _remove_many_from_running_events(self, items, service_name=""):
+        """Remove the running events of many items while holding the mutex once."""
+        ids = {item._id for item in items if item._id}
+        imdb_ids = {item.imdb_id for item in items if item.imdb_id}
+        with self.mutex:
+            finished = [event for event in self.running_events if event.item._id in ids or event.item.imdb_id in imdb_ids]
+            for event in finished:
+                self.running_events.remove(event)
+                logger.log("PROGRAM", f"Item {event.item.log_string} finished running section {service_name}")
+
     def add_to_running(self, e):
         if e.item is None:
             return
@@ -365,7 +493,9 @@ class Program(threading.Thread):
                 break
 
         if not found:
-            max_workers = int(os.environ[service.__name__.upper() +"_MAX_WORKERS"]) if service.__name__.upper() + "_MAX_WORKERS" in os.environ else 1
+            # A service can raise its default, e.g. the Trakt indexer that shares one rate limiter between its workers
+            default_workers = getattr(self.services[service], "max_workers", 1)
+            max_workers = int(os.environ[service.__name__.upper() +"_MAX_WORKERS"]) if service.__name__.upper() + "_MAX_WORKERS" in os.environ else default_workers
             new_executor = ThreadPoolExecutor(thread_name_prefix=f"Worker_{service.__name__}", max_workers=max_workers )
             self.executors.append({ "_name_prefix": service.__name__, "_executor": new_executor })
             cur_executor = new_executor
@@ -401,6 +531,18 @@ class Program(threading.Thread):
             snapshot = tracemalloc.take_snapshot()
             self.display_top_allocators(snapshot)
 
+    @staticmethod
+    def _merge_indexed(existing_item: MediaItem, indexed: MediaItem) -> None:
+        """Bring what the TraktIndexer emitted into the stored item, which carries on through the pipeline."""
+        if not existing_item.indexed_at:
+            if isinstance(existing_item, (Show, Season)):
+                existing_item.fill_in_missing_children(indexed)
+            existing_item.copy_other_media_attr(indexed)
+        # A re-index only brings in the seasons and episodes that are new or changed
+        elif changed := TraktIndexer.merge(existing_item, indexed):
+            logger.debug(f"Re-indexing {existing_item.log_string} added or changed {changed} items")
+        existing_item.indexed_at = indexed.indexed_at
+
     def run(self):
         while self.running:
             if not self.validate():
@@ -420,6 +562,9 @@ class Program(threading.Thread):
 
             with db.Session() as session:
                 existing_item: MediaItem | None = DB._get_item_from_db(session, event.item)
+                if existing_item is not None and event.emitted_by == TraktIndexer and event.item is not existing_item:
+                    # Indexed metadata goes into the stored item before its state decides what comes next
+                    self._merge_indexed(existing_item, event.item)
                 processed_item, next_service, items_to_submit = process_event(
                     existing_item, event.emitted_by, existing_item if existing_item is not None else event.item
                 )
@@ -435,6 +580,12 @@ class Program(threading.Thread):
 
                 if items_to_submit:
                     for item_to_submit in items_to_submit:
+                        if next_service == Downloader and self.services[Downloader].is_waiting(item_to_submit):
+                            # Resubmitted by the download tracker once its torrent is ready
+                            logger.debug(f"{item_to_submit.log_string} not submitted to Downloader while its torrent is not ready")
+                            continue
+                        if next_service == Downloader and item_to_submit.state == States.Scraped:
+                            self.services[Downloader].prefetch(item_to_submit)
                         self.add_to_running(Event(next_service.__name__, item_to_submit))
                         self._submit_job(next_service, item_to_submit)
                 if isinstance(processed_item, MediaItem):
@@ -460,6 +611,11 @@ class Program(threading.Thread):
         logger.log("PROGRAM", f"Adding {item.log_string} to the queue.")
         return self._push_event_queue(Event(emitted_by=emitted_by, item=item))
 
+    def add_many_to_queue(self, items: list[MediaItem], emitted_by="Manual") -> int:
+        """Add many items to the queue for processing, returns how many were queued."""
+        logger.log("PROGRAM", f"Adding {len(items)} items to the queue.")
+        return self._push_events_queue(Event(emitted_by=emitted_by, item=item) for item in items)
+
     def clear_queue(self):
         """Clear the event queue."""
         logger.log("PROGRAM", "Clearing the event queue. Please wait.")
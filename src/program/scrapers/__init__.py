@@ -74,7 +74,7 @@ class Scraping:
         if self.can_we_scrape(item):
             sorted_streams = self.scrape(item)
             for stream in sorted_streams.values():
-                if stream not in item.streams:
+                if not item.get_stream(stream.infohash):
                     item.streams.append(stream)
             item.set("scraped_at", datetime.now())
             item.set("scraped_times", item.scraped_times + 1)
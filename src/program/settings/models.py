@@ -63,6 +63,8 @@ class DownloadersModel(Observable):
     movie_filesize_max: int = -1  # MB (-1 is no limit)
     episode_filesize_min: int = 40  # MB
     episode_filesize_max: int = -1  # MB (-1 is no limit)
+    multi_provider: bool = False  # Race every enabled provider instead of allowing only one
+    availability_prefetch: int = 0  # Top ranked hashes checked once an item is scraped (0 is disabled)
     real_debrid: RealDebridModel = RealDebridModel()
     all_debrid: AllDebridModel = AllDebridModel()
     torbox: TorboxModel = TorboxModel()
@@ -75,6 +77,7 @@ class SymlinkModel(Observable):
     rclone_path: Path = Path()
     library_path: Path = Path()
     separate_anime_dirs: bool = False
+    library_rescan_interval: int = 0
 
 
 # Content Services
@@ -133,6 +136,7 @@ class OverseerrModel(Updatable):
     api_key: str = ""
     use_webhook: bool = False
     update_interval: int = 60
+    full_sync_interval: int = 86400
 
 
 class PlexWatchlistModel(Updatable):
@@ -322,6 +326,7 @@ class RTNSettingsModel(SettingsModel, Observable):
 
 class IndexerModel(Observable):
     update_interval: int = 60 * 60
+    incremental_updates: bool = False
 
 
 def get_version() -> str:
@@ -1,11 +1,11 @@
-import asyncio
 import os
 import re
 import shutil
-import time
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from sqlalchemy import select
 
@@ -13,8 +13,12 @@ from program.media.item import Episode, MediaItem, Movie, Season, Show
 from program.settings.manager import settings_manager
 from program.media.stream import Stream
 from program.db.db import db
+from program.mount import file_waiter, get_mount_index
 from utils.logger import logger
 
+# Stat calls through the rclone mount are slow, check sources a few at a time
+STAT_WORKERS = 8
+
 
 class Symlinker:
     """
@@ -110,34 +114,34 @@ class Symlinker:
 
         if isinstance(item, Show):
             all_episodes_ready = True
+            missing = []
             for season in item.seasons:
                 for episode in season.episodes:
                     if not episode.file or not episode.folder or episode.file == "None.mkv":
                         logger.warning(f"Cannot submit {episode.log_string} for symlink: Invalid file or folder. Needs to be rescraped.")
                         all_episodes_ready = False
                     elif not quick_file_check(episode):
-                        logger.debug(f"File not found for {episode.log_string} at the moment, waiting for it to become available")
-                        if not _wait_for_file(episode):
-                            all_episodes_ready = False
-                            break  # Give up on the whole season if one episode is not found in 90 seconds
+                        missing.append(episode)
             if not all_episodes_ready:
                 logger.warning(f"Cannot submit show {item.log_string} for symlink: One or more episodes need to be rescraped.")
-            return all_episodes_ready
+                return False
+            # Files that are only missing from the mount are waited for, nothing needs rescraping
+            return _wait_for_files(item, missing) if missing else True
 
         if isinstance(item, Season):
             all_episodes_ready = True
+            missing = []
             for episode in item.episodes:
                 if not episode.file or not episode.folder or episode.file == "None.mkv":
                     logger.warning(f"Cannot submit {episode.log_string} for symlink: Invalid file or folder. Needs to be rescraped.")
                     all_episodes_ready = False
                 elif not quick_file_check(episode):
-                    logger.debug(f"File not found for {episode.log_string} at the moment, waiting for it to become available")
-                    if not _wait_for_file(episode):
-                        all_episodes_ready = False
-                        break  # Give up on the whole season if one episode is not found in 90 seconds
+                    missing.append(episode)
             if not all_episodes_ready:
                 logger.warning(f"Cannot submit season {item.log_string} for symlink: One or more episodes need to be rescraped.")
-            return all_episodes_ready
+                return False
+            # Files that are only missing from the mount are waited for, nothing needs rescraping
+            return _wait_for_files(item, missing) if missing else True
 
         if isinstance(item, (Movie, Episode)):
             if not item.file or not item.folder or item.file == "None.mkv":
@@ -148,11 +152,7 @@ class Symlinker:
             if quick_file_check(item):
                 logger.log("SYMLINKER", f"File found for {item.log_string}, submitting to be symlinked")
                 return True
-            else:
-                logger.debug(f"File not found for {item.log_string} at the moment, waiting for it to become available")
-                if _wait_for_file(item):
-                    return True
-                return False
+            return _wait_for_files(item, [item])
 
         item.set("symlinked_times", item.symlinked_times + 1)
 
@@ -173,16 +173,12 @@ class Symlinker:
             logger.error(f"Invalid show sent to Symlinker: {show}")
             return
 
-        all_symlinked = True
-        for season in show.seasons:
-            for episode in season.episodes:
-                if not episode.symlinked and episode.file and episode.folder:
-                    if self._symlink(episode):
-                        episode.set("symlinked", True)
-                        episode.set("symlinked_at", datetime.now())
-                    else:
-                        all_symlinked = False
-        if all_symlinked:
+        episodes = [
+            episode for season in show.seasons for episode in season.episodes
+            if not episode.symlinked and episode.file and episode.folder
+        ]
+        results = self.symlink_episodes(episodes)
+        if all(results.values()):
             logger.log("SYMLINKER", f"Symlinked all episodes for show {show.log_string}")
         else:
             logger.error(f"Failed to symlink some episodes for show {show.log_string}")
@@ -192,21 +188,66 @@ class Symlinker:
             logger.error(f"Invalid season sent to Symlinker: {season}")
             return
 
-        all_symlinked = True
-        successfully_symlinked_episodes = []
-        for episode in season.episodes:
-            if not episode.symlinked and episode.file and episode.folder:
-                if self._symlink(episode):
+        episodes = [episode for episode in season.episodes if not episode.symlinked and episode.file and episode.folder]
+        results = self.symlink_episodes(episodes)
+        if all(results.values()):
+            logger.log("SYMLINKER", f"Symlinked all episodes for {season.log_string}")
+        else:
+            for episode, symlinked in results.items():
+                if symlinked:
+                    logger.log("SYMLINKER", f"Symlink created for {episode.log_string}")
+
+    def symlink_episodes(self, episodes: List[Episode]) -> Dict[Episode, bool]:
+        """
+        Symlink many episodes at once, returning whether each episode was symlinked.
+
+        Destinations are worked out for every episode up front, so each library folder
+        is created once and its symlinks are made relative to one open directory. The
+        sources on the rclone mount are checked by a small thread pool.
+        """
+        results: Dict[Episode, bool] = {}
+        planned: Dict[str, list] = {}
+        for episode in episodes:
+            filename = self._determine_file_name(episode)
+            if not filename:
+                logger.error(f"Symlink filename is None for {episode.log_string}, cannot create symlink.")
+                results[episode] = False
+                continue
+            extension = os.path.splitext(episode.file)[1][1:]
+            link_name = f"{filename}.{extension}".replace("/", "-")
+            source = os.path.join(self.rclone_path, episode.folder, episode.file)
+            planned.setdefault(self._destination_folder(episode), []).append((episode, link_name, source))
+
+        sources = [source for links in planned.values() for _, _, source in links]
+        with ThreadPoolExecutor(max_workers=STAT_WORKERS, thread_name_prefix="SymlinkStat") as executor:
+            available = dict(zip(sources, executor.map(os.path.exists, sources)))
+
+        for folder, links in planned.items():
+            for episode, _, source in links:
+                if not available[source]:
+                    logger.error(f"Source file {source} not found for {episode.log_string}, cannot create symlink.")
+                    results[episode] = False
+            links = [link for link in links if available[link[2]]]
+            if not links:
+                continue
+            try:
+                os.makedirs(folder, exist_ok=True)
+                created = _create_symlinks(folder, [(link_name, source) for _, link_name, source in links])
+            except OSError as e:
+                logger.error(f"OS error when creating symlinks in {folder}: {e}")
+                created = [False] * len(links)
+
+            for (episode, link_name, _), symlinked in zip(links, created):
+                results[episode] = symlinked
+                if symlinked:
+                    episode.set("update_folder", folder)
                     episode.set("symlinked", True)
                     episode.set("symlinked_at", datetime.now())
-                    successfully_symlinked_episodes.append(episode)
+                    episode.set("symlinked_times", episode.symlinked_times + 1)
+                    episode.set("symlink_path", os.path.join(folder, link_name))
                 else:
-                    all_symlinked = False
-        if all_symlinked:
-            logger.log("SYMLINKER", f"Symlinked all episodes for {season.log_string}")
-        else:
-            for episode in successfully_symlinked_episodes:
-                logger.log("SYMLINKER", f"Symlink created for {episode.log_string}")
+                    logger.error(f"Failed to create symlink {link_name} for {episode.log_string}")
+        return results
 
     def _symlink_single(self, item: Union[Movie, Episode]):
         if not item.symlinked and item.file and item.folder:
@@ -266,6 +307,13 @@ class Symlinker:
 
     def _create_item_folders(self, item: Union[Movie, Show, Season, Episode], filename: str) -> str:
         """Create necessary folders and determine the destination path for symlinks."""
+        destination_folder = self._destination_folder(item)
+        os.makedirs(destination_folder, exist_ok=True)
+        item.set("update_folder", destination_folder)
+        return os.path.join(destination_folder, filename.replace("/", "-"))
+
+    def _destination_folder(self, item: Union[Movie, Show, Season, Episode]) -> str:
+        """The library folder the item's symlinks go in."""
         is_anime: bool = hasattr(item, "is_anime") and item.is_anime
 
         movie_path: Path = self.library_path_movies
@@ -277,36 +325,16 @@ class Symlinker:
             elif isinstance(item, (Show, Season, Episode)):
                 show_path = self.library_path_anime_shows
 
-        def create_folder_path(base_path, *subfolders):
-            path = os.path.join(base_path, *subfolders)
-            os.makedirs(path, exist_ok=True)
-            return path
-
         if isinstance(item, Movie):
             movie_folder = f"{item.title.replace('/', '-')} ({item.aired_at.year}) {{imdb-{item.imdb_id}}}"
-            destination_folder = create_folder_path(movie_path, movie_folder)
-            item.set("update_folder", destination_folder)
-        elif isinstance(item, Show):
-            folder_name_show = f"{item.title.replace('/', '-')} ({item.aired_at.year}) {{imdb-{item.imdb_id}}}"
-            destination_folder = create_folder_path(show_path, folder_name_show)
-            item.set("update_folder", destination_folder)
-        elif isinstance(item, Season):
-            show = item.parent
-            folder_name_show = f"{show.title.replace('/', '-')} ({show.aired_at.year}) {{imdb-{show.imdb_id}}}"
-            show_path = create_folder_path(show_path, folder_name_show)
-            folder_season_name = f"Season {str(item.number).zfill(2)}"
-            destination_folder = create_folder_path(show_path, folder_season_name)
-            item.set("update_folder", destination_folder)
-        elif isinstance(item, Episode):
-            show = item.parent.parent
-            folder_name_show = f"{show.title.replace('/', '-')} ({show.aired_at.year}) {{imdb-{show.imdb_id}}}"
-            show_path = create_folder_path(show_path, folder_name_show)
-            season = item.parent
-            folder_season_name = f"Season {str(season.number).zfill(2)}"
-            destination_folder = create_folder_path(show_path, folder_season_name)
-            item.set("update_folder", destination_folder)
+            return os.path.join(movie_path, movie_folder)
 
-        return os.path.join(destination_folder, filename.replace("/", "-"))
+        show = item if isinstance(item, Show) else item.parent if isinstance(item, Season) else item.parent.parent
+        folder_name_show = f"{show.title.replace('/', '-')} ({show.aired_at.year}) {{imdb-{show.imdb_id}}}"
+        if isinstance(item, Show):
+            return os.path.join(show_path, folder_name_show)
+        season = item if isinstance(item, Season) else item.parent
+        return os.path.join(show_path, folder_name_show, f"Season {str(season.number).zfill(2)}")
 
     def _determine_file_name(self, item) -> str | None:
         """Determine the filename of the symlink."""
@@ -403,26 +431,60 @@ class Symlinker:
             return False
 
 
-def _wait_for_file(item: Union[Movie, Episode], timeout: int = 90) -> bool:
-    """Wrapper function to run the asynchronous wait_for_file function."""
-    return asyncio.run(wait_for_file(item, timeout))
+def _create_symlinks(folder: str, links: List[tuple]) -> List[bool]:
+    """Create `(name, source)` symlinks in an existing folder, replacing old symlinks of the same name."""
+    dir_fd = None
+    if {os.symlink, os.readlink, os.unlink, os.stat} <= os.supports_dir_fd:
+        dir_fd = os.open(folder, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    kwargs = {"dir_fd": dir_fd} if dir_fd is not None else {}
+    created = []
+    try:
+        for name, source in links:
+            path = name if dir_fd is not None else os.path.join(folder, name)
+            try:
+                try:
+                    if stat.S_ISLNK(os.stat(path, follow_symlinks=False, **kwargs).st_mode):
+                        os.unlink(path, **kwargs)
+                except FileNotFoundError:
+                    pass
+                os.symlink(source, path, **kwargs)
+                created.append(os.readlink(path, **kwargs) == source)
+            except OSError as e:
+                if e.errno == 36:
+                    logger.error(f"Filename too long when creating symlink {name}: {e}")
+                else:
+                    logger.error(f"OS error when creating symlink {name}: {e}")
+                created.append(False)
+    finally:
+        if dir_fd is not None:
+            os.close(dir_fd)
+    return created
+
 
-async def wait_for_file(item: Union[Movie, Episode], timeout: int = 90) -> bool:
-    """Asynchronously wait for the file to become available within the given timeout."""
-    start_time = time.monotonic()
-    while time.monotonic() - start_time < timeout:
-        # keep trying to find the file until timeout duration is hit
-        if quick_file_check(item):
-            logger.log("SYMLINKER", f"File found for {item.log_string}")
+def _wait_for_files(item: MediaItem, missing: List[Union[Movie, Episode]]) -> bool:
+    """
+    Check whether the files of an item have shown up, without blocking.
+
+    The missing files are handed to the file waiter, which resubmits the item once
+    they are all found or its timeout ran out. Returns True when the item was
+    resubmitted with its files found, False while waiting or after a timeout.
+    """
+    result = file_waiter.pop_result(item._id)
+    if result:
+        for episode in missing:
+            if result.get(episode.file):
+                episode.set("folder", result[episode.file])
+        if all(quick_file_check(episode) for episode in missing):
+            logger.log("SYMLINKER", f"Files found for {item.log_string}")
             return True
-        await asyncio.sleep(5)
-        # If 30 seconds have passed, try searching for the file
-        if time.monotonic() - start_time >= 30:
-            rclone_path = Path(settings_manager.settings.symlink.rclone_path)
-            if search_file(rclone_path, item):
-                logger.log("SYMLINKER", f"File found for {item.log_string} after searching")
-                return True
-    logger.log("SYMLINKER", f"File not found for {item.log_string} after waiting for {timeout} seconds, skipping")
+    elif result is False:
+        logger.log("SYMLINKER", f"Files not found for {item.log_string} after waiting for {file_waiter.timeout} seconds, skipping")
+        return False
+
+    rclone_path = Path(settings_manager.settings.symlink.rclone_path)
+    expected = [(episode.file, (episode.folder, episode.file, episode.alternative_folder)) for episode in missing]
+    if file_waiter.expect(item._id, rclone_path, expected):
+        logger.debug(f"Waiting for {len(missing)} files of {item.log_string} to become available")
     return False
 
 def quick_file_check(item: Union[Movie, Episode]) -> bool:
@@ -436,14 +498,21 @@ def quick_file_check(item: Union[Movie, Episode]) -> bool:
         return False
 
     rclone_path = Path(settings_manager.settings.symlink.rclone_path)
-    possible_folders = [item.folder, item.file, item.alternative_folder]
+    index = get_mount_index(rclone_path)
+    possible_folders = [folder for folder in (item.folder, item.file, item.alternative_folder) if folder]
 
     for folder in possible_folders:
-        if folder:
-            file_path = rclone_path / folder / item.file
-            if file_path.exists():
-                item.set("folder", folder)
-                return True
+        if index.contains(folder, item.file):
+            item.set("folder", folder)
+            return True
+
+    # Files that showed up since the index was last refreshed
+    for folder in possible_folders:
+        file_path = rclone_path / folder / item.file
+        if file_path.exists():
+            index.add(folder, item.file)
+            item.set("folder", folder)
+            return True
 
     if item.symlinked_times >= 3:
         item.reset()
@@ -462,11 +531,10 @@ def search_file(rclone_path: Path, item: Union[Movie, Episode]) -> bool:
         return False
     logger.debug(f"Searching for file {filename} in {rclone_path}")
     try:
-        for root, _, files in os.walk(rclone_path):
-            if filename in files:
-                relative_root = Path(root).relative_to(rclone_path).as_posix()
-                item.set("folder", relative_root)
-                return True
+        folder = get_mount_index(rclone_path).find(filename)
+        if folder:
+            item.set("folder", folder)
+            return True
         logger.debug(f"File {filename} not found in {rclone_path}")
     except Exception as e:
         logger.error(f"Error occurred while searching for file {filename} in {rclone_path}: {e}")
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import controllers.default as default
+import httpx
+from fastapi import FastAPI
+
+class SlowResult:
+    def scalar_one(self):
+        return 0
+
+    def unique(self):
+        return self
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+class SlowSession:
+    """Session stand-in where every query blocks until the test releases the database."""
+
+    started = threading.Event()
+    released = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, *args, **kwargs):
+        self.started.set()
+        assert self.released.wait(5), "the database was never released"
+        return SlowResult()
+
+
+async def _requests(app: FastAPI):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        stats = asyncio.create_task(client.get("/stats"))
+        await asyncio.to_thread(SlowSession.started.wait, 5)
+        fast = await asyncio.gather(*(client.get("/") for _ in range(10)))
+        stats_was_pending = not stats.done()
+        SlowSession.released.set()
+        return await stats, fast, stats_was_pending
+
+
+def test_slow_stats_does_not_stall_other_requests(monkeypatch):
+    monkeypatch.setattr(default, "db", SimpleNamespace(Session=SlowSession))
+    monkeypatch.setattr(default, "settings_manager", SimpleNamespace(settings=SimpleNamespace(version="test")))
+    app = FastAPI()
+    app.include_router(default.router)
+
+    stats_response, fast, stats_was_pending = asyncio.run(_requests(app))
+
+    # The root endpoint answers while /stats is still held up in the database
+    assert stats_was_pending
+    assert all(response.status_code == 200 for response in fast)
+    assert stats_response.status_code == 200
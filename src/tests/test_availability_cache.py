@@ -0,0 +1,185 @@
+import time
+from types import SimpleNamespace
+
+import program.downloaders.availability as availability
+import program.downloaders.realdebrid as realdebrid
+import pytest
+from program.downloaders.availability import AvailabilityCache, AvailabilityPrefetcher
+from program.downloaders.realdebrid import RealDebridDownloader
+from program.media.item import Movie
+from program.media.stream import Stream
+
+CACHED_HASH = "a" * 40
+UNCACHED_HASH = "b" * 40
+
+
+def _stream(infohash):
+    return Stream(SimpleNamespace(
+        raw_title="Inception.2010.1080p", infohash=infohash,
+        data=SimpleNamespace(parsed_title="Inception"), rank=100, lev_ratio=1.0,
+    ))
+
+
+def _movie():
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams = [_stream(UNCACHED_HASH), _stream(CACHED_HASH)]
+    return movie
+
+
+@pytest.fixture
+def downloader(monkeypatch):
+    cache = AvailabilityCache()
+    monkeypatch.setattr(availability, "availability_cache", cache)
+    calls = []
+
+    def fake_get(url, **kwargs):
+        calls.append(url)
+        return SimpleNamespace(is_ok=True, data={
+            CACHED_HASH: {"rd": [{"1": {"filename": "Inception.2010.1080p.mkv", "filesize": 2_000_000_000}}]},
+            UNCACHED_HASH: [],
+        })
+
+    monkeypatch.setattr(realdebrid, "get", fake_get)
+    downloader = RealDebridDownloader()
+    downloader.download_settings = SimpleNamespace(movie_filesize_min=200, movie_filesize_max=-1)
+    return downloader, cache, calls
+
+
+def test_availability_cache_get_many():
+    cache = AvailabilityCache()
+    cache.set("rd", CACHED_HASH.upper(), {"rd": [{}]})
+    cache.set("rd", UNCACHED_HASH, [])
+
+    known, unknown = cache.get_many("rd", [CACHED_HASH, UNCACHED_HASH, "c" * 40])
+    assert known == {CACHED_HASH: {"rd": [{}]}, UNCACHED_HASH: None}
+    assert unknown == ["c" * 40]
+
+    # Results are per provider
+    assert cache.get_many("alldebrid", [CACHED_HASH]) == ({}, [CACHED_HASH])
+    assert cache.stats()["hits"] == 2
+
+
+def test_availability_cache_negative_ttl():
+    cache = AvailabilityCache(negative_ttl=0.01)
+    cache.set("rd", CACHED_HASH, {"rd": [{}]})
+    cache.set("rd", UNCACHED_HASH, None)
+    time.sleep(0.02)
+    assert cache.get_many("rd", [CACHED_HASH, UNCACHED_HASH]) == ({CACHED_HASH: {"rd": [{}]}}, [UNCACHED_HASH])
+
+
+def test_availability_cache_is_bounded():
+    cache = AvailabilityCache(maxsize=2)
+    for i in range(5):
+        cache.set("rd", str(i) * 40, {"rd": [{}]})
+    assert len(cache) == 2
+
+
+def test_realdebrid_reuses_availability(downloader):
+    downloader, cache, calls = downloader
+
+    first = _movie()
+    assert downloader.is_cached(first) is True
+    assert first.active_stream["hash"] == CACHED_HASH
+    assert len(calls) == 1
+
+    second = _movie()
+    assert downloader.is_cached(second) is True
+    assert second.file == "Inception.2010.1080p.mkv"
+    assert len(calls) == 1
+    assert [stream.infohash for stream in second.blacklisted_streams] == [UNCACHED_HASH]
+
+
+def _checker(fetch, **kwargs):
+    from program.downloaders.availability import AvailabilityChecker
+    return AvailabilityChecker("test", fetch, cache=AvailabilityCache(), **kwargs)
+
+
+def test_checker_batch_size_respects_url_length():
+    checker = _checker(lambda batch: {}, max_batch=100, base_url_length=1000, hash_url_length=41, max_url_length=2000)
+    assert checker.batch_size == 24
+    assert [len(batch) for batch in checker.batches([str(i) for i in range(50)])] == [24, 24, 2]
+
+
+def test_checker_evaluates_in_rank_order_and_stops_at_winner():
+    hashes = [f"{i:040d}" for i in range(20)]
+    fetched, evaluated = [], []
+
+    def fetch(batch):
+        fetched.append(batch)
+        # Later batches answer first
+        time.sleep(0.05 if batch[0] == hashes[0] else 0)
+        return {h: {"files": h} if h == hashes[6] else None for h in batch}
+
+    checker = _checker(fetch, max_batch=2, max_in_flight=3)
+    winner = checker.check(hashes, lambda h, containers: evaluated.append(h) or bool(containers))
+
+    assert winner == hashes[6]
+    assert evaluated == hashes[:7]
+    # Remaining batches were never sent
+    assert len(fetched) < 10
+
+
+def test_checker_runs_batches_concurrently():
+    hashes = [f"{i:040d}" for i in range(8)]
+    active, peak = [0], [0]
+
+    def fetch(batch):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        active[0] -= 1
+        return {}
+
+    checker = _checker(fetch, max_batch=2, max_in_flight=4)
+    assert checker.lookup(hashes) == {h: None for h in hashes}
+    assert peak[0] > 1
+
+
+def test_checker_skips_failed_batches():
+    hashes = [f"{i:040d}" for i in range(4)]
+
+    def fetch(batch):
+        if hashes[0] in batch:
+            raise ValueError("boom")
+        return {h: {"files": h} for h in batch}
+
+    checker = _checker(fetch, max_batch=2)
+    assert checker.check(hashes, lambda h, containers: bool(containers)) == hashes[2]
+    # Failed hashes are not cached, they are retried on the next check
+    assert checker.cache.get_many("test", hashes)[1] == hashes[:2]
+
+
+def test_prefetch_answers_the_downloader(downloader):
+    downloader, cache, calls = downloader
+    prefetcher = AvailabilityPrefetcher(top_n=10)
+
+    movie = _movie()
+    assert prefetcher.submit(movie, [downloader.availability_checker]) == 2
+    prefetcher.wait(movie)
+    assert not prefetcher.pending(movie)
+    assert len(calls) == 1
+
+    assert downloader.is_cached(movie) is True
+    assert movie.active_stream["hash"] == CACHED_HASH
+    assert len(calls) == 1
+
+
+def test_prefetch_checks_top_ranked_hashes_only():
+    fetched = []
+
+    def fetch(batch):
+        time.sleep(0.1)
+        fetched.extend(batch)
+        return {}
+
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams = [_stream(f"{i:040d}") for i in range(5)]
+    for rank, stream in enumerate(movie.streams):
+        stream.rank = rank
+    movie.blacklist_stream(movie.streams[-1])
+
+    prefetcher = AvailabilityPrefetcher(top_n=2)
+    prefetcher.submit(movie, [_checker(fetch, max_batch=10)])
+    assert prefetcher.pending(movie)
+    prefetcher.wait(movie)
+    assert fetched == [f"{3:040d}", f"{2:040d}"]
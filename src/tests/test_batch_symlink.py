@@ -0,0 +1,93 @@
+import os
+import shutil
+from datetime import datetime
+from types import SimpleNamespace
+
+import program.symlink as symlink
+import pytest
+from program.media.item import Episode, Season, Show
+from program.symlink import Symlinker
+
+AIRED = datetime(2010, 1, 1)
+_ids = iter(range(1, 1_000_000))
+
+
+@pytest.fixture
+def symlinker(tmp_path, monkeypatch):
+    # tmpfs when available, so the benchmark measures the symlinker and not the disk
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else str(tmp_path)
+    root = tmp_path if base == str(tmp_path) else type(tmp_path)(base) / f"riven-{os.getpid()}-{tmp_path.name}"
+    rclone_path, library_path = root / "mount", root / "library"
+    rclone_path.mkdir(parents=True)
+    library_path.mkdir()
+    settings = SimpleNamespace(rclone_path=rclone_path, library_path=library_path, separate_anime_dirs=False)
+    monkeypatch.setattr(symlink, "settings_manager", SimpleNamespace(settings=SimpleNamespace(symlink=settings)))
+    yield Symlinker()
+    if root != tmp_path:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _show(symlinker, seasons, episodes, title="The Vampire Diaries", missing=()):
+    show = Show({"imdb_id": "tt1405406", "title": title, "aired_at": AIRED})
+    for season_number in range(1, seasons + 1):
+        season = Season({"number": season_number, "aired_at": AIRED})
+        folder = symlinker.rclone_path / f"{title} S{season_number:02d}"
+        folder.mkdir()
+        for number in range(1, episodes + 1):
+            episode = Episode({"number": number, "title": f"Episode {number}", "aired_at": AIRED})
+            # Results are keyed by episode, which compare by their database id
+            episode._id = next(_ids)
+            episode.file = f"{title}.S{season_number:02d}E{number:02d}.mkv"
+            episode.folder = folder.name
+            if (season_number, number) not in missing:
+                (folder / episode.file).write_text("")
+            season.add_episode(episode)
+        show.add_season(season)
+    return show
+
+
+def test_season_symlinks_are_created_in_one_folder(symlinker):
+    show = _show(symlinker, 2, 3, missing={(2, 3)})
+    episodes = [episode for season in show.seasons for episode in season.episodes]
+
+    results = symlinker.symlink_episodes(episodes)
+    assert [results[episode] for episode in episodes] == [True] * 5 + [False]
+
+    episode = show.seasons[0].episodes[1]
+    expected = symlinker.library_path_shows / "The Vampire Diaries (2010) {imdb-tt1405406}" / "Season 01"
+    assert episode.update_folder == str(expected)
+    assert episode.symlink_path == str(expected / "The Vampire Diaries (2010) - s01e02 - Episode 2.mkv")
+    assert os.readlink(episode.symlink_path) == os.path.join(symlinker.rclone_path, episode.folder, episode.file)
+    assert episode.symlinked and episode.symlinked_times == 1
+    assert not show.seasons[1].episodes[2].symlinked
+
+
+def test_existing_symlinks_are_replaced(symlinker):
+    season = _show(symlinker, 1, 2).seasons[0]
+    symlinker.symlink_episodes(season.episodes)
+    episode = season.episodes[0]
+    os.remove(os.readlink(episode.symlink_path))
+    moved = symlinker.rclone_path / "Moved"
+    moved.mkdir()
+    (moved / episode.file).write_text("")
+    episode.folder = "Moved"
+
+    assert symlinker.symlink_episodes([episode]) == {episode: True}
+    assert os.readlink(episode.symlink_path) == str(moved / episode.file)
+
+
+def test_symlinker_run_links_whole_show(symlinker):
+    show = _show(symlinker, 2, 2)
+    list(symlinker.run(show))
+    assert all(episode.symlinked for season in show.seasons for episode in season.episodes)
+
+
+def test_thousand_episode_library(symlinker):
+    shows = [_show(symlinker, 4, 25, title=f"Show {n}") for n in range(10)]
+    episodes = [episode for show in shows for season in show.seasons for episode in season.episodes]
+    assert len(episodes) == 1000
+
+    results = symlinker.symlink_episodes(episodes)
+
+    assert sum(results.values()) == 1000
+    assert len(os.listdir(symlinker.library_path_shows)) == 10
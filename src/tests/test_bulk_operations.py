@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import program.db.db_functions as DB
+import program.db.search as search
+import pytest
+from program.db.db import db
+from program.media.item import Episode, MediaItem, Movie, Season, Show
+from program.media.stream import Stream, StreamBlacklistRelation, StreamRelation
+from program.media.subtitle import Subtitle
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from utils.jobs import JobRegistry
+
+
+@pytest.fixture
+def session_factory(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(DB, "db", SimpleNamespace(Session=Session, engine=engine))
+    return Session
+
+
+def _stream(infohash):
+    return Stream(SimpleNamespace(
+        raw_title=f"Title {infohash}", infohash=infohash,
+        data=SimpleNamespace(parsed_title="Title"), rank=100, lev_ratio=1.0,
+    ))
+
+
+def _add_show(Session, tmp_path):
+    show = Show({"imdb_id": "tt1405406", "title": "The Vampire Diaries"})
+    for season_number in (1, 2):
+        season = Season({"number": season_number})
+        for episode_number in (1, 2, 3):
+            season.add_episode(Episode({"number": episode_number}))
+        show.add_season(season)
+
+    episode = show.seasons[0].episodes[0]
+    symlink = tmp_path / "episode.mkv"
+    symlink.symlink_to(tmp_path / "missing.mkv")
+    active, other = _stream("aaaa"), _stream("bbbb")
+    episode.streams = [active, other]
+    episode.active_stream = {"hash": "aaaa", "name": "episode.mkv"}
+    episode.symlink_path = str(symlink)
+    episode.symlinked = True
+    episode.scraped_times = 3
+    episode.subtitles = [Subtitle({"en": str(tmp_path / "episode.en.srt")})]
+
+    with Session() as session:
+        session.add(show)
+        session.add(Movie({"imdb_id": "tt1375666", "title": "Inception"}))
+        session.commit()
+        return show._id, episode._id, symlink
+
+
+def test_reset_show_resets_children(session_factory, tmp_path):
+    show_id, episode_id, symlink = _add_show(session_factory, tmp_path)
+    progress = []
+
+    assert DB._reset_items_in_db([show_id], progress.append) == 9
+    assert progress == [1]
+    assert not symlink.is_symlink()
+
+    with session_factory() as session:
+        episode = session.get(Episode, episode_id)
+        assert episode.symlinked is False
+        assert episode.symlink_path is None
+        assert episode.scraped_times == 0
+        assert episode.active_stream == {}
+        assert [s.infohash for s in episode.streams] == ["bbbb"]
+        assert [s.infohash for s in episode.blacklisted_streams] == ["aaaa"]
+        assert episode.subtitles[0].file is None
+
+
+def test_remove_show_removes_tree(session_factory, tmp_path):
+    show_id, _, _ = _add_show(session_factory, tmp_path)
+
+    assert DB._remove_items_from_db([show_id]) == 9
+
+    with session_factory() as session:
+        assert session.execute(select(func.count()).select_from(MediaItem.__table__)).scalar_one() == 1
+        for model in (Season, Episode, Stream, StreamRelation, StreamBlacklistRelation, Subtitle):
+            assert session.execute(select(func.count()).select_from(model.__table__)).scalar_one() == 0
+
+
+def test_remove_single_item(session_factory, tmp_path):
+    show_id, _, _ = _add_show(session_factory, tmp_path)
+    assert DB._remove_item_from_db(show_id) is True
+    assert DB._remove_item_from_db(show_id) is False
+
+
+def test_bulk_paths_keep_search_index_current(session_factory, tmp_path, monkeypatch):
+    index = search.NGramIndex()
+    index.built = True
+    monkeypatch.setattr(search, "search_index", index)
+    show_id, _, _ = _add_show(session_factory, tmp_path)
+    assert [item_id for item_id, _ in index.search("vampire diaries")] == [show_id]
+
+    DB._reset_items_in_db([show_id])
+    assert [item_id for item_id, _ in index.search("vampire diaries")] == [show_id]
+
+    DB._remove_items_from_db([show_id])
+    assert index.search("vampire diaries") == []
+    assert len(index) == 1
+
+
+def test_job_registry_progress():
+    registry = JobRegistry(max_finished=1)
+    job = registry.create("reset", total=4)
+
+    def work(progress):
+        progress(2)
+        assert job.to_dict()["progress"] == 0.5
+        progress(2)
+        return {"reset": 4}
+
+    registry.run(job, work)
+    assert job.status == "completed"
+    assert job.result == {"reset": 4}
+
+    failing = registry.create("remove", total=1)
+    registry.run(failing, lambda progress: 1 / 0)
+    assert failing.status == "failed"
+
+    registry.create("retry", total=1)
+    assert registry.get(job.id) is None
+    assert registry.get(failing.id) is failing
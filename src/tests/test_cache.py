@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cache import Cache
+
+
+def test_fresh_entries_are_served_from_cache():
+    cache = Cache("test", ttl=60)
+    calls = []
+    loader = lambda: calls.append(1) or "value"  # noqa: E731
+
+    assert cache.get_or_load("key", loader) == "value"
+    assert cache.get_or_load("key", loader) == "value"
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_none_is_not_cached_by_default():
+    cache = Cache("test", ttl=60)
+    calls = []
+    loader = lambda: calls.append(1)  # noqa: E731
+
+    cache.get_or_load("key", loader)
+    cache.get_or_load("key", loader)
+    assert len(calls) == 2
+
+
+def test_concurrent_misses_are_coalesced():
+    cache = Cache("test", ttl=60)
+    calls = []
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        release.wait(1)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(cache.get_or_load, "key", loader) for _ in range(8)]
+        time.sleep(0.05)
+        release.set()
+        assert [f.result() for f in futures] == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_stale_entries_are_served_while_revalidating():
+    cache = Cache("test", ttl=0.01, stale_ttl=60)
+    cache.set("key", "old")
+    time.sleep(0.02)
+    refreshed = threading.Event()
+
+    def loader():
+        refreshed.set()
+        return "new"
+
+    assert cache.get_or_load("key", loader, ttl=60) == "old"
+    assert refreshed.wait(1)
+    time.sleep(0.01)
+    assert cache.get_or_load("key", loader, ttl=60) == "new"
+    assert cache.stats()["stale_hits"] == 1
+
+
+def test_expired_entries_are_reloaded():
+    cache = Cache("test", ttl=0.01, stale_ttl=0)
+    cache.set("key", "old")
+    time.sleep(0.02)
+    assert cache.get_or_load("key", lambda: "new") == "new"
+
+
+def test_memory_tier_is_bounded():
+    cache = Cache("test", maxsize=2, ttl=60)
+    for key in range(5):
+        cache.set(key, key)
+    assert len(cache) == 2
+    assert cache.get(0) is None
+    assert cache.get(4).value == 4
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = tmp_path / "cache.db"
+    cache = Cache("test", maxsize=1, ttl=60, disk_path=path)
+    cache.set("a", {"title": "Inception"})
+    cache.set("b", {"title": "Interstellar"})
+
+    # "a" was evicted from memory but is still on disk
+    assert cache.get("a").value == {"title": "Inception"}
+
+    restarted = Cache("test", ttl=60, disk_path=path)
+    assert restarted.get_or_load("b", lambda: None) == {"title": "Interstellar"}
@@ -0,0 +1,130 @@
+import threading
+import time
+
+from program.downloaders.tracker import DownloadStateTracker
+
+
+class FakeAccount:
+    """Torrents whose status advances one step each time the account is listed."""
+
+    def __init__(self, *steps):
+        self.steps = steps
+        self.torrents = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def add(self, torrent_id, steps=None):
+        with self.lock:
+            self.torrents[torrent_id] = list(steps or self.steps)
+
+    def fetch_states(self, torrent_ids):
+        with self.lock:
+            self.requests.append(sorted(torrent_ids))
+            states = {}
+            for torrent_id in torrent_ids:
+                steps = self.torrents.get(torrent_id)
+                if steps:
+                    states[torrent_id] = steps.pop(0) if len(steps) > 1 else steps[0]
+            return states
+
+
+def _tracker(account, **kwargs):
+    kwargs = {"min_interval": 0.01, "max_interval": 0.05, **kwargs}
+    return DownloadStateTracker("test", account.fetch_states, failed_states={"dead"}, **kwargs)
+
+
+def _wait(tracker, torrent_id, states, timeout):
+    done = threading.Event()
+    tracker.on_done = lambda key: done.set()
+    assert tracker.expect("item", torrent_id, states, timeout=timeout)
+    assert done.wait(timeout + tracker.max_interval + 1)
+    return tracker.pop_result("item")[1]
+
+
+def test_expect_returns_once_state_is_reached():
+    account = FakeAccount("magnet_conversion", "magnet_conversion", "waiting_files_selection")
+    account.add("1")
+    tracker = _tracker(account)
+
+    assert _wait(tracker, "1", {"waiting_files_selection"}, timeout=2) == "waiting_files_selection"
+    assert len(account.requests) == 3
+    assert len(tracker) == 0
+
+
+def test_failed_states_wake_waiters():
+    account = FakeAccount("magnet_conversion", "dead")
+    account.add("1")
+    assert _wait(_tracker(account), "1", {"waiting_files_selection"}, timeout=2) == "dead"
+
+
+def test_expect_times_out():
+    account = FakeAccount("queued")
+    account.add("1")
+    tracker = _tracker(account)
+    started = time.monotonic()
+    assert _wait(tracker, "1", {"downloaded"}, timeout=0.1) is None
+    assert time.monotonic() - started < 1
+
+
+def test_torrents_are_polled_in_one_batch():
+    account = FakeAccount("magnet_conversion", "magnet_conversion", "waiting_files_selection")
+    tracker = _tracker(account, min_interval=0.05)
+    results = {}
+    reached = threading.Event()
+
+    def done(torrent_id, state):
+        results[torrent_id] = state
+        if len(results) == 3:
+            reached.set()
+
+    for torrent_id in ("1", "2", "3"):
+        account.add(torrent_id)
+        tracker.watch(torrent_id, {"waiting_files_selection"}, done, timeout=2)
+
+    assert reached.wait(2)
+    assert results == {"1": "waiting_files_selection", "2": "waiting_files_selection", "3": "waiting_files_selection"}
+    assert len(account.requests) <= 4
+    assert ["1", "2", "3"] in account.requests
+
+
+def test_polling_backs_off_while_nothing_changes():
+    account = FakeAccount("downloading")
+    account.add("1")
+    tracker = _tracker(account, min_interval=0.01, max_interval=0.16, jitter=0)
+
+    assert _wait(tracker, "1", {"downloaded"}, timeout=0.5) is None
+    # Intervals double up to the maximum: far fewer polls than at the minimum interval
+    assert 3 < len(account.requests) < 15
+
+
+def test_poller_stops_when_idle_and_restarts():
+    account = FakeAccount("downloaded")
+    account.add("1")
+    account.add("2")
+    tracker = _tracker(account)
+
+    assert _wait(tracker, "1", {"downloaded"}, timeout=1) == "downloaded"
+    time.sleep(0.1)
+    assert tracker._thread is None
+    assert _wait(tracker, 2, {"downloaded"}, timeout=1) == "downloaded"
+
+
+def test_expect_does_not_block_and_keeps_the_result():
+    account = FakeAccount("magnet_conversion", "magnet_conversion", "magnet_conversion", "waiting_files_selection")
+    account.add("1")
+    tracker = _tracker(account)
+    resubmitted = []
+    done = threading.Event()
+    tracker.on_done = lambda key: (resubmitted.append(key), done.set())
+
+    assert tracker.expect(42, "1", {"waiting_files_selection"}, timeout=2) is True
+    assert tracker.expect(42, "1", {"waiting_files_selection"}, timeout=2) is False
+    assert tracker.is_waiting(42)
+    assert tracker.pop_result(42) is None
+
+    assert done.wait(2)
+    assert resubmitted == [42]
+    assert not tracker.is_waiting(42)
+    assert tracker.has_result(42)
+    assert tracker.pop_result(42) == ("1", "waiting_files_selection")
+    assert tracker.pop_result(42) is None
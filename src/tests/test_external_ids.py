@@ -0,0 +1,112 @@
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import program.indexers.ids as ids
+import program.indexers.trakt as trakt
+import pytest
+from program.db.db import db
+from program.indexers.ids import ExternalIdResolver
+from program.media.external_id import ExternalId
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture(autouse=True)
+def Session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(ids, "db", SimpleNamespace(Session=Session, engine=engine))
+    return Session
+
+
+class Fetcher:
+    def __init__(self, answers, delay=0):
+        self.answers = answers
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, source, external_id, type):
+        with self._lock:
+            self.calls.append((source, external_id, type))
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        answer = self.answers.get((external_id, type), self.answers.get(external_id))
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def test_resolved_ids_are_stored_for_later_lookups(Session):
+    fetch = Fetcher({("1399", "show"): {"imdb": "tt0944947", "tmdb": 1399, "tvdb": 121361}})
+    resolver = ExternalIdResolver(fetch)
+    assert resolver.resolve("tmdb", 1399, "show") == "tt0944947"
+    assert resolver.resolve("tmdb", "1399", "show") == "tt0944947"
+    assert len(fetch.calls) == 1 and resolver.hits == 1
+
+    # A new process starts with an empty memory but the table still knows, the tvdb id too
+    restarted = ExternalIdResolver(fetch)
+    assert restarted.resolve("tmdb", "1399", "show") == "tt0944947"
+    assert restarted.resolve("tvdb", "121361", "show") == "tt0944947"
+    assert len(fetch.calls) == 1 and restarted.stored_hits == 2
+
+    # tmdb ids of movies and shows overlap, they are resolved apart
+    assert restarted.resolve("tmdb", "1399", "movie") is None
+    assert len(fetch.calls) == 2
+
+
+def test_misses_are_remembered_until_they_expire(Session):
+    fetch = Fetcher({})
+    resolver = ExternalIdResolver(fetch)
+    assert resolver.resolve("tvdb", "404", "show") is None
+    assert resolver.resolve("tvdb", "404", "show") is None
+    assert len(fetch.calls) == 1
+    with Session() as session:
+        assert session.execute(select(ExternalId.imdb_id).where(ExternalId.external_id == "404")).scalar_one() is None
+
+    expired = ExternalIdResolver(fetch, negative_ttl=timedelta(0))
+    assert expired.resolve("tvdb", "404", "show") is None
+    assert len(fetch.calls) == 2
+
+
+def test_errors_are_not_remembered(Session):
+    fetch = Fetcher({"1": RuntimeError("Trakt is down")})
+    resolver = ExternalIdResolver(fetch)
+    assert resolver.resolve("tmdb", "1", "movie") is None
+    fetch.answers["1"] = {"imdb": "tt0000001"}
+    assert resolver.resolve("tmdb", "1", "movie") == "tt0000001"
+    assert len(fetch.calls) == 2
+
+
+def test_batches_are_fetched_with_bounded_concurrency(Session):
+    fetch = Fetcher({str(n): {"imdb": f"tt{n:07d}"} for n in range(20)}, delay=0.02)
+    resolver = ExternalIdResolver(fetch, max_workers=3)
+    resolver.resolve("tmdb", "5", "movie")
+
+    resolved = resolver.resolve_many("tmdb", [str(n) for n in range(20)] + ["5", None], "movie")
+    assert resolved == {str(n): f"tt{n:07d}" for n in range(20)}
+    assert len(fetch.calls) == 20
+    assert fetch.most_running == 3
+
+
+def test_trakt_lookups_go_through_the_resolver(monkeypatch):
+    response = SimpleNamespace(is_ok=True, data=[
+        SimpleNamespace(type="show", show=SimpleNamespace(ids=SimpleNamespace(imdb="tt0000002", tmdb=2, tvdb=20))),
+        SimpleNamespace(type="movie", movie=SimpleNamespace(ids=SimpleNamespace(imdb="tt0000001", tmdb=1, tvdb=None))),
+    ])
+    urls = []
+    monkeypatch.setattr(trakt, "get", lambda url, **kwargs: urls.append(url) or response)
+    monkeypatch.setattr(trakt, "id_resolver", ExternalIdResolver(trakt.search_ids))
+
+    assert trakt.get_imdbid_from_tmdb("1") == "tt0000001"
+    assert trakt.get_imdbid_from_tmdb("1") == "tt0000001"
+    assert trakt.get_imdbid_from_tvdb("20", type="show") == "tt0000002"
+    assert urls == ["https://api.trakt.tv/search/tmdb/1", "https://api.trakt.tv/search/tvdb/20"]
@@ -0,0 +1,141 @@
+from datetime import datetime
+
+import program.downloaders.shared as shared
+import pytest
+from program.downloaders.registry import assign_pack_files
+from program.downloaders.shared import FileFinder, needed_episodes, parse_filename
+from program.media.item import Episode, Movie, Season, Show
+
+AIRED = datetime(2010, 1, 1)
+
+
+def _show(seasons, episodes):
+    show = Show({"imdb_id": "tt1405406", "title": "The Vampire Diaries", "aired_at": AIRED})
+    for season_number in range(1, seasons + 1):
+        season = Season({"number": season_number, "aired_at": AIRED})
+        for episode_number in range(1, episodes + 1):
+            season.add_episode(Episode({"number": episode_number, "aired_at": AIRED}))
+        show.add_season(season)
+    return show
+
+
+def _pack(seasons, episodes, extras=0):
+    """Synthetic Real-Debrid style container with a file per episode plus samples and junk."""
+    container = {}
+    for season in range(1, seasons + 1):
+        for episode in range(1, episodes + 1):
+            container[str(len(container))] = {
+                "filename": f"The.Vampire.Diaries.S{season:02d}E{episode:02d}.1080p.WEB.x264.mkv",
+                "filesize": 900_000_000,
+            }
+    for extra in range(extras):
+        container[str(len(container))] = {"filename": f"Featurette.{extra}.nfo", "filesize": 1000}
+    container[str(len(container))] = {"filename": "The.Vampire.Diaries.S01E01.sample.mkv", "filesize": 50_000_000}
+    return container
+
+
+@pytest.fixture
+def count_parses(monkeypatch):
+    calls = []
+    parse = shared.parse
+
+    def counting_parse(filename, **kwargs):
+        calls.append(filename)
+        return parse(filename, **kwargs)
+
+    parse_filename.cache_clear()
+    monkeypatch.setattr(shared, "parse", counting_parse)
+    yield calls
+    parse_filename.cache_clear()
+
+
+def test_finds_largest_movie_file():
+    finder = FileFinder("filename", "filesize")
+    container = {
+        "1": {"filename": "Inception.2010.sample.mkv", "filesize": 3_000_000_000},
+        "2": {"filename": "Inception.2010.720p.mkv", "filesize": 1_000_000_000},
+        "3": {"filename": "Inception.2010.1080p.mkv", "filesize": 2_000_000_000},
+        "4": {"filename": "Inception.2010.1080p.srt", "filesize": 4_000_000_000},
+    }
+    assert finder.find_movie(container)["filename"] == "Inception.2010.1080p.mkv"
+    assert finder.find_required_files(Movie({"imdb_id": "tt1375666"}), container) == [container["3"]]
+
+
+def test_matches_needed_episodes_only():
+    show = _show(2, 3)
+    show.seasons[1].episodes[2].file = "already.mkv"
+    show.seasons[1].episodes[2].folder = "downloaded"
+
+    finder = FileFinder("filename", "filesize", min=100_000_000)
+    needed = needed_episodes(show)
+    matches = finder.match_episodes(_pack(2, 3), show, needed)
+    assert set(matches) == set(needed) == {(1, 1), (1, 2), (1, 3), (2, 1), (2, 2)}
+    # Samples are never matched
+    assert [file["filename"] for file in matches[(1, 1)]] == ["The.Vampire.Diaries.S01E01.1080p.WEB.x264.mkv"]
+
+    finder.assign_files(matches, needed, "pack", "pack")
+    assert show.seasons[0].episodes[1].file == "The.Vampire.Diaries.S01E02.1080p.WEB.x264.mkv"
+    assert show.seasons[1].episodes[2].file == "already.mkv"
+
+
+def test_single_season_shows_match_files_without_season():
+    show = _show(1, 2)
+    container = [{"name": "The Vampire Diaries E02 1080p.mkv", "size": 500_000_000}]
+    matches = FileFinder("name", "size").match_episodes(container, show.seasons[0].episodes[1])
+    assert list(matches) == [(1, 2)]
+
+
+def test_required_files_need_every_episode():
+    season = _show(1, 3).seasons[0]
+    finder = FileFinder("name", "size", min=10000)
+    container = [{"name": f"Show.S01E0{n}.mkv", "size": 500_000_000} for n in (1, 2)]
+    assert finder.find_required_files(season, container) == []
+    container.append({"name": "Show.S01E03.mkv", "size": 500_000_000})
+    assert len(finder.find_required_files(season, container)) == 3
+
+
+def test_each_file_is_parsed_once(count_parses):
+    show = _show(2, 10)
+    finder = FileFinder("filename", "filesize")
+    container = _pack(2, 10)
+
+    finder.match_episodes(container, show)
+    for season in show.seasons:
+        finder.match_episodes(container, season)
+        for episode in season.episodes:
+            finder.match_episodes(container, episode)
+
+    assert len(count_parses) == len(set(count_parses)) == 20
+
+
+def test_pack_assignment_reuses_parsed_files(count_parses):
+    season = _show(1, 10).seasons[0]
+    filenames = [file["filename"] for file in _pack(1, 10).values() if ".sample." not in file["filename"]]
+    for filename in filenames:
+        parse_filename(filename)
+
+    hits = parse_filename.cache_info().hits
+
+    episode = season.episodes[0]
+    episode.active_stream = {"hash": "a" * 40}
+    episode.folder = episode.alternative_folder = "The.Vampire.Diaries.S01"
+    assert len(assign_pack_files(episode, filenames)) == 9
+    assert len(count_parses) == 10
+    assert parse_filename.cache_info().hits - hits == 10
+
+
+def test_large_pack_against_large_show(count_parses):
+    """1,000 files against a 300-episode show, matched against every container ordering a provider returns."""
+    show = _show(10, 30)
+    pack = _pack(10, 30, extras=699)
+    containers = [pack, dict(reversed(list(pack.items())))]
+    finder = FileFinder("filename", "filesize", min=100_000_000)
+
+    for container in containers:
+        matches = finder.match_episodes(container, show)
+    for _ in range(20):
+        finder.match_episodes(pack, show)
+
+    assert len(matches) == 300
+    # Every wanted file was parsed once, repeated matching is answered from the cache
+    assert len(count_parses) == len(set(count_parses)) == 300
@@ -0,0 +1,81 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import program.libraries.symlink as symlink_library
+import pytest
+from program.libraries.symlink import process_items, process_shows
+from program.media.item import Movie
+
+MOUNT = "/mnt/zurg/__all__"
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(symlink_library, "settings_manager", SimpleNamespace(settings=SimpleNamespace(force_refresh=False)))
+
+
+def _link(path, target):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.symlink(target, path)
+
+
+def _shows(root, shows, seasons, episodes):
+    for show in range(shows):
+        show_folder = root / f"Show {show} (2010) {{imdb-tt{show:07d}}}"
+        for season in range(1, seasons + 1):
+            for episode in range(1, episodes + 1):
+                name = f"Show {show} (2010) - s{season:02d}e{episode:02d} - Episode.mkv"
+                # Targets live on a mount that is not there, nothing may follow them
+                _link(show_folder / f"Season {season:02d}" / name, f"{MOUNT}/Show {show} S{season:02d}/Show.S{season:02d}E{episode:02d}.mkv")
+
+
+def test_movies_are_read_from_their_links(tmp_path):
+    movie = tmp_path / "movies" / "Inception (2010) {imdb-tt1375666}" / "Inception (2010) {imdb-tt1375666}.mkv"
+    _link(movie, f"{MOUNT}/Inception 2010 1080p/Inception.2010.1080p.mkv")
+    (movie.parent / "Inception (2010) {imdb-tt1375666}.en.srt").write_text("")
+    (movie.parent / "Inception (2010) {imdb-tt1375666}.nl.srt").write_text("")
+    (movie.parent / "Other.en.srt").write_text("")
+
+    movies = list(process_items(tmp_path / "movies", Movie, "movie"))
+    assert len(movies) == 1
+    assert movies[0].imdb_id == "tt1375666"
+    assert movies[0].file == "Inception.2010.1080p"
+    assert movies[0].folder == "Inception 2010 1080p"
+    assert movies[0].symlink_path == str(movie)
+    assert sorted(subtitle.language for subtitle in movies[0].subtitles) == ["en", "nl"]
+
+
+def test_shows_are_scanned_with_their_episodes(tmp_path):
+    _shows(tmp_path / "shows", 3, 2, 3)
+    os.remove(tmp_path / "shows" / "Show 1 (2010) {imdb-tt0000001}" / "Season 02" / "Show 1 (2010) - s02e02 - Episode.mkv")
+
+    shows = {show.imdb_id: show for show in process_shows(tmp_path / "shows", "show")}
+    assert set(shows) == {"tt0000000", "tt0000001", "tt0000002"}
+    season = shows["tt0000001"].seasons[1]
+    assert [episode.number for episode in season.episodes] == [1, 2, 3]
+    assert season.episodes[1].file is None
+    assert season.episodes[2].file == "Show.S02E03"
+    assert season.episodes[2].folder == "Show 1 S02"
+
+
+def test_shows_stream_out_before_the_scan_is_done(tmp_path, monkeypatch):
+    _shows(tmp_path / "shows", 20, 2, 3)
+    first_received = threading.Event()
+    held_back = []
+    process_show = symlink_library.process_show
+
+    def slow_process_show(directory, show, item_type, is_anime=False):
+        # Every show but the first waits until the caller got a result
+        if not show.startswith("Show 0 "):
+            held_back.append(not first_received.wait(timeout=5))
+        return process_show(directory, show, item_type, is_anime)
+
+    monkeypatch.setattr(symlink_library, "process_show", slow_process_show)
+    episodes = 0
+    for show in process_shows(tmp_path / "shows", "show"):
+        first_received.set()
+        episodes += sum(len(season.episodes) for season in show.seasons)
+
+    assert episodes == 20 * 2 * 3
+    assert len(held_back) == 19 and not any(held_back)
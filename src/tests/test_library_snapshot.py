@@ -0,0 +1,171 @@
+import os
+import shutil
+import time
+from types import SimpleNamespace
+
+import program.libraries.symlink as symlink_library
+import program.program as program_module
+import pytest
+from program.db.db import db
+from program.libraries.snapshot import LibrarySnapshot
+from program.libraries.symlink import SymlinkLibrary
+from program.media.item import Episode, Movie, Season, Show
+from program.program import Program
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+MOUNT = "/mnt/zurg/__all__"
+AN_HOUR_AGO = time.time() - 3600
+
+
+def _link(path, target=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.symlink(target or f"{MOUNT}/{path.stem}/{path.stem}.mkv", path)
+
+
+def _age(root):
+    # Back date every folder, as if the library was last touched well before the snapshot
+    for folder, _, _ in os.walk(root):
+        os.utime(folder, (AN_HOUR_AGO, AN_HOUR_AGO))
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    library = tmp_path / "library"
+    for show in range(3):
+        for season in (1, 2):
+            for episode in (1, 2):
+                _link(library / "shows" / f"Show {show} (2010) {{imdb-tt{show:07d}}}" / f"Season {season:02d}" / f"Show {show} (2010) - s{season:02d}e{episode:02d}.mkv")
+    _link(library / "movies" / "Inception (2010) {imdb-tt1375666}" / "Inception (2010) {imdb-tt1375666}.mkv")
+    _age(library)
+    settings = SimpleNamespace(library_path=library, separate_anime_dirs=False)
+    monkeypatch.setattr(symlink_library, "settings_manager", SimpleNamespace(settings=SimpleNamespace(symlink=settings, force_refresh=False)))
+    monkeypatch.setattr(symlink_library, "SNAPSHOT_FILE", tmp_path / "library_snapshot.json")
+    return library
+
+
+def test_only_changed_folders_are_listed(library, tmp_path):
+    snapshot = LibrarySnapshot(library, tmp_path / "snapshot.json", ["shows", "movies"])
+    assert len(snapshot.update().added) == 12
+    assert snapshot.listed == 12
+    snapshot.save()
+
+    snapshot = LibrarySnapshot(library, tmp_path / "snapshot.json", ["shows", "movies"])
+    assert not snapshot.update()
+    assert snapshot.listed == 0
+
+    season = library / "shows" / "Show 1 (2010) {imdb-tt0000001}" / "Season 02"
+    os.remove(season / "Show 1 (2010) - s02e02.mkv")
+    shutil.rmtree(library / "shows" / "Show 2 (2010) {imdb-tt0000002}")
+    diff = snapshot.update()
+    assert diff.changed == ["shows", os.path.join("shows", "Show 1 (2010) {imdb-tt0000001}", "Season 02")]
+    assert diff.removed == [os.path.join("shows", "Show 2 (2010) {imdb-tt0000002}")]
+    assert snapshot.dirs[os.path.join("shows", "Show 1 (2010) {imdb-tt0000001}", "Season 02")][1] == 1
+    assert snapshot.listed == 2
+
+
+def test_first_rescan_only_records_the_snapshot(library, tmp_path):
+    service = SymlinkLibrary()
+    assert service.rescan() == []
+    assert (tmp_path / "library_snapshot.json").exists()
+    assert service.rescan() == []
+
+
+def test_rescan_reports_changed_show_and_movie_folders(library):
+    service = SymlinkLibrary()
+    service.rescan()
+
+    _link(library / "shows" / "Show 0 (2010) {imdb-tt0000000}" / "Season 01" / "Show 0 (2010) - s01e03.mkv")
+    _link(library / "movies" / "Dune (2021) {imdb-tt1160419}" / "Dune (2021) {imdb-tt1160419}.mkv")
+    shutil.rmtree(library / "movies" / "Inception (2010) {imdb-tt1375666}")
+
+    changes = {change.path.name: change for change in service.rescan()}
+    assert {name: change.kind for name, change in changes.items()} == {
+        "Dune (2021) {imdb-tt1160419}": "added",
+        "Inception (2010) {imdb-tt1375666}": "removed",
+        "Show 0 (2010) {imdb-tt0000000}": "changed",
+    }
+    show = changes["Show 0 (2010) {imdb-tt0000000}"].items[0]
+    assert [episode.number for episode in show.seasons[0].episodes] == [1, 2, 3]
+    assert [movie.imdb_id for movie in changes["Dune (2021) {imdb-tt1160419}"].items] == ["tt1160419"]
+    assert changes["Inception (2010) {imdb-tt1375666}"].items == []
+
+
+def test_program_resets_items_whose_links_were_removed(library, tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(program_module, "db", SimpleNamespace(Session=Session, engine=engine))
+
+    folder = library / "movies" / "Inception (2010) {imdb-tt1375666}"
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.set("file", "Inception")
+    movie.set("folder", "Inception")
+    movie.set("symlinked", True)
+    movie.set("symlink_path", str(folder / "Inception (2010) {imdb-tt1375666}.mkv"))
+    with Session() as session:
+        session.add(movie)
+        session.commit()
+        movie_id = movie._id
+
+    service = SymlinkLibrary()
+    service.rescan()
+    shutil.rmtree(folder)
+    _link(library / "movies" / "Dune (2021) {imdb-tt1160419}" / "Dune (2021) {imdb-tt1160419}.mkv")
+
+    queued, events = [], []
+    program = SimpleNamespace(
+        services={SymlinkLibrary: service},
+        add_to_queue=lambda item, emitted_by: queued.append((item.imdb_id, emitted_by)),
+        _push_events_queue=lambda new_events: events.extend((event.item.imdb_id, event.emitted_by) for event in new_events),
+    )
+    Program._rescan_library(program)
+
+    assert queued == [("tt1375666", "LibraryRescan")]
+    assert events == [("tt1160419", SymlinkLibrary)]
+    with Session() as session:
+        reset = session.get(Movie, movie_id)
+        assert reset.symlink_path is None and not reset.symlinked
+
+
+def test_rescan_records_new_links_on_stored_shows(library, tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(program_module, "db", SimpleNamespace(Session=Session, engine=engine))
+
+    folder = library / "shows" / "Show 0 (2010) {imdb-tt0000000}" / "Season 01"
+    show = Show({"imdb_id": "tt0000000", "title": "Show 0"})
+    season = Season({"number": 1})
+    for number in (1, 2, 3):
+        season.add_episode(Episode({"number": number}))
+    show.add_season(season)
+    first = season.episodes[0]
+    first.set("file", "Show 0 (2010) - s01e01")
+    first.set("folder", "Show 0 (2010) - s01e01")
+    first.set("symlinked", True)
+    first.set("symlink_path", str(folder / "Show 0 (2010) - s01e01.mkv"))
+    with Session() as session:
+        session.add(show)
+        session.commit()
+        show_id = show._id
+
+    service = SymlinkLibrary()
+    service.rescan()
+    _link(folder / "Show 0 (2010) - s01e03.mkv")
+
+    queued, events = [], []
+    program = SimpleNamespace(
+        services={SymlinkLibrary: service},
+        add_to_queue=lambda item, emitted_by: queued.append((item.imdb_id, emitted_by)),
+        _push_events_queue=lambda new_events: events.extend(event.item.imdb_id for event in new_events),
+    )
+    Program._rescan_library(program)
+
+    assert queued == [("tt0000000", "LibraryRescan")]
+    assert events == []
+    with Session() as session:
+        episodes = session.get(Show, show_id).seasons[0].episodes
+        assert [episode.symlinked for episode in episodes] == [True, True, True]
+        assert episodes[2].symlink_path == str(folder / "Show 0 (2010) - s01e03.mkv")
+        assert episodes[2].file == "Show 0 (2010) - s01e03"
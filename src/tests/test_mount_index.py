@@ -0,0 +1,176 @@
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import program.symlink as symlink
+import pytest
+from program.media.item import Episode, Movie, Season, Show
+from program.mount import FileWaiter, MountIndex
+
+
+def _touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("")
+
+
+def _bump(path):
+    # Directory mtimes can be coarse, make sure a change is seen
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def mount(tmp_path):
+    for i in range(20):
+        _touch(tmp_path / "__all__" / f"Torrent {i}" / f"file{i}.mkv")
+    _touch(tmp_path / "__all__" / "Pack" / "Season 1" / "Show.S01E01.mkv")
+    _touch(tmp_path / "root.mkv")
+    return tmp_path
+
+
+def test_files_are_found_by_name(mount):
+    index = MountIndex(mount)
+    assert index.find("file3.mkv") == "__all__/Torrent 3"
+    assert index.find("Show.S01E01.mkv") == "__all__/Pack/Season 1"
+    assert index.find("root.mkv") == "."
+    assert index.contains("__all__/Torrent 7", "file7.mkv")
+    assert not index.contains("__all__/Torrent 7", "file8.mkv")
+
+
+def test_refresh_only_lists_changed_folders(mount):
+    index = MountIndex(mount, min_refresh_interval=0)
+    index.refresh()
+    scans = index.scans
+
+    _touch(mount / "__all__" / "New Torrent" / "new.mkv")
+    _bump(mount / "__all__")
+    index.refresh()
+    # __all__ changed and the new torrent folder is listed, nothing else
+    assert index.scans - scans == 2
+    assert index.find("new.mkv", refresh=False) == "__all__/New Torrent"
+
+    os.remove(mount / "__all__" / "Torrent 1" / "file1.mkv")
+    _bump(mount / "__all__" / "Torrent 1")
+    index.refresh()
+    assert index.find("file1.mkv", refresh=False) is None
+
+
+def test_misses_refresh_at_most_once_per_interval(mount):
+    index = MountIndex(mount, min_refresh_interval=60)
+    assert index.find("missing.mkv") is None
+    scans = index.scans
+    _touch(mount / "late.mkv")
+    _bump(mount)
+    assert index.find("late.mkv") is None
+    assert index.scans == scans
+
+
+def test_symlinker_checks_use_the_index(mount, monkeypatch):
+    settings = SimpleNamespace(settings=SimpleNamespace(symlink=SimpleNamespace(rclone_path=mount)))
+    monkeypatch.setattr(symlink, "settings_manager", settings)
+    monkeypatch.setattr(symlink, "get_mount_index", lambda root, index=MountIndex(mount, min_refresh_interval=0): index)
+
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.file, movie.folder = "file5.mkv", "wrong folder"
+    assert symlink.search_file(mount, movie) is True
+    assert movie.folder == "__all__/Torrent 5"
+    assert symlink.quick_file_check(movie) is True
+
+    # Files newer than the index are still found and recorded
+    _touch(mount / "__all__" / "Later" / "later.mkv")
+    movie.file, movie.folder = "later.mkv", "__all__/Later"
+    assert symlink.quick_file_check(movie) is True
+    assert symlink.get_mount_index(mount).contains("__all__/Later", "later.mkv")
+
+
+def test_lookups_are_dictionary_hits(mount):
+    index = MountIndex(mount)
+    index.refresh()
+    started = time.perf_counter()
+    for _ in range(10_000):
+        index.find("file19.mkv")
+    assert time.perf_counter() - started < 0.5
+    assert index.scans == 24
+
+
+def _waiter(**kwargs):
+    kwargs = {"interval": 0.02, "timeout": 2, "search_after": 0.5, **kwargs}
+    return FileWaiter(**kwargs)
+
+
+def _season(mount):
+    show = Show({"imdb_id": "tt1405406", "title": "The Vampire Diaries", "aired_at": datetime(2010, 1, 1)})
+    season = Season({"number": 1})
+    for number in range(1, 25):
+        episode = Episode({"number": number})
+        episode.file, episode.folder = f"Show.S01E{number:02d}.mkv", "__all__/Show S01"
+        season.add_episode(episode)
+    show.add_season(season)
+    season._id = 42
+    return season
+
+
+def test_waiter_resolves_all_files_together(mount):
+    waiter = _waiter()
+    done = []
+    waiter.on_done = done.append
+    files = [(f"Show.S01E{n:02d}.mkv", ["__all__/Show S01"]) for n in range(1, 25)]
+    assert waiter.expect("season", mount, files) is True
+    assert waiter.expect("season", mount, files) is False
+
+    time.sleep(0.1)
+    assert waiter.pop_result("season") is None
+    for name, _ in files:
+        _touch(mount / "__all__" / "Show S01" / name)
+
+    started = time.monotonic()
+    while not done and time.monotonic() - started < 2:
+        time.sleep(0.01)
+    assert done == ["season"]
+    assert waiter.pop_result("season") == {name: "__all__/Show S01" for name, _ in files}
+    assert len(waiter) == 0
+
+
+def test_waiter_searches_the_mount_and_times_out(mount):
+    waiter = _waiter(timeout=0.3, search_after=0)
+    done = []
+    waiter.on_done = done.append
+    waiter.expect("moved", mount, [("file2.mkv", ["__all__/Elsewhere"])])
+    waiter.expect("missing", mount, [("missing.mkv", ["__all__/Elsewhere"])])
+
+    started = time.monotonic()
+    while len(done) < 2 and time.monotonic() - started < 2:
+        time.sleep(0.01)
+    assert waiter.pop_result("moved") == {"file2.mkv": "__all__/Torrent 2"}
+    assert waiter.pop_result("missing") is False
+
+
+def test_symlinker_does_not_block_on_missing_files(mount, monkeypatch):
+    settings = SimpleNamespace(settings=SimpleNamespace(symlink=SimpleNamespace(rclone_path=mount)))
+    monkeypatch.setattr(symlink, "settings_manager", settings)
+    monkeypatch.setattr(symlink, "get_mount_index", lambda root, index=MountIndex(mount, min_refresh_interval=0): index)
+    waiter = _waiter()
+    monkeypatch.setattr(symlink, "file_waiter", waiter)
+    resubmitted = []
+    waiter.on_done = resubmitted.append
+
+    season = _season(mount)
+    warnings = []
+    sink = symlink.logger.add(warnings.append, level="WARNING")
+    started = time.monotonic()
+    try:
+        assert symlink.Symlinker.should_submit(season) is False
+    finally:
+        symlink.logger.remove(sink)
+    assert time.monotonic() - started < 1
+    assert waiter.is_waiting(42)
+    # Waiting on the mount is not a reason to rescrape
+    assert warnings == []
+
+    for episode in season.episodes:
+        _touch(mount / "__all__" / "Show S01" / episode.file)
+    while not resubmitted and time.monotonic() - started < 3:
+        time.sleep(0.01)
+    assert resubmitted == [42]
+    assert symlink.Symlinker.should_submit(season) is True
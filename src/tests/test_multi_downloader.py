@@ -0,0 +1,113 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from program.downloaders.availability import AvailabilityCache, AvailabilityChecker
+from program.downloaders.multi import MAX_CONSECUTIVE_FAILURES, ProviderRace
+from program.media.item import Movie
+from program.media.stream import Stream
+from utils.ratelimiter import RateLimiter
+
+BEST = "a" * 40
+GOOD = "b" * 40
+WORST = "c" * 40
+
+
+class FakeProvider:
+    def __init__(self, key, cached, accepts=True, barrier=None, fail=False):
+        self.key = key
+        self.cached = cached
+        self.accepts = accepts
+        self.barrier = barrier
+        self.fail = fail
+        self.runs = 0
+        self.overall_rate_limiter = RateLimiter(10, 60)
+        self.availability_checker = AvailabilityChecker(key, self._fetch, max_batch=10, cache=AvailabilityCache())
+
+    def _fetch(self, hashes):
+        if self.barrier:
+            # Only passes once every provider is looking up at the same time
+            self.barrier.wait(timeout=2)
+        if self.fail:
+            raise ValueError("provider down")
+        return {h: {"files": h} if h in self.cached else None for h in hashes}
+
+    def run(self, item):
+        self.runs += 1
+        for stream in list(item.streams):
+            if stream.infohash in self.cached and self.accepts:
+                item.set("active_stream", {"hash": stream.infohash, "id": self.key})
+                return True
+            item.blacklist_stream(stream)
+        return False
+
+
+def _movie():
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams = [
+        Stream(SimpleNamespace(raw_title=h, infohash=h, data=SimpleNamespace(parsed_title="Inception"), rank=rank, lev_ratio=1.0))
+        for h, rank in ((WORST, 10), (GOOD, 50), (BEST, 100))
+    ]
+    return movie
+
+
+def test_provider_with_best_ranked_stream_wins():
+    realdebrid = FakeProvider("realdebrid", {GOOD})
+    torbox = FakeProvider("torbox", {BEST})
+    movie = _movie()
+
+    assert ProviderRace([realdebrid, torbox]).run(movie) is True
+    assert movie.active_stream == {"hash": BEST, "id": "torbox"}
+    assert realdebrid.runs == 0
+
+
+def test_ties_go_to_provider_with_more_rate_budget():
+    realdebrid = FakeProvider("realdebrid", {BEST})
+    alldebrid = FakeProvider("alldebrid", {BEST})
+    realdebrid.overall_rate_limiter.tokens = 1
+    realdebrid.overall_rate_limiter.last_call = time.time()
+
+    movie = _movie()
+    assert ProviderRace([realdebrid, alldebrid]).run(movie) is True
+    assert movie.active_stream["id"] == "alldebrid"
+
+
+def test_next_provider_gets_the_original_streams():
+    realdebrid = FakeProvider("realdebrid", {BEST}, accepts=False)
+    torbox = FakeProvider("torbox", {GOOD})
+    movie = _movie()
+
+    assert ProviderRace([realdebrid, torbox]).run(movie) is True
+    assert movie.active_stream == {"hash": GOOD, "id": "torbox"}
+    # Only the streams torbox walked past are blacklisted
+    assert [stream.infohash for stream in movie.blacklisted_streams] == [WORST]
+
+
+def test_availability_is_queried_concurrently():
+    barrier = threading.Barrier(3)
+    providers = [FakeProvider(key, {BEST}, barrier=barrier) for key in ("realdebrid", "alldebrid", "torbox")]
+    race = ProviderRace(providers)
+
+    assert race.run(_movie()) is True
+    assert all(stats.lookups == 1 and stats.failed_lookups == 0 for stats in race.stats.values())
+
+
+def test_streams_uncached_everywhere_are_blacklisted():
+    movie = _movie()
+    race = ProviderRace([FakeProvider("realdebrid", set()), FakeProvider("torbox", set())])
+    assert race.run(movie) is False
+    assert not movie.is_scraped()
+
+
+def test_failing_provider_is_skipped_after_cooldown_threshold():
+    down = FakeProvider("realdebrid", {BEST}, fail=True)
+    torbox = FakeProvider("torbox", {GOOD})
+    race = ProviderRace([down, torbox])
+
+    for _ in range(MAX_CONSECUTIVE_FAILURES):
+        assert race.run(_movie()) is True
+
+    stats = race.get_stats()
+    assert stats["realdebrid"]["healthy"] is False
+    assert stats["realdebrid"]["failed_lookups"] == MAX_CONSECUTIVE_FAILURES
+    assert stats["torbox"]["latency"] is not None
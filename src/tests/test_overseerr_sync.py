@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import program.content.overseerr as overseerr
+import program.media.cursor as cursor
+import pytest
+from program.content.overseerr import FULL_SYNC_CURSOR, REQUESTS_CURSOR, Overseerr
+from program.db.db import db
+from program.media.cursor import get_cursor, set_cursor
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    monkeypatch.setattr(cursor, "db", SimpleNamespace(Session=sessionmaker(engine), engine=engine))
+
+
+class Server:
+    """Serves /api/v1/request pages sorted by modification, newest first."""
+
+    def __init__(self, count):
+        self.requests = [self._request(n) for n in range(1, count + 1)]
+        self.urls = []
+
+    @staticmethod
+    def _request(n, status=3):
+        return SimpleNamespace(
+            id=n,
+            status=2,
+            updatedAt=f"{datetime(2024, 1, 1) + timedelta(minutes=n):%Y-%m-%dT%H:%M:%S}.000Z",
+            media=SimpleNamespace(id=n, status=status, imdbId=f"tt{n:07d}"),
+        )
+
+    def add(self, n, status=3):
+        self.requests.append(self._request(n, status))
+
+    def __call__(self, url, additional_headers=None, **kwargs):
+        self.urls.append(url)
+        query = parse_qs(urlparse(url).query)
+        take, skip = int(query["take"][0]), int(query["skip"][0])
+        assert query["sort"] == ["modified"]
+        ordered = sorted(self.requests, key=lambda request: request.updatedAt, reverse=True)
+        return SimpleNamespace(is_ok=True, data=SimpleNamespace(
+            pageInfo=SimpleNamespace(results=len(ordered)), results=ordered[skip:skip + take]
+        ))
+
+
+@pytest.fixture
+def service(monkeypatch):
+    server = Server(250)
+    monkeypatch.setattr(overseerr, "get", server)
+    service = Overseerr.__new__(Overseerr)
+    service.key = "overseerr"
+    service.settings = SimpleNamespace(url="http://overseerr", use_webhook=False, full_sync_interval=86400)
+    service.headers = {}
+    service.run_once = False
+    service.recurring_items = set()
+    return service, server
+
+
+def test_first_run_reconciles_every_request(service):
+    service, server = service
+    assert len(list(service.run())) == 250
+    assert len(server.urls) == 3
+    assert get_cursor(REQUESTS_CURSOR) == server.requests[-1].updatedAt
+    assert get_cursor(FULL_SYNC_CURSOR)
+
+
+def test_polls_stop_at_the_cursor(service):
+    service, server = service
+    list(service.run())
+    server.urls.clear()
+
+    assert list(service.run()) == []
+    assert len(server.urls) == 1 and "take=20" in server.urls[0]
+
+    server.add(251)
+    server.add(252, status=5)
+    assert [item.imdb_id for item in service.run()] == ["tt0000251"]
+    assert len(server.urls) == 2
+    assert get_cursor(REQUESTS_CURSOR) == server.requests[-1].updatedAt
+
+
+def test_full_sync_runs_again_once_due(service):
+    service, server = service
+    list(service.run())
+    set_cursor(FULL_SYNC_CURSOR, (datetime.now() - timedelta(days=2)).isoformat())
+    service.recurring_items.clear()
+    server.urls.clear()
+
+    assert len(list(service.run())) == 250
+    assert all("take=100" in url for url in server.urls)
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from utils.request import CachePolicy, ResponseCache, cache_stats, get
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802
+        server = self.server
+        server.requests.append((self.path, self.headers.get("If-None-Match")))
+        etag = server.response_headers.get("ETag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path, "count": len(server.requests)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in server.response_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []
+    server.response_headers = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fresh_responses_are_served_without_a_request(server):
+    cache = ResponseCache("test_fresh", CachePolicy(ttl=60))
+    first = get(f"{server.url}/shows", params={"page": 1}, cache=cache)
+    second = get(f"{server.url}/shows", params={"page": 1}, cache=cache)
+    other = get(f"{server.url}/shows", params={"page": 2}, cache=cache)
+
+    assert first.data.count == second.data.count == 1
+    assert other.data.count == 2
+    assert len(server.requests) == 2
+    assert cache.stats() == {"size": 2, "hits": 1, "revalidated": 0, "misses": 2, "hit_ratio": 0.3333}
+    assert cache_stats()["test_fresh"]["hits"] == 1
+
+
+def test_expired_responses_are_revalidated(server):
+    server.response_headers = {"ETag": '"v1"', "Cache-Control": "max-age=0"}
+    cache = ResponseCache("test_etag", CachePolicy(ttl=60))
+    first = get(f"{server.url}/show", cache=cache)
+    second = get(f"{server.url}/show", cache=cache)
+
+    # max-age=0 from the server wins over the policy, every call is a conditional request
+    assert server.requests == [("/show", None), ("/show", '"v1"')]
+    assert second.is_ok and second.data.count == first.data.count == 1
+    assert cache.stats()["revalidated"] == 1
+
+    server.response_headers = {"ETag": '"v2"', "Cache-Control": "max-age=0"}
+    assert get(f"{server.url}/show", cache=cache).data.count == 3
+
+
+def test_cache_control_is_honoured(server):
+    cache = ResponseCache("test_control", CachePolicy(ttl=60, max_ttl=1))
+    server.response_headers = {"Cache-Control": "no-store"}
+    get(f"{server.url}/private", cache=cache)
+    get(f"{server.url}/private", cache=cache)
+    assert len(server.requests) == 2
+
+    # A longer max-age than the policy allows is capped
+    server.response_headers = {"Cache-Control": "max-age=3600"}
+    get(f"{server.url}/capped", cache=cache)
+    get(f"{server.url}/capped", cache=cache)
+    assert len(server.requests) == 3
+    time.sleep(1.1)
+    get(f"{server.url}/capped", cache=cache)
+    assert len(server.requests) == 4
+
+
+def test_keys_cover_method_and_headers_without_exposing_them(server):
+    cache = ResponseCache("test_get", CachePolicy(ttl=60))
+    key = cache.key("GET", f"{server.url}/shows", {"page": 1}, {"trakt-api-key": "secret"})
+    assert "secret" not in key
+    assert key != cache.key("GET", f"{server.url}/shows", {"page": 1}, {"trakt-api-key": "other"})
+    assert key != cache.key("POST", f"{server.url}/shows", {"page": 1}, {"trakt-api-key": "secret"})
+
+
+def test_disk_tier_survives_restart(server, tmp_path):
+    cache = ResponseCache("test_disk", CachePolicy(ttl=60), disk_path=tmp_path / "http.db")
+    get(f"{server.url}/movie", cache=cache)
+
+    restarted = ResponseCache("test_disk", CachePolicy(ttl=60), disk_path=tmp_path / "http.db")
+    assert get(f"{server.url}/movie", cache=restarted).data.count == 1
+    assert len(server.requests) == 1
+    assert restarted.stats()["hits"] == 1
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import program.db.search as search
+from program.db.db import db
+from program.db.search import MAX_RANKED, NGramIndex, apply_search
+from program.media.item import MediaItem, Movie, Show
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import sessionmaker
+
+
+def _index():
+    index = NGramIndex()
+    index.add_many([
+        (1, "Inception", "tt1375666"),
+        (2, "Interstellar", "tt0816692"),
+        (3, "The Vampire Diaries", "tt1405406"),
+        (4, "The Dark Knight", "tt0468569"),
+    ])
+    return index
+
+
+def test_search_substring():
+    results = _index().search("vampire")
+    assert [item_id for item_id, _ in results] == [3]
+
+
+def test_search_tolerates_typos():
+    results = _index().search("inceptoin")
+    assert results and results[0][0] == 1
+
+
+def test_search_ranks_exact_title_first():
+    index = _index()
+    index.add(5, "Inception: The Cobol Job", "tt5295894")
+    results = [item_id for item_id, _ in index.search("inception")]
+    assert results[:2] == [1, 5]
+
+
+def test_search_by_imdb_id():
+    results = _index().search("tt0816692")
+    assert results[0][0] == 2
+
+
+def test_search_no_match():
+    assert _index().search("zzzzzz") == []
+    assert _index().search("") == []
+
+
+def test_update_and_remove():
+    index = _index()
+    index.add(4, "The Dark Knight Rises", "tt1345836")
+    assert len(index) == 4
+    assert index.search("rises")[0][0] == 4
+
+    index.remove(4)
+    assert index.search("dark knight") == []
+    assert "rises" not in str(index._postings.keys())
+
+
+def test_apply_search_fallback(monkeypatch):
+    index = _index()
+    index.built = True
+    monkeypatch.setattr(search, "search_index", index)
+    monkeypatch.setattr(search, "_uses_trigram_index", lambda: False)
+
+    query = apply_search(select(MediaItem), "vampire")
+    compiled = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    assert "IN (3)" in compiled
+    assert "ORDER BY CASE" in compiled
+
+
+def test_apply_search_filters_and_counts_every_match(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(search, "db", SimpleNamespace(Session=Session, engine=engine))
+    monkeypatch.setattr(search, "search_index", NGramIndex())
+
+    # The shows rank first, so the movies are all past the ranked matches
+    with Session() as session:
+        session.add_all(Show({"imdb_id": f"tt{n:07d}", "title": "Vampire"}) for n in range(MAX_RANKED))
+        session.add_all(Movie({"imdb_id": f"tt{n:07d}", "title": f"Vampire Movie {n}"}) for n in range(MAX_RANKED, MAX_RANKED + 50))
+        session.commit()
+
+        query = apply_search(select(MediaItem), "vampire").where(MediaItem.type == "movie")
+        assert session.execute(select(func.count()).select_from(query.subquery())).scalar_one() == 50
+        titles = session.execute(query.limit(2)).unique().scalars().all()
+        assert [movie.title for movie in titles] == [f"Vampire Movie {MAX_RANKED}", f"Vampire Movie {MAX_RANKED + 1}"]
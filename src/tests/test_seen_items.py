@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import program.content.seen as seen
+import pytest
+from program.content.seen import SeenSet, expire_seen
+from program.db.db import db
+from program.media.item import Movie
+from program.media.seen_item import SeenItem
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.orm import sessionmaker
+from utils.bloom import BloomFilter
+
+
+@pytest.fixture(autouse=True)
+def Session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(seen, "db", SimpleNamespace(Session=Session, engine=engine))
+    monkeypatch.setattr(seen, "seen_sets", {})
+    return Session
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for n in range(1000):
+        bloom.add(f"tt{n:07d}")
+    assert all(f"tt{n:07d}" in bloom for n in range(1000))
+    false_positives = sum(f"tt{n:07d}" in bloom for n in range(1000, 11000))
+    assert false_positives < 300
+
+
+def test_seen_ids_survive_a_restart(Session):
+    overseerr = SeenSet("overseerr")
+    assert "tt0944947" not in overseerr
+    overseerr.add("tt0944947")
+    assert "tt0944947" in overseerr
+    assert "tt0944947" not in SeenSet("listrr")
+
+    restarted = SeenSet("overseerr")
+    assert "tt0944947" in restarted
+    assert "tt1375666" not in restarted
+
+
+def test_unseen_ids_are_answered_without_queries(Session):
+    seen_set = SeenSet("mdblist")
+    for n in range(50):
+        seen_set.add(f"tt{n:07d}")
+
+    statements = []
+    event.listen(seen.db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert all(f"tt{n:07d}" in seen_set for n in range(50))
+    assert not any(f"tt{n:07d}" in seen_set for n in range(1000, 1100))
+    # Confirmed ids are held in memory and the Bloom filter turns the others away
+    assert statements == []
+    assert seen_set.filtered >= 95
+
+
+def test_ids_outside_the_library_expire(Session):
+    seen_set = SeenSet("plex_watchlist")
+    for imdb_id in ("tt0000001", "tt0000002", "tt0000003"):
+        seen_set.add(imdb_id)
+    with Session() as session:
+        session.add(Movie({"imdb_id": "tt0000001", "title": "Kept"}))
+        session.execute(update(SeenItem).where(SeenItem.imdb_id != "tt0000003").values(seen_at=datetime.now() - timedelta(days=2)))
+        session.commit()
+
+    assert expire_seen() == 1
+    assert "tt0000001" in seen_set
+    assert "tt0000002" not in seen_set
+    # Too recent to tell whether it is on its way into the library
+    assert "tt0000003" in seen_set
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+from program.db.db import db
+from program.media.item import Movie
+from program.media.stream import Stream
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def _stream(infohash):
+    return Stream(SimpleNamespace(
+        raw_title=f"Inception {infohash}", infohash=infohash,
+        data=SimpleNamespace(parsed_title="Inception"), rank=100, lev_ratio=1.0,
+    ))
+
+
+def test_streams_are_looked_up_by_infohash():
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams.append(_stream("AAAA"))
+    assert movie.get_stream("aaaa").infohash == "AAAA"
+
+    movie.streams = [_stream("bbbb")]
+    assert movie.get_stream("aaaa") is None
+    assert movie.get_stream("BBBB") is not None
+
+    movie.streams.remove(movie.get_stream("bbbb"))
+    assert movie.get_stream("bbbb") is None
+    assert not movie.is_scraped()
+
+
+def test_blacklisting_moves_stream_between_indexes():
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams = [_stream("aaaa"), _stream("bbbb")]
+
+    assert movie.blacklist_stream(_stream("aaaa")) is True
+    assert movie.blacklist_stream(_stream("aaaa")) is False
+    assert movie.get_stream("aaaa") is None
+    assert movie.is_stream_blacklisted(_stream("AAAA"))
+    assert movie.is_scraped()
+
+    assert movie.blacklist_streams([_stream("bbbb"), _stream("cccc")]) == 1
+    assert not movie.is_scraped()
+    assert {stream.infohash for stream in movie.blacklisted_streams} == {"aaaa", "bbbb"}
+
+
+def test_index_is_built_for_items_loaded_from_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams = [_stream("aaaa"), _stream("bbbb")]
+    movie.blacklist_stream(movie.get_stream("bbbb"))
+    with Session() as session:
+        session.add(movie)
+        session.commit()
+        movie_id = movie._id
+
+    with Session() as session:
+        loaded = session.get(Movie, movie_id)
+        assert loaded.get_stream("aaaa") is not None
+        assert loaded.is_stream_blacklisted(_stream("bbbb"))
+        loaded.blacklist_stream(loaded.get_stream("aaaa"))
+        session.commit()
+
+    with Session() as session:
+        assert not session.get(Movie, movie_id).is_scraped()
+
+
+def test_streams_are_hashable():
+    assert len({_stream("aaaa"), _stream("aaaa"), _stream("bbbb")}) == 2
+
+
+def test_blacklisting_thousands_of_streams_is_linear(monkeypatch):
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.streams = [_stream(f"{i:040x}") for i in range(5000)]
+    builds = []
+    stream_index = Movie._stream_index
+
+    def counting_stream_index(self, collection):
+        if f"_{collection}_index" not in self.__dict__:
+            builds.append(collection)
+        return stream_index(self, collection)
+
+    monkeypatch.setattr(Movie, "_stream_index", counting_stream_index)
+
+    # Every lookup is answered by one index, built once instead of scanning the streams
+    assert all(movie.get_stream(f"{i:040x}") for i in range(5000))
+    assert movie.blacklist_streams(list(movie.streams)) == 5000
+    assert builds == ["streams"]
+    assert not movie.is_scraped()
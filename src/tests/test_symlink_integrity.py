@@ -0,0 +1,105 @@
+import os
+from types import SimpleNamespace
+
+import program.libraries.integrity as integrity
+import program.program as program_module
+import pytest
+from program.db.db import db
+from program.libraries.integrity import SymlinkIntegrityScanner
+from program.media.item import Movie
+from program.mount import MountIndex
+from program.program import Program
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    mount, library = tmp_path / "mount", tmp_path / "library"
+    links = []
+    for show in range(3):
+        for episode in range(1, 5):
+            source = mount / f"Show {show} S01" / f"Show.{show}.S01E{episode:02d}.mkv"
+            source.parent.mkdir(parents=True, exist_ok=True)
+            source.write_text("")
+            link = library / "shows" / f"Show {show}" / "Season 01" / f"Show {show} - s01e{episode:02d}.mkv"
+            link.parent.mkdir(parents=True, exist_ok=True)
+            os.symlink(source, link)
+            links.append((link, source))
+    index = MountIndex(mount, min_refresh_interval=0)
+    monkeypatch.setattr(integrity, "get_mount_index", lambda root: index)
+    return library, mount, links
+
+
+def test_broken_links_are_found(library):
+    library, mount, links = library
+    os.remove(links[5][1])
+    os.remove(links[10][1])
+
+    scanner = SymlinkIntegrityScanner(library, mount, batch_size=100)
+    assert scanner.run() == [str(links[5][0]), str(links[10][0])]
+    stats = scanner.stats()
+    assert stats["checked"] == 12 and stats["broken"] == 2 and stats["full_passes"] == 1
+    assert stats["cursor"] is None
+
+
+def test_runs_continue_from_the_cursor(library):
+    library, mount, links = library
+    os.remove(links[0][1])
+    os.remove(links[9][1])
+    scanner = SymlinkIntegrityScanner(library, mount, batch_size=5)
+
+    assert scanner.run() == [str(links[0][0])]
+    assert scanner.cursor == ("shows", "Show 1", "Season 01", "Show 1 - s01e01.mkv")
+    assert scanner.run() == [str(links[9][0])]
+    assert scanner.run() == []
+    assert scanner.passes == 1 and scanner.cursor is None
+    assert scanner.checked == 12
+
+    # The next pass starts over
+    assert scanner.run() == [str(links[0][0])]
+
+
+def test_index_hits_are_not_checked_on_the_mount(library, monkeypatch):
+    library, mount, links = library
+    stats = []
+    exists = os.path.exists
+    monkeypatch.setattr(integrity.os.path, "exists", lambda path: stats.append(path) or exists(path))
+
+    os.remove(links[3][1])
+    scanner = SymlinkIntegrityScanner(library, mount)
+    assert scanner.run() == [str(links[3][0])]
+    assert stats == [str(links[3][1])]
+
+
+def test_program_resets_and_requeues_broken_items(library, tmp_path, monkeypatch):
+    library, mount, links = library
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(program_module, "db", SimpleNamespace(Session=Session, engine=engine))
+
+    link, source = links[2]
+    movie = Movie({"imdb_id": "tt1375666", "title": "Inception"})
+    movie.set("file", source.name)
+    movie.set("folder", source.parent.name)
+    movie.set("symlinked", True)
+    movie.set("symlink_path", str(link))
+    with Session() as session:
+        session.add(movie)
+        session.commit()
+        movie_id = movie._id
+    os.remove(source)
+
+    queued = []
+    program = SimpleNamespace(
+        symlink_scanner=SymlinkIntegrityScanner(library, mount),
+        add_to_queue=lambda item, emitted_by: queued.append((item.imdb_id, emitted_by)),
+    )
+    Program._check_symlink_integrity(program)
+
+    assert queued == [("tt1375666", "SymlinkIntegrity")]
+    assert not os.path.lexists(link)
+    with Session() as session:
+        reset = session.get(Movie, movie_id)
+        assert reset.symlink_path is None and reset.file is None and not reset.symlinked
@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from program.downloaders.torrents import TorrentMirror
+
+
+class FakeAccount:
+    def __init__(self, count):
+        self.torrents = [{"id": i, "hash": f"{i:040x}"} for i in range(count)]
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def add(self, torrent_id):
+        self.torrents.append({"id": torrent_id, "hash": f"{torrent_id:040x}"})
+
+    def fetch_page(self, offset, limit):
+        with self.lock:
+            self.requests.append((offset, limit))
+        time.sleep(0.01)
+        newest_first = list(reversed(self.torrents))
+        return newest_first[offset:offset + limit]
+
+
+def _mirror(account, **kwargs):
+    kwargs.setdefault("min_refresh_interval", 0)
+    return TorrentMirror("test", account.fetch_page, page_size=10, full_page_size=100, **kwargs)
+
+
+def test_first_lookup_lists_the_whole_account():
+    account = FakeAccount(250)
+    mirror = _mirror(account)
+
+    assert mirror.get_by_hash(f"{5:040X}")["id"] == 5
+    assert mirror.get_by_id(249)["hash"] == f"{249:040x}"
+    assert len(mirror) == 250
+    assert account.requests == [(0, 100), (100, 100), (200, 100)]
+
+
+def test_refresh_stops_at_first_known_torrent():
+    account = FakeAccount(250)
+    mirror = _mirror(account)
+    mirror.refresh()
+    account.requests.clear()
+
+    for torrent_id in range(250, 265):
+        account.add(torrent_id)
+    assert mirror.get_by_id(262)["id"] == 262
+    assert len(mirror) == 265
+    # 15 new torrents, two incremental pages
+    assert account.requests == [(0, 10), (10, 10)]
+
+
+def test_own_changes_are_applied_without_listing():
+    account = FakeAccount(20)
+    mirror = _mirror(account)
+    mirror.refresh()
+    account.requests.clear()
+
+    mirror.add({"id": 100, "hash": "A" * 40})
+    assert mirror.get_by_hash("a" * 40)["id"] == 100
+    mirror.remove(3)
+    assert mirror.get_by_id(3, refresh=False) is None
+    assert mirror.get_by_hash(f"{3:040x}", refresh=False) is None
+    assert account.requests == []
+
+
+def test_locally_added_torrents_do_not_end_refresh_early():
+    account = FakeAccount(20)
+    mirror = _mirror(account)
+    mirror.refresh()
+
+    # Added from another client before our own add
+    account.add(20)
+    account.add(21)
+    mirror.add({"id": 21, "hash": f"{21:040x}"})
+    assert mirror.get_by_id(20)["id"] == 20
+
+
+def test_stale_mirror_is_fully_resynced():
+    account = FakeAccount(20)
+    mirror = _mirror(account, max_age=0.01)
+    mirror.refresh()
+    account.torrents = account.torrents[:10]
+    time.sleep(0.02)
+
+    assert mirror.get_by_id(100) is None
+    assert len(mirror) == 10
+
+
+def test_concurrent_misses_share_a_refresh():
+    account = FakeAccount(20)
+    mirror = _mirror(account)
+    mirror.refresh()
+    account.requests.clear()
+    account.add(20)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: mirror.get_by_id(20), range(8)))
+    assert all(result["id"] == 20 for result in results)
+    assert len(account.requests) == 1
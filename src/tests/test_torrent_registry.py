@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import program.downloaders.realdebrid as realdebrid
+import program.downloaders.registry as registry
+import pytest
+from program.db.db import db
+from program.downloaders.realdebrid import RealDebridDownloader
+from program.downloaders.registry import TorrentRegistry, assign_pack_files
+from program.media.item import Episode, Season, Show
+from program.settings.models import AppModel
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+PACK_HASH = "c" * 40
+PACK_FILES = {
+    str(number): {"filename": f"The.Vampire.Diaries.S01E0{number}.1080p.mkv", "filesize": 1_000_000_000}
+    for number in (1, 2, 3)
+}
+
+
+@pytest.fixture(autouse=True)
+def session_factory(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    Session = sessionmaker(engine)
+    monkeypatch.setattr(registry, "db", SimpleNamespace(Session=Session, engine=engine))
+    return Session
+
+
+@pytest.fixture
+def downloader(monkeypatch):
+    # Other tests swap out the global settings
+    monkeypatch.setattr(realdebrid, "settings_manager", SimpleNamespace(settings=AppModel()))
+    return RealDebridDownloader
+
+
+def _season():
+    show = Show({"imdb_id": "tt1405406", "title": "The Vampire Diaries"})
+    season = Season({"number": 1})
+    for number in (1, 2, 3):
+        season.add_episode(Episode({"number": number}))
+    show.add_season(season)
+    return season
+
+
+def test_same_hash_is_only_added_once():
+    torrents = TorrentRegistry("realdebrid")
+    calls = []
+
+    def add():
+        calls.append(1)
+        time.sleep(0.05)
+        return "TORRENT1"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: torrents.get_or_add(PACK_HASH, add), range(8)))
+
+    assert len(calls) == 1
+    assert {entry.torrent_id for entry, _ in results} == {"TORRENT1"}
+    assert sum(added for _, added in results) == 1
+
+
+def test_registry_is_unique_per_provider_and_hash():
+    torrents = TorrentRegistry("realdebrid")
+    torrents.register(PACK_HASH.upper(), "TORRENT1")
+    # A second add from elsewhere keeps the first entry
+    assert torrents.register(PACK_HASH, "TORRENT2").torrent_id == "TORRENT1"
+    assert TorrentRegistry("torbox").get(PACK_HASH) is None
+
+    torrents.remove("TORRENT1")
+    assert torrents.get(PACK_HASH) is None
+
+
+def test_pack_files_are_assigned_to_waiting_episodes():
+    season = _season()
+    episode = season.episodes[0]
+    episode.active_stream = {"hash": PACK_HASH, "id": "TORRENT1", "files": PACK_FILES}
+    episode.folder = episode.alternative_folder = "The.Vampire.Diaries.S01"
+    episode.file = PACK_FILES["1"]["filename"]
+
+    assigned = assign_pack_files(episode, [file["filename"] for file in PACK_FILES.values()])
+    assert [e.number for e in assigned] == [2, 3]
+    assert season.episodes[2].file == PACK_FILES["3"]["filename"]
+    assert season.episodes[2].folder == "The.Vampire.Diaries.S01"
+    assert season.episodes[2].active_stream["id"] == "TORRENT1"
+
+
+def test_realdebrid_reuses_registered_torrent(monkeypatch, downloader):
+    def no_requests(*args, **kwargs):
+        raise AssertionError("unexpected request")
+
+    monkeypatch.setattr(realdebrid, "get", no_requests)
+    monkeypatch.setattr(realdebrid, "post", no_requests)
+    downloader = downloader()
+    downloader.torrents.add(SimpleNamespace(id="TORRENT1", hash=PACK_HASH))
+    downloader.torrents.refresh = lambda *args, **kwargs: None
+    downloader.registry.register(PACK_HASH, "TORRENT1", files=PACK_FILES, name="The.Vampire.Diaries.S01")
+
+    episode = _season().episodes[1]
+    episode.active_stream = {"hash": PACK_HASH, "files": PACK_FILES, "id": None}
+    episode.file = PACK_FILES["2"]["filename"]
+
+    assert downloader._is_downloaded(episode) is True
+    assert episode.active_stream["id"] == "TORRENT1"
+    assert episode.folder == "The.Vampire.Diaries.S01"
+    assert [e.file for e in episode.parent.episodes] == [file["filename"] for file in PACK_FILES.values()]
+
+
+def test_realdebrid_forgets_torrents_gone_from_account(monkeypatch, downloader):
+    monkeypatch.setattr(realdebrid, "get", lambda *args, **kwargs: SimpleNamespace(is_ok=True, data=[]))
+    downloader = downloader()
+    downloader.registry.register(PACK_HASH, "TORRENT1")
+
+    assert downloader._registered_torrent(PACK_HASH) is None
+    assert downloader.registry.get(PACK_HASH) is None
+
+
+def test_realdebrid_waits_for_file_selection_without_blocking(monkeypatch, downloader):
+    downloader = downloader()
+    states = {"TORRENT1": "magnet_conversion"}
+    downloader.download_tracker.fetch_states = lambda torrent_ids: {i: states[i] for i in torrent_ids}
+    downloader.download_tracker.min_interval = 0.01
+    resubmitted = []
+    downloader.download_tracker.on_done = resubmitted.append
+    added, selected = [], []
+    monkeypatch.setattr(downloader, "add_magnet", lambda item: added.append(item._id) or "TORRENT1")
+    monkeypatch.setattr(downloader, "select_files", lambda request_id, item: selected.append(request_id))
+    info = SimpleNamespace(filename="The.Vampire.Diaries.S01", original_filename="The.Vampire.Diaries.S01")
+    monkeypatch.setattr(downloader, "get_torrent_info", lambda request_id: info)
+
+    episodes = _season().episodes
+    for number, episode in enumerate(episodes[:2], start=1):
+        episode._id = number
+        episode.active_stream = {"hash": PACK_HASH, "files": PACK_FILES, "id": None}
+        episode.file = PACK_FILES[str(number)]["filename"]
+        downloader._download_item(episode)
+
+    # Both episodes wait on the one torrent, nothing is selected before it is ready
+    assert added == [1]
+    assert downloader.download_tracker.is_waiting(1) and downloader.download_tracker.is_waiting(2)
+    assert selected == []
+
+    states["TORRENT1"] = "waiting_files_selection"
+    started = time.monotonic()
+    while len(resubmitted) < 2 and time.monotonic() - started < 2:
+        time.sleep(0.01)
+    assert sorted(resubmitted) == [1, 2]
+
+    for episode in episodes[:2]:
+        downloader.run(episode)
+        assert episode.active_stream["id"] == "TORRENT1"
+        assert episode.folder == "The.Vampire.Diaries.S01"
+    assert selected == ["TORRENT1"]
+    assert downloader.registry.get(PACK_HASH).files == PACK_FILES
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import program.indexers.trakt as trakt
+import pytest
+from program.indexers.trakt import TraktIndexer
+from program.media.item import Movie
+from utils.ratelimiter import RateLimitExceeded, TokenBucket
+
+
+class Trakt:
+    """Answers create_item_from_imdb_id, slower for the ids in `delays`."""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, imdb_id, fresh=False):
+        with self._lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(self.delays.get(imdb_id, 0.02))
+        with self._lock:
+            self.running -= 1
+        if imdb_id == "tt9999999":
+            return None
+        return Movie({"imdb_id": imdb_id, "title": imdb_id})
+
+
+@pytest.fixture
+def indexer():
+    return TraktIndexer.__new__(TraktIndexer)
+
+
+def _library(*imdb_ids):
+    return [Movie({"imdb_id": imdb_id, "title": imdb_id}) for imdb_id in imdb_ids]
+
+
+def test_batch_is_indexed_with_bounded_concurrency(monkeypatch, indexer):
+    fetch = Trakt()
+    monkeypatch.setattr(trakt, "create_item_from_imdb_id", fetch)
+    imdb_ids = [f"tt{n:07d}" for n in range(12)]
+
+    indexed = list(indexer.run_batch(_library(*imdb_ids, "tt9999999"), max_workers=3))
+    assert sorted(item.imdb_id for item in indexed) == imdb_ids
+    assert all(item.indexed_at for item in indexed)
+    assert fetch.most_running == 3
+
+
+def test_batch_yields_items_as_they_complete(monkeypatch, indexer):
+    monkeypatch.setattr(trakt, "create_item_from_imdb_id", Trakt(delays={"tt0000001": 0.3}))
+    indexed = [item.imdb_id for item in indexer.run_batch(_library("tt0000001", "tt0000002", "tt0000003"), max_workers=3)]
+    assert indexed[-1] == "tt0000001"
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    for _ in range(6):
+        with bucket:
+            pass
+    # Two calls come out of the full bucket, the other four wait a twentieth of a second each
+    assert 0.15 < time.monotonic() - started < 0.5
+
+    with pytest.raises(RateLimitExceeded):
+        with TokenBucket(rate=1, capacity=0, raise_on_limit=True):
+            pass
+
+
+def test_limit_hit_holds_every_caller_back():
+    bucket = TokenBucket(rate=100, capacity=10)
+    bucket.limit_hit(retry_after=0.2)
+    started = time.monotonic()
+    with bucket:
+        pass
+    assert time.monotonic() - started >= 0.19
@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import program.indexers.trakt as trakt
+import program.media.cursor as cursor
+import pytest
+from program.db.db import db
+from program.indexers.trakt import TraktIndexer, TraktUpdates, get_updated_ids
+from program.media.cursor import get_cursor, set_cursor
+from program.media.item import Episode, Movie, Season, Show
+from program.media.state import States
+from program.program import Program
+from program.scrapers import Scraping
+from program.state_transition import process_event
+from program.symlink import Symlinker
+from sqlalchemy import create_engine
+from utils.request import CachePolicy, ResponseCache
+from sqlalchemy.orm import sessionmaker
+
+AIRED = datetime(2010, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'riven.db'}")
+    db.Model.metadata.create_all(engine)
+    monkeypatch.setattr(cursor, "db", SimpleNamespace(Session=sessionmaker(engine), engine=engine))
+    indexer = SimpleNamespace(incremental_updates=True, update_interval=3600)
+    monkeypatch.setattr(trakt, "settings_manager", SimpleNamespace(settings=SimpleNamespace(indexer=indexer)))
+
+
+def _show(episodes_per_season, titles=None):
+    show = Show({"imdb_id": "tt1405406", "title": "The Vampire Diaries", "aired_at": AIRED})
+    for number, episodes in enumerate(episodes_per_season, start=1):
+        season = Season({"number": number, "aired_at": AIRED})
+        for episode_number in range(1, episodes + 1):
+            title = (titles or {}).get((number, episode_number), f"Episode {episode_number}")
+            season.add_episode(Episode({"number": episode_number, "title": title, "aired_at": AIRED}))
+        show.add_season(season)
+    return show
+
+
+def test_cursor_is_stored():
+    assert get_cursor("test") is None
+    set_cursor("test", "one")
+    set_cursor("test", "two")
+    assert get_cursor("test") == "two"
+
+
+def test_updates_replace_the_timer_once_synced(monkeypatch):
+    calls = []
+    monkeypatch.setattr(trakt, "get_updated_ids", lambda kind, since: calls.append(kind) or {"shows": {"tt1405406"}, "movies": {"tt1375666"}}[kind])
+    updates = TraktUpdates()
+    monkeypatch.setattr(trakt, "trakt_updates", updates)
+
+    # The first sync has nothing to compare with, it only records where to start
+    assert updates.sync() == set()
+    assert not updates.active and calls == []
+    assert get_cursor(trakt.UPDATES_CURSOR)
+
+    assert updates.sync() == {"tt1405406", "tt1375666"}
+    assert updates.active
+    # Only what the library holds is remembered, the rest of the feed is dropped
+    assert updates.updated == set()
+    updates.mark({"tt1405406"})
+
+    show = _show([2])
+    show.indexed_at = datetime.now() - timedelta(days=2)
+    other = Show({"imdb_id": "tt0944947", "title": "Game of Thrones"})
+    other.indexed_at = datetime.now() - timedelta(days=2)
+    assert TraktIndexer.should_submit(show)
+    assert not TraktIndexer.should_submit(other)
+
+    updates.done("tt1405406")
+    assert not TraktIndexer.should_submit(show)
+
+
+def test_stale_cursor_falls_back_to_the_timer(monkeypatch):
+    monkeypatch.setattr(trakt, "get_updated_ids", lambda kind, since: pytest.fail("feed must not be fetched"))
+    set_cursor(trakt.UPDATES_CURSOR, (datetime.now(timezone.utc) - timedelta(days=45)).isoformat())
+    updates = TraktUpdates()
+    assert updates.sync() == set()
+    assert not updates.active
+
+
+def test_reported_items_skip_the_response_cache(monkeypatch):
+    cache = ResponseCache("trakt_test", CachePolicy(ttl=3600))
+    url = "https://api.trakt.tv/shows/tt1405406/seasons?extended=episodes,full"
+    key = cache.key("GET", url, headers=trakt.TRAKT_HEADERS)
+    cache._cache.set(key, "old seasons")
+    monkeypatch.setattr(trakt, "trakt_cache", cache)
+    monkeypatch.setattr(trakt, "get", lambda url, cache=None, **kwargs: SimpleNamespace(is_ok=True, data=cache.lookup(key)))
+
+    assert trakt.get_show("tt1405406") == cache.lookup(key)
+    assert trakt.get_show("tt1405406", fresh=True) == {}
+    assert cache.lookup(key) is None
+
+
+def test_updated_ids_are_paged(monkeypatch):
+    pages = {
+        1: [SimpleNamespace(show=SimpleNamespace(ids=SimpleNamespace(imdb="tt0000001"))), SimpleNamespace(show=SimpleNamespace(ids=SimpleNamespace(imdb=None)))],
+        2: [SimpleNamespace(show=SimpleNamespace(ids=SimpleNamespace(imdb="tt0000002")))],
+    }
+    urls = []
+
+    def get(url, **kwargs):
+        urls.append(url)
+        page = int(url.split("page=")[1].split("&")[0])
+        return SimpleNamespace(is_ok=True, data=pages[page], response=SimpleNamespace(headers={"X-Pagination-Page-Count": "2"}))
+
+    monkeypatch.setattr(trakt, "get", get)
+    since = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    assert get_updated_ids("shows", since) == {"tt0000001", "tt0000002"}
+    assert urls[0] == "https://api.trakt.tv/shows/updates/2024-05-01T12:30:00Z?page=1&limit=100"
+    assert len(urls) == 2
+
+
+def test_only_new_and_changed_episodes_are_merged():
+    existing = _show([2])
+    kept = existing.seasons[0].episodes[0]
+    kept.file = "kept.mkv"
+    indexed = _show([3, 1], titles={(1, 2): "Renamed"})
+
+    assert TraktIndexer.merge(existing, indexed) == 3
+    assert [season.number for season in existing.seasons] == [1, 2]
+    first = existing.seasons[0]
+    assert [episode.number for episode in first.episodes] == [1, 2, 3]
+    assert first.episodes[0] is kept and kept.file == "kept.mkv"
+    assert first.episodes[1].title == "Renamed"
+    assert existing.seasons[1].parent is existing
+    assert TraktIndexer.merge(existing, _show([3, 1], titles={(1, 2): "Renamed"})) == 0
+
+
+def test_copy_items_matches_seasons_by_number():
+    library = Show({"imdb_id": "tt1405406", "title": "The Vampire Diaries"})
+    season = Season({"number": 2})
+    episode = Episode({"number": 1})
+    episode.file = "The.Vampire.Diaries.S02E01.mkv"
+    season.add_episode(episode)
+    library.add_season(season)
+
+    indexed = TraktIndexer.__new__(TraktIndexer).copy_items(library, _show([1, 1]))
+    assert indexed.seasons[0].episodes[0].file is None
+    assert indexed.seasons[1].episodes[0].file == "The.Vampire.Diaries.S02E01.mkv"
+
+
+def test_reindexed_show_is_merged_into_the_stored_one(monkeypatch):
+    monkeypatch.setattr(Scraping, "can_we_scrape", classmethod(lambda cls, item: False))
+    existing = _show([2])
+    existing.indexed_at = datetime.now() - timedelta(days=1)
+    indexed = _show([3])
+    indexed.indexed_at = datetime.now()
+
+    Program._merge_indexed(existing, indexed)
+    assert [episode.number for episode in existing.seasons[0].episodes] == [1, 2, 3]
+    assert existing.indexed_at == indexed.indexed_at
+    processed, _, _ = process_event(existing, TraktIndexer, existing)
+    assert processed is existing
+
+
+def test_reindexed_downloaded_movie_continues_as_the_stored_one(monkeypatch):
+    monkeypatch.setattr(Symlinker, "should_submit", staticmethod(lambda item: True))
+    existing = Movie({"imdb_id": "tt1375666", "title": "Inception", "aired_at": AIRED})
+    existing._id = 1
+    existing.indexed_at = datetime.now() - timedelta(days=1)
+    existing.file, existing.folder = "Inception.mkv", "Inception"
+    indexed = Movie({"imdb_id": "tt1375666", "title": "Inception (2010)", "aired_at": AIRED})
+    indexed.indexed_at = datetime.now()
+    TraktIndexer.__new__(TraktIndexer).copy_items(existing, indexed)
+
+    Program._merge_indexed(existing, indexed)
+    assert existing.title == "Inception (2010)"
+    assert existing.state == States.Downloaded
+    _, next_service, submitted = process_event(existing, TraktIndexer, existing)
+    assert next_service is Symlinker
+    assert submitted[0] is existing
@@ -0,0 +1,220 @@
+"""Two tier response cache with per key TTLs, stale-while-revalidate and request coalescing"""
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional
+
+from cachetools import LRUCache
+from utils.logger import logger
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires_at: float
+    stale_until: float
+
+    def is_fresh(self, now: float) -> bool:
+        return now < self.expires_at
+
+    def is_usable(self, now: float) -> bool:
+        return now < self.stale_until
+
+
+class DiskCache:
+    """SQLite backed cache tier, survives restarts and holds more than memory does."""
+
+    def __init__(self, path: Path, max_entries: int = 10000):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, stale_until REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, stale_until FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[2] <= time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        try:
+            return CacheEntry(pickle.loads(row[0]), row[1], row[2])  # noqa: S301
+        except Exception as e:
+            logger.debug(f"Dropping unreadable disk cache entry {key}: {e}")
+            self.delete(key)
+            return None
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        value = pickle.dumps(entry.value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, stale_until, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, entry.expires_at, entry.stale_until, time.time()),
+            )
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _evict(self) -> None:
+        if self._count() <= self.max_entries:
+            return
+        self._conn.execute("DELETE FROM cache WHERE stale_until <= ?", (time.time(),))
+        excess = self._count() - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)", (excess,)
+            )
+
+
+class Cache:
+    """
+    Bounded in-memory LRU cache with an optional disk tier.
+
+    `get_or_load` is the main entry point: fresh entries are returned as is, entries
+    within their stale window are returned immediately while a single background
+    refresh is started, and misses are loaded once no matter how many threads ask
+    for the same key at the same time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 1024,
+        ttl: float = 300,
+        stale_ttl: float = 0,
+        disk_path: Optional[Path] = None,
+        refresh_workers: int = 2,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self._disk = DiskCache(disk_path) if disk_path else None
+        self._lock = threading.Lock()
+        self._inflight: dict[Hashable, Future] = {}
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix=f"{name}Cache")
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        """Return the entry for `key` while it is still usable, looking in memory first."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None and self._disk:
+            entry = self._disk.get(str(key))
+            if entry is not None:
+                with self._lock:
+                    self._memory[key] = entry
+        if entry is None or not entry.is_usable(now):
+            return None
+        return entry
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, stale_ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        now = time.time()
+        entry = CacheEntry(value, now + ttl, now + ttl + stale_ttl)
+        with self._lock:
+            self._memory[key] = entry
+        if self._disk:
+            self._disk.set(str(key), entry)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._disk:
+            self._disk.delete(str(key))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._disk:
+            self._disk.clear()
+
+    def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Any],
+        ttl: Optional[float] = None,
+        stale_ttl: Optional[float] = None,
+        cache_none: bool = False,
+    ) -> Any:
+        """Return the cached value for `key`, calling `loader` to fill or refresh it."""
+        entry = self.get(key)
+        if entry is not None:
+            if entry.is_fresh(time.time()):
+                self.hits += 1
+                return entry.value
+            self.stale_hits += 1
+            self._load(key, loader, ttl, stale_ttl, cache_none, background=True)
+            return entry.value
+
+        self.misses += 1
+        return self._load(key, loader, ttl, stale_ttl, cache_none).result()
+
+    def _load(self, key, loader, ttl, stale_ttl, cache_none, background: bool = False) -> Future:
+        """Start loading `key` unless a load is already in flight, in which case share it."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self._inflight[key] = future
+
+        def run():
+            try:
+                value = loader()
+                if value is not None or cache_none:
+                    self.set(key, value, ttl, stale_ttl)
+                future.set_result(value)
+            except Exception as e:
+                if background:
+                    logger.debug(f"{self.name} cache failed to refresh {key}: {e}")
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+        if background:
+            self._refresher.submit(run)
+        else:
+            run()
+        return future
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._memory),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,84 @@
+"""Progress tracking for long running API jobs"""
+import threading
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+
+from utils.logger import logger
+
+MAX_FINISHED_JOBS = 100
+
+
+@dataclass
+class Job:
+    name: str
+    total: int
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    done: int = 0
+    status: str = "pending"
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+
+    def advance(self, amount: int) -> None:
+        self.done = min(self.total, self.done + amount)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "progress": round(self.done / self.total, 4) if self.total else 1.0,
+            "result": self.result,
+            "error": self.error,
+            "created_at": str(self.created_at),
+            "finished_at": str(self.finished_at) if self.finished_at else None,
+        }
+
+
+class JobRegistry:
+    """Keeps track of background jobs so their progress can be polled."""
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, name: str, total: int) -> Job:
+        job = Job(name=name, total=total)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def all(self) -> list[Job]:
+        return list(self._jobs.values())
+
+    def run(self, job: Job, fn: Callable[[Callable[[int], None]], dict]) -> None:
+        """Run `fn` with a progress callback and record its outcome on the job."""
+        job.status = "running"
+        try:
+            job.result = fn(job.advance)
+            job.done = job.total
+            job.status = "completed"
+        except Exception as e:
+            logger.exception(f"Job {job.name} ({job.id}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.now()
+
+    def _prune(self) -> None:
+        finished = sorted((job for job in self._jobs.values() if job.finished_at), key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
+
+
+jobs = JobRegistry()
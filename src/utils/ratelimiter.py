@@ -41,4 +41,49 @@ class RateLimiter:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
\ No newline at end of file
+        pass
+
+
+class TokenBucket:
+    """
+    Token bucket meant to be shared by every caller of one API. The bucket holds up to
+    `capacity` tokens and refills at `rate` tokens per second, each call takes one and
+    waits for the next token when the bucket is empty. Usable wherever a RateLimiter is.
+    """
+
+    def __init__(self, rate: float, capacity: int, raise_on_limit=False):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = Lock()
+        self.raise_on_limit = raise_on_limit
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                if self.raise_on_limit:
+                    raise RateLimitExceeded("Rate limit exceeded")
+            time.sleep(wait)
+
+    def limit_hit(self, retry_after: float = 0):
+        """The API turned a call down, nobody gets a token for `retry_after` seconds."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0) - retry_after * self.rate
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
@@ -1,15 +1,24 @@
+import hashlib
 import json
 import logging
+import os
+import threading
+import time
 from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
 from types import SimpleNamespace
-from typing import Optional
+from typing import Dict, Optional
 
 import requests
 from lxml import etree
 from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectTimeout, RequestException
+from requests.structures import CaseInsensitiveDict
 from urllib3.util.retry import Retry
-from utils.ratelimiter import RateLimiter, RateLimitExceeded
+from utils import data_dir_path
+from utils.cache import Cache
+from utils.ratelimiter import RateLimiter, RateLimitExceeded, TokenBucket
 from utils.useragents import user_agent_factory
 from xmltodict import parse as parse_xml
 
@@ -23,6 +32,19 @@ _retry_strategy = Retry(
 _adapter = HTTPAdapter(max_retries=_retry_strategy)
 
 
+def create_session(pool_size: int = 10, retry_if_failed=True) -> requests.Session:
+    """A session meant to be shared, its pool keeps up to `pool_size` connections per host alive."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=_retry_strategy if retry_if_failed else 0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class ResponseObject:
     """Response object"""
 
@@ -71,6 +93,160 @@ class ResponseObject:
             return {}
 
 
+@dataclass
+class CachePolicy:
+    """How long a service keeps its responses."""
+    # Seconds a response is fresh for when the server does not send a max-age
+    ttl: float
+    # Upper bound on the max-age a server asks for, None trusts the server
+    max_ttl: Optional[float] = None
+    # Seconds an expired response is kept to revalidate it with a conditional request
+    revalidate_for: float = 7 * 24 * 60 * 60
+
+
+@dataclass
+class CachedResponse:
+    status_code: int
+    url: str
+    headers: Dict[str, str]
+    content: bytes
+
+    def to_response(self) -> requests.Response:
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.url = self.url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        return response
+
+
+# Response headers worth keeping, the rest only matters to the connection they came with
+_CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+response_caches: Dict[str, "ResponseCache"] = {}
+
+
+def _cache_control(headers) -> Dict[str, Optional[str]]:
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+
+class ResponseCache:
+    """
+    Opt-in cache for GET responses, keyed by method, url, params and request headers.
+
+    Fresh responses are served without a request. Expired ones are revalidated with
+    `If-None-Match`/`If-Modified-Since` and a 304 serves the stored body again.
+    `Cache-Control` from the server wins over the policy: `no-store` is never cached,
+    `no-cache` is always revalidated and `max-age` sets the freshness, capped by the
+    policy's `max_ttl`. Entries live in memory with an optional sqlite tier on disk.
+    """
+
+    def __init__(self, name: str, policy: CachePolicy, maxsize: int = 1024, disk_path: Optional[Path] = None):
+        self.name = name
+        self.policy = policy
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._cache = Cache(f"{name}Http", maxsize=maxsize, ttl=policy.ttl, disk_path=disk_path)
+        response_caches[name] = self
+
+    @classmethod
+    def for_service(cls, name: str, policy: CachePolicy, maxsize: int = 1024) -> "ResponseCache":
+        """The cache of a service, on disk too when HTTP_CACHE_DISK is set."""
+        disk = os.getenv("HTTP_CACHE_DISK", "false").lower() in ["true", "1"]
+        return cls(name, policy, maxsize=maxsize, disk_path=data_dir_path / "cache" / "http.db" if disk else None)
+
+    @staticmethod
+    def key(method: str, url: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> str:
+        # Hashed, request headers carry api keys that have no business on disk
+        parts = [method.upper(), url, sorted((params or {}).items()), sorted((headers or {}).items())]
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+    def lookup(self, key: str):
+        """Return the stored entry for `key`, fresh or only good for revalidation, or None."""
+        return self._cache.get(key)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def store(self, key: str, response: requests.Response) -> None:
+        """Keep a successful response for as long as its Cache-Control and the policy allow."""
+        if response.status_code != 200:
+            return
+        directives = _cache_control(response.headers)
+        if "no-store" in directives:
+            return
+        if "no-cache" in directives:
+            ttl = 0
+        elif (max_age := directives.get("max-age")) and max_age.isdigit():
+            ttl = int(max_age) if self.policy.max_ttl is None else min(int(max_age), self.policy.max_ttl)
+        else:
+            ttl = self.policy.ttl
+        validators = "ETag" in response.headers or "Last-Modified" in response.headers
+        if ttl <= 0 and not validators:
+            return
+        headers = {name: response.headers[name] for name in _CACHED_HEADERS if name in response.headers}
+        cached = CachedResponse(response.status_code, response.url, headers, response.content)
+        self._cache.set(key, cached, ttl=ttl, stale_ttl=self.policy.revalidate_for if validators else 0)
+
+    def fresh(self, key: str) -> Optional[requests.Response]:
+        """The stored response for `key` while it is fresh, served without a request."""
+        entry = self.lookup(key)
+        if entry is None or not entry.is_fresh(time.time()):
+            return None
+        self._count("hits")
+        return entry.value.to_response()
+
+    def send(self, session: requests.Session, key: str, method: str, url: str, headers: Optional[dict], **kwargs) -> requests.Response:
+        """Send the request, conditional when an expired response is stored, and keep what comes back."""
+        entry = self.lookup(key)
+        headers = dict(headers or {})
+        if entry is not None:
+            if etag := entry.value.headers.get("ETag"):
+                headers["If-None-Match"] = etag
+            if last_modified := entry.value.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = last_modified
+        response = session.request(method, url, headers=headers, **kwargs)
+        if entry is not None and response.status_code == 304:
+            self._count("revalidated")
+            # The 304 may carry a new max-age or validators for the body we already have
+            updated = {name: response.headers[name] for name in _CACHED_HEADERS if name in response.headers}
+            cached = entry.value
+            response = CachedResponse(cached.status_code, cached.url, {**cached.headers, **updated}, cached.content).to_response()
+        else:
+            self._count("misses")
+        self.store(key, response)
+        return response
+
+    def evict(self, method: str, url: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> None:
+        """Drop the stored response of a request, the next one fetches the body again."""
+        self._cache.delete(self.key(method, url, params, headers))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.revalidated) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def cache_stats() -> Dict[str, dict]:
+    """Hit ratio metrics of every response cache."""
+    return {name: cache.stats() for name, cache in response_caches.items()}
+
+
 def _handle_request_exception() -> SimpleNamespace:
     """Handle exceptions during requests and return a namespace object."""
     logger.error("Request failed", exc_info=True)
@@ -88,13 +264,22 @@ def _make_request(
         response_type=SimpleNamespace,
         proxies=None,
         json=None,
-        specific_rate_limiter: Optional[RateLimiter] = None,
-        overall_rate_limiter: Optional[RateLimiter] = None
+        specific_rate_limiter: Optional[RateLimiter | TokenBucket] = None,
+        overall_rate_limiter: Optional[RateLimiter | TokenBucket] = None,
+        cache: Optional[ResponseCache] = None,
+        session: Optional[requests.Session] = None
 ) -> ResponseObject:
-    session = requests.Session()
-    if retry_if_failed:
-        session.mount("http://", _adapter)
-        session.mount("https://", _adapter)
+    cache_key = cache.key(method, url, params, additional_headers) if cache and method == "GET" else None
+    if cache_key and (cached := cache.fresh(cache_key)) is not None:
+        return ResponseObject(cached, response_type)
+
+    # A session handed in by the caller is shared and stays open for its next requests
+    own_session = session is None
+    if own_session:
+        session = requests.Session()
+        if retry_if_failed:
+            session.mount("http://", _adapter)
+            session.mount("https://", _adapter)
 
     specific_context = specific_rate_limiter if specific_rate_limiter else nullcontext()
     overall_context = overall_rate_limiter if overall_rate_limiter else nullcontext()
@@ -102,14 +287,21 @@ def _make_request(
     try:
         with overall_context:
             with specific_context:
-                response = session.request(
-                    method, url, headers=additional_headers, data=data, params=params, timeout=timeout, proxies=proxies, json=json
-                )
+                if cache_key:
+                    response = cache.send(
+                        session, cache_key, method, url, additional_headers,
+                        data=data, params=params, timeout=timeout, proxies=proxies, json=json
+                    )
+                else:
+                    response = session.request(
+                        method, url, headers=additional_headers, data=data, params=params, timeout=timeout, proxies=proxies, json=json
+                    )
     except requests.exceptions.RequestException as e:
         logger.error(f"Request failed: {e}", exc_info=True)
         response = _handle_request_exception()
     finally:
-        session.close()
+        if own_session:
+            session.close()
 
     return ResponseObject(response, response_type)
 
@@ -142,10 +334,13 @@ def get(
         response_type=SimpleNamespace,
         proxies=None,
         json=None,
-        specific_rate_limiter: Optional[RateLimiter] = None,
-        overall_rate_limiter: Optional[RateLimiter] = None
+        specific_rate_limiter: Optional[RateLimiter | TokenBucket] = None,
+        overall_rate_limiter: Optional[RateLimiter | TokenBucket] = None,
+        cache: Optional[ResponseCache] = None,
+        session: Optional[requests.Session] = None
 ) -> ResponseObject:
-    """Requests get wrapper"""
+    """Requests get wrapper, `cache` opts in to serving the response from a ResponseCache
+    and `session` reuses the connections of a shared session"""
     return _make_request(
         "GET",
         url,
@@ -158,7 +353,9 @@ def get(
         proxies=proxies,
         json=json,
         specific_rate_limiter=specific_rate_limiter,
-        overall_rate_limiter=overall_rate_limiter
+        overall_rate_limiter=overall_rate_limiter,
+        cache=cache,
+        session=session
     )
 
 